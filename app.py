@@ -1,15 +1,29 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
-from config import DATABASE_URL
-from models import db, KiteUser, ScheduledOrder, ScheduledOrderLog, ScheduledOrderBulkAudit, Admin
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, flash, session, g, send_from_directory
+from config import DATABASE_URL, APP_MODE, PROFILE_DIR
+from models import db, KiteUser, ScheduledOrder, ScheduledOrderLog, ScheduledOrderBulkAudit, Admin, RecurringSchedule
+from baskets import BasketError, basket_statuses, create_basket, parse_legs
+from recurring import RecurringScheduleError, WEEKDAY_NAMES, parse_schedule, next_occurrence, require_calendar
+from trigger_orders import TriggerError, parse_trigger
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
-from scheduler import start_scheduler, place_order
-from kiteconnect import KiteConnect
-from sqlalchemy import create_engine
+import clock
+import fragment_cache
+import kite_sessions
+import log_export
+import profiling
+import query_stats
+import scheduler as scheduler_module
+from scheduler import start_scheduler, place_order, wake_dispatcher
+from heartbeat import HeartbeatReader, assess
+from http_cache import cached_json
+from order_actions import OrderFilterError, parse_filters, cancel_pending_orders, reschedule_pending_orders
+from kite_client import get_kiteconnect_class
+from sqlalchemy import create_engine, func, case
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import IntegrityError
 from functools import wraps
 import os
+import signal
+import threading
 
 # Allowed stock list (symbol -> metadata)
 ALLOWED_STOCKS = [
@@ -59,38 +73,44 @@ ALLOWED_STOCKS = [
 ALLOWED_SYMBOLS = {s["symbol"] for s in ALLOWED_STOCKS}
 
 
-def create_app():
+APP_MODES = ('all', 'web', 'scheduler', 'cli')
+
+
+def create_app(mode: str = None):
+    """Build the Flask app.
+
+    ``mode`` (or the APP_MODE env var) decides the side effects of startup: only
+    ``all`` runs migrations, and only ``all``/``scheduler`` start the background
+    scheduler. ``web`` and ``cli`` do neither and never touch the database here.
+    """
+    mode = (mode or APP_MODE or 'all').lower()
+    if mode not in APP_MODES:
+        raise ValueError(f"Unknown app mode {mode!r}; expected one of {', '.join(APP_MODES)}")
+
     app = Flask(__name__, 
                 template_folder=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
     app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret')
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['KITE_CALLBACK_URL'] = os.environ.get('KITE_CALLBACK_URL', 'http://localhost:5000/kite/callback')
+    app.config['APP_MODE'] = mode
+    app.add_template_filter(clock.format_ist, 'ist')
     db.init_app(app)
 
-    # create DB
-    with app.app_context():
-        db.create_all()
-        
-        # Auto-create default admin from env vars if not exists
-        from config import DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_PASSWORD
-        if DEFAULT_ADMIN_USERNAME and DEFAULT_ADMIN_PASSWORD:
-            existing = Admin.query.filter_by(
-                username=DEFAULT_ADMIN_USERNAME
-            ).first()
-            if not existing:
-                admin = Admin(username=DEFAULT_ADMIN_USERNAME)
-                admin.set_password(DEFAULT_ADMIN_PASSWORD)
-                db.session.add(admin)
-                db.session.commit()
-                print(f"[INFO] Default admin '{DEFAULT_ADMIN_USERNAME}' created from environment variables")
-
     # session maker for scheduler
     engine = create_engine(DATABASE_URL, echo=False)
     Session = sessionmaker(bind=engine)
 
-    # start scheduler
-    start_scheduler(app, Session)
+    if mode == 'all':
+        # Local development convenience: bring the schema up to date on boot.
+        # Deployments run `python manage_admins.py migrate` as a separate step.
+        from migrations import upgrade, bootstrap_default_admin
+        upgrade(engine)
+        with app.app_context():
+            bootstrap_default_admin()
+
+    if mode in ('all', 'scheduler'):
+        app.extensions['order_scheduler'] = start_scheduler(app, Session)
 
     # Admin session protection decorator
     def admin_required(f):
@@ -102,6 +122,27 @@ def create_app():
             return f(*args, **kwargs)
         return decorated_function
 
+    # SQL query counts/time per request; Server-Timing header in debug mode
+    query_stats.init_app(app)
+
+    # Per-request stack sampling for admins: send `X-Profile: <name>` with the request
+    @app.before_request
+    def _start_request_profile():
+        name = request.headers.get('X-Profile')
+        if name and 'admin_id' in session:
+            capture = profiling.Capture(f'request-{name}', profiling.MAX_CAPTURE_SECONDS,
+                                        thread_ids=[threading.get_ident()])
+            capture.start()
+            g.profile_capture = capture
+
+    @app.after_request
+    def _finish_request_profile(response):
+        capture = g.pop('profile_capture', None)
+        if capture is not None:
+            path = capture.finish()
+            response.headers['X-Profile-Output'] = os.path.basename(path)
+        return response
+
     # Admin login route
     @app.route('/admin/login', methods=['GET', 'POST'])
     def admin_login():
@@ -194,8 +235,7 @@ def create_app():
 
     @app.route('/users', methods=['GET'])
     def list_users():
-        users = KiteUser.query.all()
-        return jsonify([u.to_dict() for u in users])
+        return cached_json('users', ('users',), lambda: [u.to_dict() for u in KiteUser.query.all()])
 
 
     @app.route('/orders', methods=['POST'])
@@ -206,13 +246,22 @@ def create_app():
         quantity = data.get('quantity')
         order_type = data.get('order_type')
         scheduled_time = data.get('scheduled_time')
-
-        if not all([user_id, stock_symbol, quantity, order_type, scheduled_time]):
-            return jsonify({"error": "user_id, stock_symbol, quantity, order_type, scheduled_time required"}), 400
         try:
-            dt = datetime.fromisoformat(scheduled_time)
-        except Exception:
-            return jsonify({"error": "scheduled_time must be ISO format"}), 400
+            trigger_price, trigger_direction = parse_trigger(data)
+        except TriggerError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not all([user_id, stock_symbol, quantity, order_type, scheduled_time or trigger_price]):
+            return jsonify({"error": "user_id, stock_symbol, quantity, order_type and scheduled_time "
+                                     "or trigger_price required"}), 400
+        if trigger_price is not None:
+            # armed until the trigger engine releases it; scheduled_time is reset when it fires
+            dt = clock.now_ist()
+        else:
+            try:
+                dt = datetime.fromisoformat(scheduled_time)
+            except Exception:
+                return jsonify({"error": "scheduled_time must be ISO format"}), 400
 
         order = ScheduledOrder(
             user_id=user_id,
@@ -220,6 +269,9 @@ def create_app():
             quantity=int(quantity),
             order_type=order_type.lower(),
             scheduled_time=dt,
+            status='armed' if trigger_price is not None else 'pending',
+            trigger_price=trigger_price,
+            trigger_direction=trigger_direction,
         )
         db.session.add(order)
         db.session.commit()
@@ -228,9 +280,171 @@ def create_app():
 
     @app.route('/orders', methods=['GET'])
     def list_orders():
-        orders = ScheduledOrder.query.order_by(ScheduledOrder.scheduled_time.asc()).all()
-        return jsonify([o.to_dict() for o in orders])
+        return cached_json('orders', ('orders',), lambda: [
+            o.to_dict() for o in ScheduledOrder.query.order_by(ScheduledOrder.scheduled_time.asc()).all()
+        ])
+
+    def _parse_reschedule_target(data):
+        """Return (new_time, shift) from 'scheduled_time' (ISO) or 'shift_seconds'."""
+        scheduled_time = data.get('scheduled_time')
+        shift_seconds = data.get('shift_seconds')
+        if scheduled_time and shift_seconds not in (None, ''):
+            raise OrderFilterError('provide either scheduled_time or shift_seconds, not both')
+        if scheduled_time:
+            try:
+                new_time = datetime.fromisoformat(scheduled_time)
+            except ValueError:
+                raise OrderFilterError('scheduled_time must be ISO format')
+            if new_time <= clock.now_ist():
+                raise OrderFilterError('Cannot reschedule orders into the past')
+            return new_time, None
+        if shift_seconds not in (None, ''):
+            try:
+                return None, timedelta(seconds=int(shift_seconds))
+            except (TypeError, ValueError):
+                raise OrderFilterError('shift_seconds must be an integer')
+        raise OrderFilterError('scheduled_time or shift_seconds required')
+
+    @app.route('/orders/cancel', methods=['POST'])
+    @admin_required
+    def cancel_orders():
+        data = request.json or {}
+        try:
+            filters = parse_filters(data)
+        except OrderFilterError as e:
+            return jsonify({"error": str(e)}), 400
+        ids = cancel_pending_orders(db.session, filters, reason=data.get('reason'))
+        wake_dispatcher()
+        return jsonify({"cancelled": len(ids), "order_ids": ids})
+
+    @app.route('/orders/reschedule', methods=['POST'])
+    @admin_required
+    def reschedule_orders():
+        data = request.json or {}
+        try:
+            filters = parse_filters(data)
+            new_time, shift = _parse_reschedule_target(data)
+            ids = reschedule_pending_orders(db.session, filters, new_time=new_time, shift=shift)
+        except OrderFilterError as e:
+            return jsonify({"error": str(e)}), 400
+        wake_dispatcher()
+        return jsonify({"rescheduled": len(ids), "order_ids": ids})
     
+    @app.route('/orders/fairness', methods=['GET'])
+    def dispatch_fairness():
+        """Per-user dispatch positions across bursts, normalised by burst size (0 = first, 1 = last)."""
+        burst_sizes = db.session.query(
+            ScheduledOrder.scheduled_time.label('scheduled_time'),
+            func.count(ScheduledOrder.id).label('size'),
+        ).filter(ScheduledOrder.dispatch_position.isnot(None)).group_by(ScheduledOrder.scheduled_time).subquery()
+        query = db.session.query(
+            ScheduledOrder.user_id,
+            func.count(ScheduledOrder.id),
+            func.avg(ScheduledOrder.dispatch_position),
+            func.avg(ScheduledOrder.dispatch_position * 1.0 / case((burst_sizes.c.size > 1, burst_sizes.c.size - 1), else_=1)),
+        ).join(burst_sizes, burst_sizes.c.scheduled_time == ScheduledOrder.scheduled_time).filter(
+            ScheduledOrder.dispatch_position.isnot(None),
+        )
+        bulk_audit_id = request.args.get('bulk_audit_id', type=int)
+        if bulk_audit_id:
+            query = query.filter(ScheduledOrder.bulk_audit_id == bulk_audit_id)
+        user_id = request.args.get('user_id', type=int)
+        if user_id:
+            query = query.filter(ScheduledOrder.user_id == user_id)
+        rows = query.group_by(ScheduledOrder.user_id).order_by(ScheduledOrder.user_id).all()
+        return jsonify([
+            {
+                "user_id": uid,
+                "bursts": count,
+                "mean_position": round(float(mean_pos), 2),
+                "mean_relative_position": round(float(mean_rel), 4),
+            }
+            for uid, count, mean_pos, mean_rel in rows
+        ])
+
+    def _parse_basket_users(value):
+        if isinstance(value, str):
+            value = [u for u in value.split(',') if u.strip()]
+        try:
+            return sorted({int(u) for u in (value or [])})
+        except (TypeError, ValueError):
+            raise BasketError('user_ids must be integers')
+
+    @app.route('/baskets', methods=['POST'])
+    @admin_required
+    def create_basket_schedule():
+        data = request.json or {}
+        try:
+            legs = parse_legs(data.get('legs'), ALLOWED_SYMBOLS)
+            user_ids = _parse_basket_users(data.get('user_ids'))
+            try:
+                scheduled_time = datetime.fromisoformat(data.get('scheduled_time') or '')
+                priority = int(data.get('priority') or 0)
+            except (TypeError, ValueError):
+                raise BasketError('scheduled_time must be ISO format and priority an integer')
+        except BasketError as e:
+            return jsonify({"error": str(e)}), 400
+        if scheduled_time <= clock.now_ist():
+            return jsonify({"error": "Cannot schedule orders in the past"}), 400
+        audit_id, created = create_basket(
+            db.session, legs, scheduled_time, priority=priority, user_ids=user_ids, initiator=data.get('initiator'),
+        )
+        if not created:
+            db.session.rollback()
+            return jsonify({"error": "No users available to schedule orders for"}), 400
+        db.session.commit()
+        wake_dispatcher()
+        return jsonify({"bulk_audit_id": audit_id, "legs": legs, "users_created": created}), 201
+
+    @app.route('/baskets/<int:audit_id>', methods=['GET'])
+    def basket_status(audit_id):
+        audit = ScheduledOrderBulkAudit.query.get(audit_id)
+        if not audit or audit.kind != 'basket':
+            return jsonify({"error": "basket not found"}), 404
+        result = audit.to_dict()
+        result.update(basket_statuses(db.session, [audit_id])[audit_id])
+        return jsonify(result)
+
+    @app.route('/recurring', methods=['GET'])
+    def list_recurring():
+        now_ist = clock.now_ist()
+        result = []
+        for schedule in RecurringSchedule.query.order_by(RecurringSchedule.id).all():
+            item = schedule.to_dict()
+            upcoming = next_occurrence(schedule, now_ist) if schedule.active else None
+            item['next_occurrence'] = upcoming.isoformat() if upcoming else None
+            result.append(item)
+        return jsonify(result)
+
+    @app.route('/recurring', methods=['POST'])
+    @admin_required
+    def create_recurring():
+        try:
+            values = parse_schedule(request.json or {}, ALLOWED_SYMBOLS)
+            require_calendar(clock.now_ist().year)
+        except RecurringScheduleError as e:
+            return jsonify({"error": str(e)}), 400
+        schedule = RecurringSchedule(**values)
+        db.session.add(schedule)
+        db.session.commit()
+        return jsonify(schedule.to_dict()), 201
+
+    @app.route('/recurring/<int:schedule_id>/active', methods=['POST'])
+    @admin_required
+    def set_recurring_active(schedule_id):
+        schedule = RecurringSchedule.query.get(schedule_id)
+        if not schedule:
+            return jsonify({"error": "recurring schedule not found"}), 404
+        active = bool((request.json or {}).get('active'))
+        if active:
+            try:
+                require_calendar(clock.now_ist().year)
+            except RecurringScheduleError as e:
+                return jsonify({"error": str(e)}), 400
+        schedule.active = active
+        db.session.commit()
+        return jsonify(schedule.to_dict())
+
     @app.route('/')
     def index():
         return redirect(url_for('dashboard'))
@@ -240,48 +454,58 @@ def create_app():
     @app.route('/dashboard')
     @admin_required
     def dashboard():
-        users = KiteUser.query.order_by(KiteUser.created_at.desc()).all()
-        orders = ScheduledOrder.query.order_by(ScheduledOrder.scheduled_time.asc()).all()
-        ist = ZoneInfo('Asia/Kolkata')
-        now = datetime.now(ist).replace(tzinfo=None)
+        now_utc = clock.utcnow()
+        tags = fragment_cache.version_tags(db.session, ('users', 'orders', 'logs'))
 
-        # Attach an IST-formatted expiry string to each user for display
-        for u in users:
-            u.token_expiry_ist = None
-            if u.token_expiry:
-                try:
-                    # token_expiry is stored as naive UTC; treat it as UTC then convert
-                    dt_utc = u.token_expiry.replace(tzinfo=ZoneInfo('UTC'))
-                    dt_ist = dt_utc.astimezone(ist)
-                    u.token_expiry_ist = dt_ist.strftime('%Y-%m-%d %H:%M:%S %Z')
-                except Exception:
-                    u.token_expiry_ist = None
+        def load_users():
+            users = KiteUser.query.order_by(KiteUser.created_at.desc()).all()
+            # the Active/Expired badges change when the next token expires
+            expiries = [u.token_expiry for u in users if u.access_token and u.token_expiry and u.token_expiry > now_utc]
+            return {'users': users, 'now_utc': now_utc}, min(expiries, default=None)
 
-        # fetch recent logs for display
-        logs = ScheduledOrderLog.query.order_by(ScheduledOrderLog.created_at.desc()).limit(50).all()
-        for log_entry in logs:
-            try:
-                dt_utc = log_entry.created_at.replace(tzinfo=ZoneInfo('UTC'))
-                dt_ist = dt_utc.astimezone(ZoneInfo('Asia/Kolkata'))
-                log_entry.created_at_ist = dt_ist.strftime('%Y-%m-%d %H:%M:%S %Z')
-            except Exception:
-                log_entry.created_at_ist = None
+        def load_api_keys():
+            return {'users': KiteUser.query.order_by(KiteUser.created_at.desc()).all()}, None
+
+        def load_orders():
+            return {'orders': ScheduledOrder.query.order_by(ScheduledOrder.scheduled_time.asc()).all()}, None
+
+        def load_logs():
+            return {'logs': ScheduledOrderLog.query.order_by(ScheduledOrderLog.created_at.desc()).limit(50).all()}, None
+
+        users_table = fragment_cache.render_cached(
+            'dashboard:users', tags['users'], '_users_table.html', load_users, now_utc)
+        api_key_previews = fragment_cache.render_cached(
+            'dashboard:api_keys', tags['users'], '_api_key_previews.html', load_api_keys, now_utc)
+        orders_table = fragment_cache.render_cached(
+            'dashboard:orders', tags['orders'], '_orders_table.html', load_orders, now_utc)
+        recent_logs = fragment_cache.render_cached(
+            'dashboard:logs', tags['logs'], '_recent_logs.html', load_logs, now_utc)
+
+        bulk_audits = ScheduledOrderBulkAudit.query.order_by(ScheduledOrderBulkAudit.created_at.desc()).limit(20).all()
+        recurring_schedules = RecurringSchedule.query.order_by(RecurringSchedule.id).all()
+        baskets = [a for a in bulk_audits if a.kind == 'basket']
+        statuses = basket_statuses(db.session, [a.id for a in baskets])
+        for basket in baskets:
+            basket.summary = statuses[basket.id]
 
         return render_template(
             'dashboard.html',
-            users=users,
-            orders=orders,
-            logs=logs,
-            now=now,
+            users_table=users_table,
+            api_key_previews=api_key_previews,
+            orders_table=orders_table,
+            recent_logs=recent_logs,
+            bulk_audits=bulk_audits,
+            recurring_schedules=recurring_schedules,
+            baskets=baskets,
+            weekday_names=WEEKDAY_NAMES,
             allowed_stocks=ALLOWED_STOCKS,
         )
 
     @app.route('/dashboard/user/<int:user_id>')
     def user_profile(user_id: int):
         user = KiteUser.query.get_or_404(user_id)
-        ist = ZoneInfo('Asia/Kolkata')
-        now = datetime.now(ist).replace(tzinfo=None)
-        return render_template('user_profile.html', user=user, now=now)
+        # token_expiry is naive UTC
+        return render_template('user_profile.html', user=user, now=clock.utcnow())
 
     @app.route('/dashboard/user/<int:user_id>/update', methods=['POST'])
     def update_user(user_id: int):
@@ -295,6 +519,14 @@ def create_app():
             user.access_token = None
             user.token_expiry = None
         
+        dispatch_priority = request.form.get('dispatch_priority')
+        if dispatch_priority not in (None, ''):
+            try:
+                user.dispatch_priority = int(dispatch_priority)
+            except ValueError:
+                flash('Dispatch priority must be an integer', 'error')
+                return redirect(url_for('user_profile', user_id=user_id))
+
         # Update API Secret if provided
         api_secret = request.form.get('api_secret')
         if api_secret:
@@ -322,64 +554,70 @@ def create_app():
         page = request.args.get('page', 1, type=int)
         if page < 1:
             page = 1
+        filter_args = tuple(request.args.get(name, '') for name in ('user_id', 'scheduled_order_id', 'status', 'q'))
 
-        query = ScheduledOrderLog.query.order_by(
-            ScheduledOrderLog.created_at.desc()
-        )
-        user_id = request.args.get('user_id')
-        soid = request.args.get('scheduled_order_id')
-        status = request.args.get('status')
-        q = request.args.get('q')
-        if user_id:
-            try:
-                uid = int(user_id)
-                query = query.filter(ScheduledOrderLog.user_id == uid)
-            except Exception:
-                pass
-        if soid:
-            try:
-                sid = int(soid)
-                query = query.filter(ScheduledOrderLog.scheduled_order_id == sid)
-            except Exception:
-                pass
-        if status:
-            query = query.filter(
-                ScheduledOrderLog.status.ilike(f"%{status}%")
-            )
-        if q:
-            query = query.filter(
-                ScheduledOrderLog.message.ilike(f"%{q}%")
+        def load_page():
+            current_page = page
+            query = ScheduledOrderLog.query.order_by(
+                ScheduledOrderLog.created_at.desc()
             )
+            user_id, soid, status, q = filter_args
+            if user_id:
+                try:
+                    uid = int(user_id)
+                    query = query.filter(ScheduledOrderLog.user_id == uid)
+                except Exception:
+                    pass
+            if soid:
+                try:
+                    sid = int(soid)
+                    query = query.filter(ScheduledOrderLog.scheduled_order_id == sid)
+                except Exception:
+                    pass
+            if status:
+                query = query.filter(
+                    ScheduledOrderLog.status.ilike(f"%{status}%")
+                )
+            if q:
+                query = query.filter(
+                    ScheduledOrderLog.message.ilike(f"%{q}%")
+                )
 
-        total_count = query.count()
-        total_pages = (total_count + per_page - 1) // per_page
-        if page > total_pages and total_pages > 0:
-            page = total_pages
+            total_count = query.count()
+            total_pages = (total_count + per_page - 1) // per_page
+            if current_page > total_pages and total_pages > 0:
+                current_page = total_pages
 
-        logs = query.offset((page - 1) * per_page).limit(per_page).all()
-        # attach IST formatted created time
-        ist = ZoneInfo('Asia/Kolkata')
-        for entry in logs:
-            try:
-                dt_utc = entry.created_at.replace(tzinfo=ZoneInfo('UTC'))
-                dt_ist = dt_utc.astimezone(ist)
-                entry.created_at_ist = dt_ist.strftime(
-                    '%Y-%m-%d %H:%M:%S %Z'
-                )
-            except Exception:
-                entry.created_at_ist = None
+            logs = query.offset((current_page - 1) * per_page).limit(per_page).all()
+            page_range = range(
+                max(1, current_page - 2), min(total_pages + 1, current_page + 3)
+            )
+            return {
+                'logs': logs,
+                'current_page': current_page,
+                'total_pages': total_pages,
+                'page_range': page_range,
+            }, None
 
-        page_range = range(
-            max(1, page - 2), min(total_pages + 1, page + 3)
-        )
+        tag = fragment_cache.version_tags(db.session, ('logs',))['logs']
+        logs_table = fragment_cache.render_cached(
+            ('logs', page) + filter_args, tag, '_logs_table.html', load_page, clock.utcnow())
+        return render_template('logs.html', logs_table=logs_table)
 
-        return render_template(
-            'logs.html',
-            logs=logs,
-            current_page=page,
-            total_pages=total_pages,
-            page_range=page_range,
-        )
+    @app.route('/logs/export')
+    @admin_required
+    def logs_export():
+        # date or from/to (IST), user_id, status (comma-separated), format=csv|ndjson
+        try:
+            filters = log_export.parse_export_args(request.args)
+        except log_export.ExportFilterError as e:
+            return jsonify({"error": str(e)}), 400
+        # the generator outlives the app context, so bind the engine now
+        body = log_export.stream_export(db.engine, filters)
+        response = Response(body, mimetype='application/gzip', direct_passthrough=True)
+        response.headers['Content-Disposition'] = f'attachment; filename={log_export.export_filename(filters)}'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
 
     @app.route('/dashboard/users/create', methods=['POST'])
     def dashboard_create_user():
@@ -413,7 +651,6 @@ def create_app():
         session['kite_login_user_id'] = user_id
         
         # Create login URL
-        kite = KiteConnect(api_key=user.api_key)
         login_url = f"https://kite.zerodha.com/connect/login?api_key={user.api_key}&v=3"
         return redirect(login_url)
 
@@ -435,46 +672,27 @@ def create_app():
             return redirect(url_for('dashboard'))
 
         try:
-            # Exchange request token for access token
+            # Exchange request token for access token; the one broker call left on this path
+            KiteConnect = get_kiteconnect_class()
+            if KiteConnect is None:
+                raise RuntimeError('kiteconnect package is not installed')
             kite = KiteConnect(api_key=user.api_key)
             data = kite.generate_session(request_token, api_secret=user.api_secret)
             access_token = data.get('access_token')
-            
+
             if access_token:
-                # Get user profile from Kite
-                kite.set_access_token(access_token)
-                profile = kite.profile()
-                
-                # Calculate token expiry as next 06:00 IST, and store as UTC naive datetime
-                ist = ZoneInfo('Asia/Kolkata')
-                now_ist = datetime.now(tz=ist)
-                expiry_ist = now_ist.replace(hour=6, minute=0, second=0, microsecond=0)
-                if now_ist.hour >= 6:
-                    expiry_ist = expiry_ist + timedelta(days=1)
-                # convert to UTC and store as naive UTC datetime for comparison with utcnow()
-                expiry_utc = expiry_ist.astimezone(ZoneInfo('UTC')).replace(tzinfo=None)
-                expiry = expiry_utc
-                
-                # Update user with profile data
+                now_ist = clock.now_ist()
                 user.access_token = access_token
-                user.token_expiry = expiry
-                user.token_set_at = datetime.now(ist).replace(tzinfo=None)
-                user.user_id = str(profile.get('user_id'))
-                user.email = profile.get('email')
-                user.user_name = profile.get('user_name')
-                user.user_shortname = profile.get('user_shortname')
-                user.broker = profile.get('broker')
-                user.exchanges = ','.join(profile.get('exchanges', []))
-                user.products = ','.join(profile.get('products', []))
-                user.order_types = ','.join(profile.get('order_types', []))
-                user.avatar_url = profile.get('avatar_url')
-                
-                db.session.add(user)
+                user.token_expiry = kite_sessions.token_expiry(now_ist)
+                user.token_set_at = now_ist
                 db.session.commit()
+                # profile fields are copied in the background (batched with other logins)
+                kite_sessions.hydrator.enqueue(db.engine, user.id, user.api_key, access_token, data)
                 flash('Successfully logged in to Kite', 'success')
             else:
                 flash('No access token received', 'error')
         except Exception as e:
+            db.session.rollback()
             flash(f'Failed to get access token: {str(e)}', 'error')
         
         return redirect(url_for('dashboard'))
@@ -486,6 +704,7 @@ def create_app():
             stock_symbol = request.form.get('stock_symbol')
             quantity = int(request.form.get('quantity'))
             order_type = request.form.get('order_type')
+            priority = int(request.form.get('priority') or 0)
             scheduled_time = request.form.get('scheduled_time')  # HH:MM:SS (time-only with seconds)
 
             # Validate stock symbol is allowed
@@ -498,8 +717,7 @@ def create_app():
                 return redirect(url_for('dashboard'))
 
             # Parse time (HH:MM:SS) and build datetime in IST
-            ist = ZoneInfo('Asia/Kolkata')
-            now_ist = datetime.now(ist)
+            now_ist = clock.now_ist()
             time_parts = scheduled_time.split(':')
             hh = int(time_parts[0])
             mm = int(time_parts[1])
@@ -537,6 +755,7 @@ def create_app():
             quantity=quantity,
             order_type=(order_type or '').lower(),
             scheduled_time=dt,
+            priority=priority,
         )
         db.session.add(audit)
         db.session.flush()
@@ -545,7 +764,7 @@ def create_app():
         users = KiteUser.query.filter(
             KiteUser.access_token.isnot(None),
             KiteUser.token_expiry.isnot(None),
-            KiteUser.token_expiry > datetime.now(ZoneInfo('UTC')).replace(tzinfo=None),
+            KiteUser.token_expiry > clock.utcnow(),
         ).all()
         audit.users_targeted = len(users)
         db.session.add(audit)
@@ -562,6 +781,8 @@ def create_app():
                 quantity=quantity,
                 order_type=(order_type or '').lower(),
                 scheduled_time=dt,
+                bulk_audit_id=audit.id,
+                priority=priority,
             )
             db.session.add(order)
             db.session.flush()  # ensure order.id is populated
@@ -585,21 +806,212 @@ def create_app():
         return redirect(url_for('dashboard'))
 
 
+    @app.route('/dashboard/baskets/create', methods=['POST'])
+    @admin_required
+    def dashboard_create_basket():
+        try:
+            legs = parse_legs(request.form.get('legs') or '', ALLOWED_SYMBOLS)
+            priority = int(request.form.get('priority') or 0)
+            hh, mm, *rest = (int(part) for part in (request.form.get('scheduled_time') or '').split(':'))
+            now_ist = clock.now_ist()
+            dt = now_ist.replace(hour=hh, minute=mm, second=rest[0] if rest else 0, microsecond=0)
+        except BasketError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('dashboard'))
+        except (TypeError, ValueError):
+            flash('Invalid basket input: scheduled_time must be HH:MM[:SS] and priority an integer', 'error')
+            return redirect(url_for('dashboard'))
+        if dt <= now_ist:
+            flash('Cannot schedule orders in the past', 'error')
+            return redirect(url_for('dashboard'))
+        if not (9.5 <= hh + mm / 60 + dt.second / 3600 <= 15.5):
+            flash('Orders can only be scheduled between 09:30 and 15:30', 'error')
+            return redirect(url_for('dashboard'))
+
+        audit_id, created = create_basket(db.session, legs, dt, priority=priority)
+        if not created:
+            db.session.rollback()
+            flash('No users available to schedule orders for', 'error')
+            return redirect(url_for('dashboard'))
+        db.session.commit()
+        wake_dispatcher()
+        flash(f'{len(legs)}-leg basket #{audit_id} scheduled for {created} users', 'success')
+        return redirect(url_for('dashboard'))
+
+    @app.route('/dashboard/recurring/create', methods=['POST'])
+    @admin_required
+    def dashboard_create_recurring():
+        data = request.form.to_dict()
+        data['weekdays'] = request.form.getlist('weekdays')
+        try:
+            values = parse_schedule(data, ALLOWED_SYMBOLS)
+            require_calendar(clock.now_ist().year)
+        except RecurringScheduleError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('dashboard'))
+        schedule = RecurringSchedule(**values)
+        db.session.add(schedule)
+        db.session.commit()
+        flash('Recurring schedule created', 'success')
+        return redirect(url_for('dashboard'))
+
+    @app.route('/dashboard/recurring/<int:schedule_id>/toggle', methods=['POST'])
+    @admin_required
+    def dashboard_toggle_recurring(schedule_id):
+        schedule = RecurringSchedule.query.get_or_404(schedule_id)
+        if not schedule.active:
+            try:
+                require_calendar(clock.now_ist().year)
+            except RecurringScheduleError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('dashboard'))
+        schedule.active = not schedule.active
+        db.session.commit()
+        flash(f"Recurring schedule {'resumed' if schedule.active else 'paused'}", 'success')
+        return redirect(url_for('dashboard'))
+
+    @app.route('/dashboard/orders/bulk-action', methods=['POST'])
+    @admin_required
+    def dashboard_bulk_order_action():
+        action = request.form.get('action')
+        form = {k: v for k, v in request.form.items() if v}
+        try:
+            filters = parse_filters(form)
+            if action == 'cancel':
+                ids = cancel_pending_orders(db.session, filters, reason='Cancelled from dashboard')
+                flash(f'Cancelled {len(ids)} pending orders', 'success')
+            elif action == 'reschedule':
+                new_time, shift = _parse_reschedule_target(form)
+                ids = reschedule_pending_orders(db.session, filters, new_time=new_time, shift=shift)
+                flash(f'Rescheduled {len(ids)} pending orders', 'success')
+            else:
+                flash('Unknown bulk action', 'error')
+                return redirect(url_for('dashboard'))
+        except OrderFilterError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('dashboard'))
+        wake_dispatcher()
+        return redirect(url_for('dashboard'))
+
     # Health check
+    heartbeat_reader = HeartbeatReader()
+
+    def _scheduler_state():
+        """Heartbeat assessment from this process's scheduler, or the published file."""
+        if 'order_scheduler' in app.extensions:
+            snapshot = scheduler_module.heartbeat.snapshot()
+        else:
+            snapshot = heartbeat_reader.read()
+        return assess(snapshot, now_ist=clock.now_ist())
+
+    # Health check (liveness): never touches the database
     @app.route('/health')
     def health_check():
-        status = {'status': 'ok'}
+        state = _scheduler_state()
+        return jsonify({
+            'status': 'ok',
+            'scheduler': 'ok' if state['ready'] else 'degraded',
+            'reasons': state['reasons'],
+            'heartbeat_age_seconds': state['heartbeat_age_seconds'],
+            'pending_orders': (state['scheduler'] or {}).get('pending'),
+            'in_flight_orders': (state['scheduler'] or {}).get('in_flight'),
+            'next_deadline': (state['scheduler'] or {}).get('next_deadline'),
+        })
+
+    # Readiness: 503 when the dispatcher heartbeat is stale or orders are overdue
+    @app.route('/ready')
+    def readiness_check():
+        state = _scheduler_state()
+        return jsonify(state), (200 if state['ready'] else 503)
+
+
+    @app.route('/admin/profiling', methods=['GET'])
+    @admin_required
+    def profiling_status():
         try:
-            # quick DB ping
-            db.session.execute('SELECT 1')
-            pending = ScheduledOrder.query.filter(ScheduledOrder.status == 'pending').count()
-            status['db'] = 'ok'
-            status['pending_orders'] = pending
-        except Exception as e:
-            status['db'] = 'error'
-            status['error'] = str(e)
-        return jsonify(status)
+            files = sorted(os.listdir(PROFILE_DIR))
+        except FileNotFoundError:
+            files = []
+        capture = profiling.active()
+        return jsonify({'active': capture.name if capture else None, 'files': files})
+
+    @app.route('/admin/profiling', methods=['POST'])
+    @admin_required
+    def profiling_request():
+        """Start/stop a capture in the scheduler: {action, name, seconds, start_at (IST ISO)}."""
+        data = request.json or request.form.to_dict()
+        action = data.get('action') or 'start'
+        if action not in ('start', 'stop'):
+            return jsonify({"error": "action must be start or stop"}), 400
+        try:
+            seconds = float(data.get('seconds') or profiling.PROFILE_DEFAULT_SECONDS)
+            if data.get('start_at'):
+                datetime.fromisoformat(data['start_at'])
+        except (TypeError, ValueError):
+            return jsonify({"error": "seconds must be a number and start_at ISO format"}), 400
+        req = {'action': action, 'name': profiling.safe_name(data.get('name') or 'burst'),
+               'seconds': seconds, 'start_at': data.get('start_at')}
+        profiling.control.write(req)
+
+        delivered = 'file'
+        if 'order_scheduler' in app.extensions:
+            profiling.control.apply()
+            delivered = 'in-process'
+        else:
+            pid = (heartbeat_reader.read() or {}).get('pid')
+            if pid and hasattr(signal, 'SIGUSR2'):
+                try:
+                    os.kill(pid, signal.SIGUSR2)
+                    delivered = 'signal'
+                except OSError:
+                    pass
+        # 'file' means the scheduler picks the request up on its next poll
+        return jsonify({'request': req, 'delivered': delivered}), 202
+
+    @app.route('/admin/profiling/<path:filename>', methods=['GET'])
+    @admin_required
+    def profiling_download(filename):
+        return send_from_directory(PROFILE_DIR, filename, as_attachment=True)
 
+    token_revalidation = {'running': False, 'started_at': None, 'finished_at': None, 'counts': None}
+    token_revalidation_lock = threading.Lock()
+
+    def _revalidate_tokens_in_background():
+        try:
+            counts = kite_sessions.revalidate_tokens(db.engine)
+        except Exception:
+            app.logger.exception('Token re-validation failed')
+            counts = None
+        with token_revalidation_lock:
+            token_revalidation.update(running=False, finished_at=clock.now_ist().isoformat(),
+                                      counts=dict(counts) if counts is not None else None)
+
+    @app.route('/admin/tokens/revalidate', methods=['GET'])
+    @admin_required
+    def token_revalidation_status():
+        with token_revalidation_lock:
+            return jsonify(token_revalidation)
+
+    @app.route('/admin/tokens/revalidate', methods=['POST'])
+    @admin_required
+    def token_revalidation_start():
+        """Check every stored token in parallel in the background; poll GET for the result."""
+        with token_revalidation_lock:
+            if token_revalidation['running']:
+                return jsonify(token_revalidation), 409
+            token_revalidation.update(running=True, started_at=clock.now_ist().isoformat(),
+                                      finished_at=None, counts=None)
+        threading.Thread(target=_revalidate_tokens_in_background, name='token-revalidation', daemon=True).start()
+        return jsonify(token_revalidation), 202
+
+    @app.route('/admin/query-stats', methods=['GET'])
+    @admin_required
+    def query_stats_summary():
+        """SQL totals per endpoint in this process, and per scheduler job from the heartbeat."""
+        return jsonify({
+            'process': query_stats.aggregates.snapshot(),
+            'scheduler': (heartbeat_reader.read() or {}).get('query_stats'),
+        })
 
     @app.route('/orders/<int:order_id>/place', methods=['POST'])
     def place_order_now(order_id):
@@ -620,5 +1032,5 @@ def create_app():
 
 
 if __name__ == '__main__':
-    app = create_app()
+    app = create_app(mode='all')
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,185 @@
+"""Basket schedules: several legs on one bulk schedule, dispatched per user as a unit.
+
+A basket is a ScheduledOrderBulkAudit with ``kind='basket'`` and one
+ScheduledOrder per (user, leg), numbered by ``basket_leg``. The dispatcher keeps
+a user's legs together (see fair_dispatch.dispatch_units) and places them
+back-to-back on that user's warm broker client, while different users' baskets
+run in parallel. Status is aggregated per user and per basket from the legs.
+"""
+import json
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, func, insert, literal, select, update
+
+import clock
+from change_tracking import bump
+from models import KiteUser, ScheduledOrder, ScheduledOrderBulkAudit, ScheduledOrderLog
+
+# Upper bound on legs per basket
+MAX_LEGS = 20
+
+_orders = ScheduledOrder.__table__
+_users = KiteUser.__table__
+_logs = ScheduledOrderLog.__table__
+_audits = ScheduledOrderBulkAudit.__table__
+
+
+class BasketError(ValueError):
+    pass
+
+
+def parse_legs(legs, allowed_symbols: Iterable[str]) -> list:
+    """Validate legs given as a list of dicts or as text, one ``SYMBOL QTY BUY|SELL`` per line."""
+    if isinstance(legs, str):
+        parsed = []
+        for lineno, line in enumerate(legs.splitlines(), start=1):
+            parts = line.replace(',', ' ').split()
+            if not parts:
+                continue
+            if len(parts) != 3:
+                raise BasketError(f'leg on line {lineno} must be "SYMBOL QUANTITY BUY|SELL"')
+            parsed.append({'stock_symbol': parts[0], 'quantity': parts[1], 'order_type': parts[2]})
+        legs = parsed
+    if not legs:
+        raise BasketError('a basket needs at least one leg')
+    if len(legs) > MAX_LEGS:
+        raise BasketError(f'a basket can have at most {MAX_LEGS} legs')
+
+    allowed = set(allowed_symbols)
+    result = []
+    for index, leg in enumerate(legs):
+        symbol = (leg.get('stock_symbol') or '').strip().upper()
+        if symbol not in allowed:
+            raise BasketError(f'leg {index}: invalid stock symbol {symbol!r}')
+        try:
+            quantity = int(leg.get('quantity'))
+        except (TypeError, ValueError):
+            raise BasketError(f'leg {index}: quantity must be an integer')
+        if quantity <= 0:
+            raise BasketError(f'leg {index}: quantity must be positive')
+        order_type = (leg.get('order_type') or '').lower()
+        if order_type not in ('buy', 'sell'):
+            raise BasketError(f'leg {index}: order_type must be buy or sell')
+        result.append({'stock_symbol': symbol, 'quantity': quantity, 'order_type': order_type})
+    return result
+
+
+def create_basket(conn, legs: list, scheduled_time: datetime, priority: int = 0,
+                  user_ids: Optional[list] = None, initiator: Optional[str] = None) -> tuple:
+    """Insert the basket audit and one order (plus log) per targeted user and leg.
+
+    Targets every user with a still-valid token, or only ``user_ids`` among them.
+    Returns ``(audit_id, users_created)``; runs in the caller's transaction.
+    """
+    now_utc = clock.utcnow()
+    symbols = '+'.join(leg['stock_symbol'] for leg in legs)
+    audit_id = conn.execute(
+        insert(_audits).values(
+            initiator=initiator,
+            kind='basket',
+            legs=json.dumps(legs),
+            stock_symbol=symbols[:64],
+            quantity=sum(leg['quantity'] for leg in legs),
+            order_type='basket',
+            scheduled_time=scheduled_time,
+            priority=priority,
+            created_at=now_utc,
+        ).returning(_audits.c.id)
+    ).scalar_one()
+
+    targets = and_(
+        _users.c.access_token.isnot(None),
+        _users.c.token_expiry.isnot(None),
+        _users.c.token_expiry > now_utc,
+    )
+    if user_ids:
+        targets = and_(targets, _users.c.id.in_(user_ids))
+
+    users_created = 0
+    for index, leg in enumerate(legs):
+        users_created = conn.execute(
+            insert(_orders).from_select(
+                ['user_id', 'stock_symbol', 'quantity', 'order_type', 'scheduled_time', 'status',
+                 'bulk_audit_id', 'priority', 'basket_leg', 'created_at', 'updated_at'],
+                select(
+                    _users.c.id,
+                    literal(leg['stock_symbol']),
+                    literal(leg['quantity']),
+                    literal(leg['order_type']),
+                    literal(scheduled_time),
+                    literal('pending'),
+                    literal(audit_id),
+                    literal(priority),
+                    literal(index),
+                    literal(now_utc),
+                    literal(now_utc),
+                ).where(targets),
+            )
+        ).rowcount
+
+    conn.execute(
+        insert(_logs).from_select(
+            ['scheduled_order_id', 'user_id', 'status', 'message', 'created_at'],
+            select(
+                _orders.c.id,
+                _orders.c.user_id,
+                literal('scheduled'),
+                literal(f'Created from basket {audit_id}'),
+                literal(now_utc),
+            ).where(_orders.c.bulk_audit_id == audit_id),
+        )
+    )
+    conn.execute(
+        update(_audits).where(_audits.c.id == audit_id).values(
+            users_targeted=len(user_ids) if user_ids else users_created,
+            users_created=users_created,
+            message=f'Created {len(legs)}-leg basket for {users_created} users',
+        )
+    )
+    bump(conn, 'bulk_audits', 'orders', 'logs')
+    return audit_id, users_created
+
+
+def aggregate_status(statuses: Counter) -> str:
+    """Collapse leg statuses into one: pending/processing while any leg is open,
+    then completed, failed, cancelled, or partial for a mix."""
+    if statuses.get('processing'):
+        return 'processing'
+    if statuses.get('pending'):
+        return 'processing' if sum(statuses.values()) > statuses['pending'] else 'pending'
+    finished = {status for status, count in statuses.items() if count}
+    if len(finished) == 1:
+        return finished.pop()
+    return 'partial'
+
+
+def basket_statuses(conn, audit_ids: Iterable[int]) -> dict:
+    """``{audit_id: {'status', 'legs': {status: n}, 'users': {status: n}, 'per_user': {user_id: status}}}``."""
+    audit_ids = list(audit_ids)
+    if not audit_ids:
+        return {}
+    rows = conn.execute(
+        select(_orders.c.bulk_audit_id, _orders.c.user_id, _orders.c.status, func.count())
+        .where(_orders.c.bulk_audit_id.in_(audit_ids), _orders.c.basket_leg.isnot(None))
+        .group_by(_orders.c.bulk_audit_id, _orders.c.user_id, _orders.c.status)
+    )
+    per_user = defaultdict(lambda: defaultdict(Counter))
+    for audit_id, user_id, status, count in rows:
+        per_user[audit_id][user_id][status] += count
+
+    result = {}
+    for audit_id in audit_ids:
+        users = {user_id: aggregate_status(counts) for user_id, counts in per_user[audit_id].items()}
+        legs = Counter()
+        for counts in per_user[audit_id].values():
+            legs.update(counts)
+        user_counts = Counter(users.values())
+        result[audit_id] = {
+            'status': aggregate_status(user_counts) if users else 'empty',
+            'legs': dict(legs),
+            'users': dict(user_counts),
+            'per_user': users,
+        }
+    return result
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Microbenchmark: ORM dispatch path vs. the Core-statement hot path.
+
+Both paths claim, load and complete the same number of due orders against a
+temporary SQLite database with the simulated broker, one order at a time on a
+single thread, so the numbers isolate per-order CPU time and allocations.
+
+    python benchmarks/bench_dispatch_path.py --orders 2000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['KITE_ENABLE_REAL'] = 'false'
+
+import logging  # noqa: E402
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import scheduler  # noqa: E402
+from kite_client import ClientCache  # noqa: E402
+from models import db, KiteUser, ScheduledOrder  # noqa: E402
+
+
+def orm_process_order(session_maker, order_id, clients):
+    """The pre-Core worker: ORM claim, ORM re-load, scheduler.place_order()."""
+    session = session_maker()
+    try:
+        rows = session.query(ScheduledOrder).filter(
+            ScheduledOrder.id == order_id,
+            ScheduledOrder.status == 'pending',
+        ).update({'status': 'processing'}, synchronize_session=False)
+        session.commit()
+        if not rows:
+            return
+        order = session.query(ScheduledOrder).filter_by(id=order_id).one_or_none()
+        scheduler.place_order(session, order, clients)
+    finally:
+        session.close()
+
+
+def seed(engine, count):
+    db.metadata.drop_all(bind=engine)
+    db.metadata.create_all(bind=engine)
+    when = datetime.now() - timedelta(seconds=1)
+    with engine.begin() as conn:
+        conn.execute(KiteUser.__table__.insert(), [
+            {'id': i, 'api_key': f'key{i}', 'api_secret': 'secret', 'access_token': 'token', 'dispatch_priority': 0}
+            for i in range(1, count + 1)
+        ])
+        conn.execute(ScheduledOrder.__table__.insert(), [
+            {'id': i, 'user_id': i, 'stock_symbol': 'SBIN', 'quantity': 1, 'order_type': 'buy',
+             'scheduled_time': when, 'status': 'pending', 'priority': 0}
+            for i in range(1, count + 1)
+        ])
+
+
+def _drive(fn, session_maker, count):
+    clients = ClientCache()
+    for order_id in range(1, count + 1):
+        fn(session_maker, order_id, clients)
+
+
+def run(label, fn, engine, session_maker, count):
+    # timing pass (tracemalloc off, it would dominate the measurement)
+    seed(engine, count)
+    gc.collect()
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    _drive(fn, session_maker, count)
+    cpu = time.process_time() - cpu0
+    wall = time.perf_counter() - wall0
+
+    # allocation pass
+    seed(engine, count)
+    gc.collect()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    _drive(fn, session_maker, count)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>5}: {cpu / count * 1e6:8.1f} us CPU/order  {wall / count * 1e6:8.1f} us wall/order  "
+          f"peak traced {peak / 1024:8.1f} KiB")
+    return cpu / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=1000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        session_maker = sessionmaker(bind=engine)
+        orm = run('orm', orm_process_order, engine, session_maker, args.orders)
+        core = run('core', scheduler.process_order, engine, session_maker, args.orders)
+        print(f"core/orm CPU ratio: {core / orm:.2f}")
+
+
+if __name__ == '__main__':
+    main()
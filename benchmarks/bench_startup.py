@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""Cold-start benchmark for create_app() in each startup mode.
+
+Every sample runs in a fresh interpreter so import costs are included.
+
+    python benchmarks/bench_startup.py --runs 7 --record benchmarks/startup_history.jsonl
+
+The ``--record`` file gets one JSON line per invocation so regressions can be
+tracked over time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app = create_app(mode={mode!r})
+t2 = time.perf_counter()
+sched = app.extensions.get('order_scheduler')
+if sched is not None:
+    sched.shutdown(wait=False)
+import sys
+print(t1 - t0, t2 - t1, 'kiteconnect' in sys.modules, 'apscheduler' in sys.modules)
+"""
+
+
+def sample(mode: str, env: dict):
+    out = subprocess.run(
+        [sys.executable, '-c', SNIPPET.format(mode=mode)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    return float(out[0]), float(out[1]), out[2] == 'True', out[3] == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', default='cli,web,all')
+    parser.add_argument('--record', help='append results as a JSON line to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        env.setdefault('KITE_ENABLE_REAL', 'false')
+        results = {}
+        for mode in args.modes.split(','):
+            samples = [sample(mode, env) for _ in range(args.runs)]
+            imports = [s[0] * 1000 for s in samples]
+            boots = [s[1] * 1000 for s in samples]
+            results[mode] = {
+                'import_ms_median': round(statistics.median(imports), 2),
+                'create_app_ms_median': round(statistics.median(boots), 2),
+                'total_ms_median': round(statistics.median(i + b for i, b in zip(imports, boots)), 2),
+                'loads_kiteconnect': samples[-1][2],
+                'loads_apscheduler': samples[-1][3],
+            }
+            r = results[mode]
+            print(f"{mode:>9}: import {r['import_ms_median']:8.2f} ms  create_app {r['create_app_ms_median']:8.2f} ms  "
+                  f"total {r['total_ms_median']:8.2f} ms  kiteconnect={r['loads_kiteconnect']} "
+                  f"apscheduler={r['loads_apscheduler']}")
+
+    if args.record:
+        with open(args.record, 'a') as fh:
+            fh.write(json.dumps({'ts': time.time(), 'runs': args.runs, 'results': results}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""Replay a trading day through the real dispatcher on a virtual clock.
+
+The day comes from a recorded database (its ``scheduled_orders`` and bulk
+schedules for one date) or from a synthetic list of bulk-schedule times. Each
+configuration replays it on a fresh temporary SQLite database, calling
+``scheduler.place_pending_orders`` every poll interval of *virtual* time with a
+simulated broker that sleeps for a configurable latency. The clock runs at real
+speed while orders are in flight and jumps over idle time, so a full day
+replays in seconds while dispatch lateness is still measured honestly.
+
+    python benchmarks/replay_day.py --source-db sqlite:///db.sqlite3 --date 2026-10-16 --user-scale 4
+    python benchmarks/replay_day.py --synthetic 09:30:00,09:30:00,11:00:00 --users 2000 \\
+        --batch-size 50,200 --max-workers 10,40 --latency-ms 40 --jitter-ms 20
+
+Lateness is the time from an order's ``scheduled_time`` to the broker
+acknowledging it. Sharded dispatch (DISPATCH_PROCESSES) is not replayed: the
+shard processes cannot share the virtual clock.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as dt_time, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['KITE_ENABLE_REAL'] = 'false'
+
+import logging  # noqa: E402
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import create_engine, func, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import clock  # noqa: E402
+import scheduler  # noqa: E402
+from fair_dispatch import BurstPositions  # noqa: E402
+from heartbeat import Heartbeat  # noqa: E402
+from scheduler import PendingCounter  # noqa: E402
+from models import db, KiteUser, ScheduledOrder, ScheduledOrderBulkAudit  # noqa: E402
+
+_users = KiteUser.__table__
+_orders = ScheduledOrder.__table__
+_audits = ScheduledOrderBulkAudit.__table__
+
+
+class Day:
+    """A trading day to replay: users, bulk schedules and orders as plain dicts."""
+
+    def __init__(self, users, audits, orders):
+        self.users = users
+        self.audits = audits
+        self.orders = orders
+
+
+def load_day(database_url: str, day: date) -> Day:
+    """Orders scheduled on ``day`` (IST) in a recorded database, with their users and bulk schedules."""
+    engine = create_engine(database_url)
+    start = datetime.combine(day, dt_time.min)
+    end = start + timedelta(days=1)
+    with engine.connect() as conn:
+        orders = [dict(r._mapping) for r in conn.execute(
+            select(_orders.c.user_id, _orders.c.stock_symbol, _orders.c.quantity, _orders.c.order_type,
+                   _orders.c.scheduled_time, _orders.c.priority, _orders.c.bulk_audit_id, _orders.c.basket_leg)
+            .where(_orders.c.scheduled_time >= start, _orders.c.scheduled_time < end)
+        )]
+        user_ids = {o['user_id'] for o in orders}
+        users = [dict(r._mapping) for r in conn.execute(
+            select(_users.c.id, _users.c.dispatch_priority).where(_users.c.id.in_(user_ids))
+        )]
+        audit_ids = {o['bulk_audit_id'] for o in orders if o['bulk_audit_id'] is not None}
+        audits = [dict(r._mapping) for r in conn.execute(
+            select(_audits.c.id, _audits.c.stock_symbol, _audits.c.quantity, _audits.c.order_type,
+                   _audits.c.scheduled_time, _audits.c.priority, _audits.c.kind)
+            .where(_audits.c.id.in_(audit_ids))
+        )]
+    engine.dispose()
+    known = {u['id'] for u in users}
+    users.extend({'id': uid, 'dispatch_priority': 0} for uid in user_ids - known)
+    return Day(users, audits, orders)
+
+
+def synthetic_day(times, users: int, day: date) -> Day:
+    """One single-leg bulk schedule for every user at each of ``times`` (HH:MM[:SS])."""
+    audits, orders = [], []
+    for audit_id, value in enumerate(times, start=1):
+        when = datetime.combine(day, dt_time.fromisoformat(value))
+        audits.append({'id': audit_id, 'stock_symbol': 'SBIN', 'quantity': 1, 'order_type': 'buy',
+                       'scheduled_time': when, 'priority': 0, 'kind': 'single'})
+        orders.extend(
+            {'user_id': uid, 'stock_symbol': 'SBIN', 'quantity': 1, 'order_type': 'buy', 'scheduled_time': when,
+             'priority': 0, 'bulk_audit_id': audit_id, 'basket_leg': None}
+            for uid in range(1, users + 1)
+        )
+    return Day([{'id': uid, 'dispatch_priority': 0} for uid in range(1, users + 1)], audits, orders)
+
+
+def seed(engine, day: Day, user_scale: int):
+    """Load ``day`` into an empty schema, cloning every user ``user_scale`` times."""
+    db.metadata.create_all(bind=engine)
+    ids = {}
+    user_rows = []
+    for index, user in enumerate(sorted(day.users, key=lambda u: u['id'])):
+        for clone in range(user_scale):
+            new_id = index * user_scale + clone + 1
+            ids[(user['id'], clone)] = new_id
+            user_rows.append({'id': new_id, 'api_key': f'replay{new_id}', 'api_secret': 'secret',
+                              'access_token': 'token', 'dispatch_priority': user['dispatch_priority'] or 0})
+    order_rows = [
+        dict(order, user_id=ids[(order['user_id'], clone)], status='pending')
+        for order in day.orders for clone in range(user_scale)
+    ]
+    with engine.begin() as conn:
+        conn.execute(_users.insert(), user_rows)
+        if day.audits:
+            conn.execute(_audits.insert(), [dict(a, kind=a.get('kind') or 'single') for a in day.audits])
+        conn.execute(_orders.insert(), order_rows)
+    return len(order_rows)
+
+
+class ReplayBroker:
+    """Simulated broker: sleeps ``latency`` (+ uniform jitter) and records the virtual ack time."""
+
+    def __init__(self, latency: float, jitter: float, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next = itertools.count(1)
+        self.acked = {}
+
+    def get(self, user_id, api_key=None, api_secret=None, access_token=None):
+        return self
+
+    def place_order(self, tradingsymbol, quantity, transaction_type):
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            order_id = f'REPLAY-{next(self._next)}'
+        if delay:
+            time.sleep(delay)
+        self.acked[order_id] = clock.now_ist()
+        return {'status': 'success', 'order_id': order_id, 'raw': {'simulated': True}}
+
+
+def _reset_scheduler(batch_size: int, max_workers: int, broker):
+    if scheduler._executor is not None:
+        scheduler._executor.shutdown(wait=True)
+    scheduler._executor = None
+    scheduler.BATCH_SIZE = batch_size
+    scheduler.MAX_WORKERS = max_workers
+    scheduler.client_cache = broker
+    scheduler.burst_positions = BurstPositions()
+    scheduler.heartbeat = Heartbeat(path=None)
+    scheduler.pending_counter = PendingCounter()
+
+
+def _next_deadline(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.min(_orders.c.scheduled_time)).where(_orders.c.status == 'pending')).scalar()
+
+
+def replay(day: Day, user_scale: int, batch_size: int, max_workers: int, poll: float, phase: float,
+           latency: float, jitter: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'replay.sqlite3')}", connect_args={'timeout': 30})
+        session_maker = sessionmaker(bind=engine)
+        total = seed(engine, day, user_scale)
+        broker = ReplayBroker(latency, jitter)
+        _reset_scheduler(batch_size, max_workers, broker)
+        app = Flask('replay')
+
+        first = _next_deadline(engine)
+        grid_start = first.replace(second=0, microsecond=0) - timedelta(minutes=1) + timedelta(seconds=phase)
+        virtual = clock.VirtualClock(grid_start)
+        previous_clock = clock.set_clock(virtual)
+        step = timedelta(seconds=poll)
+        wall0 = time.perf_counter()
+        polls = late_polls = 0
+        try:
+            tick = grid_start
+            while True:
+                if virtual.now_ist() > tick + step:  # the poll slipped by more than an interval
+                    late_polls += 1
+                virtual.jump_to(tick)
+                scheduler.place_pending_orders(app, session_maker)
+                polls += 1
+                tick += step
+                # run at real speed while orders are in flight, then skip the rest of the interval
+                while virtual.now_ist() < tick and scheduler.heartbeat.in_flight() > 0:
+                    time.sleep(0.001)
+                if scheduler.heartbeat.in_flight() > 0:
+                    continue
+                deadline = _next_deadline(engine)
+                if deadline is None:
+                    break
+                if deadline > tick:
+                    tick += step * int((deadline - tick) / step)
+                    if tick < deadline:
+                        tick += step
+        finally:
+            scheduler.get_executor().shutdown(wait=True)
+            scheduler._executor = None
+            clock.set_clock(previous_clock)
+        wall = time.perf_counter() - wall0
+
+        with engine.connect() as conn:
+            rows = conn.execute(select(_orders.c.scheduled_time, _orders.c.kite_order_id, _orders.c.status)).all()
+        engine.dispose()
+
+    lateness = []
+    bursts = defaultdict(list)
+    for scheduled_time, kite_order_id, status in rows:
+        acked = broker.acked.get(kite_order_id)
+        if acked is None:
+            continue
+        lateness.append((acked - scheduled_time).total_seconds())
+        bursts[scheduled_time].append(acked)
+    lateness.sort()
+
+    def pct(p):
+        return round(lateness[min(len(lateness) - 1, int(p * len(lateness)))], 3) if lateness else None
+
+    # per-burst drain rate: orders acked / seconds from deadline to the last ack
+    rates = [len(acks) / max((max(acks) - deadline).total_seconds(), 1e-3) for deadline, acks in bursts.items()]
+    return {
+        'batch_size': batch_size,
+        'max_workers': max_workers,
+        'users': len(day.users) * user_scale,
+        'orders': total,
+        'placed': len(lateness),
+        'p50_s': pct(0.50),
+        'p95_s': pct(0.95),
+        'p99_s': pct(0.99),
+        'max_s': round(lateness[-1], 3) if lateness else None,
+        'worst_burst_orders_per_s': round(min(rates), 1) if rates else None,
+        'polls': polls,
+        'late_polls': late_polls,
+        'wall_s': round(wall, 2),
+    }
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--source-db', help='database URL of a recorded day')
+    source.add_argument('--synthetic', help='comma-separated IST times, one bulk schedule for every user each')
+    parser.add_argument('--date', type=date.fromisoformat, help='day to replay (default today)')
+    parser.add_argument('--users', type=int, default=200, help='users in a synthetic day')
+    parser.add_argument('--user-scale', type=int, default=1, help='clone every user this many times')
+    parser.add_argument('--batch-size', type=_int_list, default=[scheduler.BATCH_SIZE])
+    parser.add_argument('--max-workers', type=_int_list, default=[scheduler.MAX_WORKERS])
+    parser.add_argument('--poll-interval', type=float, default=scheduler.POLL_INTERVAL_SECONDS)
+    parser.add_argument('--phase', type=float, default=scheduler.POLL_INTERVAL_SECONDS / 2,
+                        help='seconds between a whole minute and the next poll')
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='simulated broker latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='extra uniform random broker latency')
+    parser.add_argument('--record', help='append results as JSON lines to this file')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    day_date = args.date or clock.now_ist().date()
+    if args.source_db:
+        day = load_day(args.source_db, day_date)
+    else:
+        day = synthetic_day(args.synthetic.split(','), args.users, day_date)
+    if not day.orders:
+        parser.error(f'no orders scheduled on {day_date}')
+
+    results = []
+    for batch_size, max_workers in itertools.product(args.batch_size, args.max_workers):
+        r = replay(day, args.user_scale, batch_size, max_workers, args.poll_interval, args.phase,
+                   args.latency_ms / 1000, args.jitter_ms / 1000)
+        results.append(r)
+        print(f"batch {batch_size:>5} workers {max_workers:>4}: {r['placed']}/{r['orders']} orders  "
+              f"lateness p50 {r['p50_s']}s p95 {r['p95_s']}s p99 {r['p99_s']}s max {r['max_s']}s  "
+              f"worst burst {r['worst_burst_orders_per_s']} orders/s  ({r['polls']} polls, {r['wall_s']}s wall)")
+
+    if args.record:
+        with open(args.record, 'a') as fh:
+            for r in results:
+                fh.write(json.dumps(dict(r, ts=time.time(), day=day_date.isoformat())) + '\n')
+
+
+if __name__ == '__main__':
+    main()
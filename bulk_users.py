@@ -0,0 +1,176 @@
+"""Streaming bulk import/export of Kite user credentials.
+
+Records are read lazily from CSV or JSONL and upserted in fixed-size batches:
+each batch does a single ``IN`` lookup for existing api_keys, one bulk insert
+for new rows and one bulk update for changed secrets, then commits. Nothing
+is held in memory beyond the current batch.
+"""
+import csv
+import json
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import bindparam, insert, select, update
+
+from change_tracking import bump
+from models import KiteUser
+
+DEFAULT_BATCH_SIZE = 500
+EXPORT_FIELDS = ['id', 'api_key', 'user_id', 'user_name', 'email', 'broker', 'created_at', 'token_expiry']
+
+
+@dataclass
+class RowResult:
+    line: int
+    api_key_preview: str
+    status: str  # created, updated, unchanged, duplicate, invalid
+    message: str = ''
+
+    def to_dict(self):
+        return {
+            'line': self.line,
+            'api_key_preview': self.api_key_preview,
+            'status': self.status,
+            'message': self.message,
+        }
+
+
+def _preview(api_key: Optional[str]) -> str:
+    return f"{api_key[:4]}..." if api_key else ''
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    if fmt:
+        return fmt.lower()
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def iter_records(stream, fmt: str) -> Iterator[tuple]:
+    """Yield ``(line_number, record_dict_or_None, error)`` from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+    elif fmt == 'jsonl':
+        for lineno, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield lineno, None, f'invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield lineno, None, 'expected a JSON object'
+                continue
+            yield lineno, record, None
+    else:
+        raise ValueError(f'unsupported format {fmt!r}')
+
+
+def _batches(records: Iterable, size: int):
+    batch = []
+    for item in records:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_users(session, records: Iterable, batch_size: int = DEFAULT_BATCH_SIZE,
+                 update_existing: bool = True) -> Iterator[RowResult]:
+    """Upsert ``records`` (as produced by :func:`iter_records`) and yield a result per row.
+
+    Existing users are matched on ``api_key``. A changed ``api_secret`` updates the
+    row and clears its access token, the same as editing the user in the dashboard.
+    Repeated api_keys within the input are reported as ``duplicate``.
+    """
+    seen = set()
+    for batch in _batches(records, batch_size):
+        results = []
+        candidates = {}
+        for lineno, record, error in batch:
+            if error:
+                results.append(RowResult(lineno, '', 'invalid', error))
+                continue
+            api_key = (record.get('api_key') or '').strip()
+            api_secret = (record.get('api_secret') or '').strip()
+            if not api_key or not api_secret:
+                results.append(RowResult(lineno, _preview(api_key), 'invalid', 'api_key and api_secret required'))
+                continue
+            if api_key in seen:
+                results.append(RowResult(lineno, _preview(api_key), 'duplicate', 'api_key repeated in input'))
+                continue
+            seen.add(api_key)
+            candidates[api_key] = (lineno, api_secret)
+
+        if candidates:
+            existing = dict(session.execute(
+                select(KiteUser.api_key, KiteUser.api_secret).where(KiteUser.api_key.in_(list(candidates)))
+            ).all())
+            to_insert = []
+            to_update = []
+            for api_key, (lineno, api_secret) in candidates.items():
+                if api_key not in existing:
+                    to_insert.append({'api_key': api_key, 'api_secret': api_secret})
+                    results.append(RowResult(lineno, _preview(api_key), 'created'))
+                elif existing[api_key] == api_secret or not update_existing:
+                    results.append(RowResult(lineno, _preview(api_key), 'unchanged'))
+                else:
+                    to_update.append({'key': api_key, 'api_secret': api_secret})
+                    results.append(RowResult(lineno, _preview(api_key), 'updated'))
+            try:
+                if to_insert:
+                    session.execute(insert(KiteUser), to_insert)
+                if to_update:
+                    session.execute(
+                        update(KiteUser.__table__)
+                        .where(KiteUser.__table__.c.api_key == bindparam('key'))
+                        .values(api_secret=bindparam('api_secret'), access_token=None, token_expiry=None),
+                        to_update,
+                    )
+                if to_insert or to_update:
+                    bump(session, 'users')
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                failed = {r.line for r in results if r.status in ('created', 'updated')}
+                results = [
+                    RowResult(r.line, r.api_key_preview, 'invalid', f'batch failed: {e}') if r.line in failed else r
+                    for r in results
+                ]
+
+        results.sort(key=lambda r: r.line)
+        yield from results
+
+
+def export_users(session, stream, fmt: str, include_secrets: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Stream all users to ``stream`` as CSV or JSONL. Returns the number of rows written.
+
+    With ``include_secrets`` the output carries ``api_secret`` and can be fed back
+    into :func:`upsert_users` on another deployment.
+    """
+    fields = list(EXPORT_FIELDS)
+    if include_secrets:
+        fields.insert(2, 'api_secret')
+    columns = [getattr(KiteUser, f) for f in fields]
+    rows = session.execute(
+        select(*columns).order_by(KiteUser.id).execution_options(stream_results=True, yield_per=batch_size)
+    )
+
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+    count = 0
+    for row in rows:
+        values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in row]
+        if writer:
+            writer.writerow(values)
+        else:
+            stream.write(json.dumps(dict(zip(fields, values))) + '\n')
+        count += 1
+    return count
@@ -0,0 +1,155 @@
+"""Per-resource change counters for conditional GETs and cache invalidation.
+
+Every write to a tracked table bumps the matching row in ``resource_versions``
+inside the writer's own transaction, so a version is visible exactly when the
+data it describes is. ORM writes are picked up automatically by the session
+hooks below; Core writers (order_actions, bulk_users, baskets) call
+:func:`bump` themselves.
+
+The dispatch hot path cannot afford that: every claim and finish would update
+the same ``resource_versions`` row, and on PostgreSQL each worker would wait
+for that row lock. dispatch_sql calls :func:`touch` instead, which only
+records the names on the connection. Once that transaction commits, a
+:class:`VersionPublisher` thread bumps them in its own transaction, at most
+once per ``VERSION_PUBLISH_SECONDS`` however many orders went through.
+"""
+import logging
+import threading
+
+from sqlalchemy import bindparam, event, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import clock
+from config import VERSION_PUBLISH_SECONDS
+from models import ResourceVersion
+from order_notify import mark_orders_changed
+
+logger = logging.getLogger(__name__)
+
+# table name -> resource name
+TRACKED_TABLES = {
+    'kite_users': 'users',
+    'scheduled_orders': 'orders',
+    'scheduled_order_logs': 'logs',
+    'scheduled_order_bulk_audits': 'bulk_audits',
+    'recurring_schedules': 'recurring',
+    'instruments': 'instruments',
+}
+RESOURCES = tuple(sorted(set(TRACKED_TABLES.values())))
+
+_versions = ResourceVersion.__table__
+
+BUMP = (
+    update(_versions)
+    .where(_versions.c.name.in_(bindparam('names', expanding=True)))
+    .values(version=_versions.c.version + 1, updated_at=bindparam('now'))
+)
+
+SELECT_VERSIONS = select(_versions.c.name, _versions.c.version, _versions.c.updated_at).where(
+    _versions.c.name.in_(bindparam('names', expanding=True)),
+)
+
+_SESSION_KEY = 'changed_resources'
+_CONNECTION_KEY = 'touched_resources'
+
+# names touched by committed transactions and not yet published
+_touched = set()
+_touched_lock = threading.Lock()
+
+
+def bump(conn, *names):
+    """Increment the version of ``names`` on ``conn`` (a Connection or Session)."""
+    if names:
+        conn.execute(BUMP, {'names': list(names), 'now': clock.utcnow()})
+        if 'orders' in names and isinstance(conn, Session):
+            # tell a scheduler in another process once this commits (see order_notify)
+            mark_orders_changed(conn)
+
+
+def touch(conn, *names):
+    """Mark ``names`` changed by ``conn``'s transaction; a VersionPublisher bumps them after it commits."""
+    conn.info.setdefault(_CONNECTION_KEY, set()).update(names)
+
+
+@event.listens_for(Engine, 'commit')
+def _collect_touched(conn):
+    names = conn.info.pop(_CONNECTION_KEY, None)
+    if names:
+        with _touched_lock:
+            _touched.update(names)
+
+
+@event.listens_for(Engine, 'rollback')
+def _discard_touched(conn):
+    conn.info.pop(_CONNECTION_KEY, None)
+
+
+class VersionPublisher(threading.Thread):
+    """Bump the versions touched by committed Core writes, at most once per ``interval``.
+
+    The commit hook runs just before the database commits, so a bump could
+    overtake the write it describes and let a reader cache the old rows under
+    the new version. Every name is therefore bumped a second time on the next
+    round, by which point that write has landed.
+    """
+
+    def __init__(self, engine, interval: float = VERSION_PUBLISH_SECONDS):
+        super().__init__(name='version-publisher', daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self._again = set()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.publish()
+
+    def publish(self):
+        with _touched_lock:
+            fresh = set(_touched)
+            _touched.clear()
+        names, self._again = fresh | self._again, fresh
+        if not names:
+            return
+        try:
+            with self.engine.begin() as conn:
+                bump(conn, *sorted(names))
+        except Exception:
+            logger.exception('Failed to publish resource versions %s', sorted(names))
+            self._again |= names
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=self.interval * 2)
+        self.publish()
+        self.publish()
+
+
+def read_versions(conn, names) -> dict:
+    """Return ``{name: (version, updated_at)}`` for the given resources."""
+    return {row[0]: (row[1], row[2]) for row in conn.execute(SELECT_VERSIONS, {'names': list(names)})}
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = session.info.setdefault(_SESSION_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table in TRACKED_TABLES and (obj not in session.dirty or session.is_modified(obj)):
+            changed.add(TRACKED_TABLES[table])
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_on_commit(session):
+    # flush first so the last batch of changes is collected, then bump once per
+    # commit rather than once per flush (bulk schedules flush per order)
+    session.flush()
+    changed = session.info.pop(_SESSION_KEY, None)
+    if changed:
+        bump(session, *sorted(changed))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_SESSION_KEY, None)
@@ -0,0 +1,81 @@
+"""Injectable wall clock for the scheduler and order validation.
+
+Code that needs "now" calls :func:`now_ist` / :func:`utcnow` instead of
+``datetime.now(...)`` directly, so a replay (see benchmarks/replay_day.py) can
+run the real dispatch code on a virtual trading day. The default
+:class:`SystemClock` is the real clock.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+IST = ZoneInfo('Asia/Kolkata')
+UTC = ZoneInfo('UTC')
+
+# IST is a fixed offset, which lets the virtual clock derive UTC without tz lookups
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+
+class SystemClock:
+    def now_ist(self) -> datetime:
+        """Current IST time as a naive datetime (how scheduled_time is stored)."""
+        return datetime.now(IST).replace(tzinfo=None)
+
+    def utcnow(self) -> datetime:
+        return datetime.now(UTC).replace(tzinfo=None)
+
+
+class VirtualClock:
+    """A clock that runs at real speed from ``start`` (naive IST) and can jump forward.
+
+    Work in progress is timed at real rate, so measured latencies stay honest;
+    idle waits are skipped with :meth:`jump_to` instead of being slept through.
+    """
+
+    def __init__(self, start: datetime):
+        self._lock = threading.Lock()
+        self._base = start
+        self._anchor = time.perf_counter()
+
+    def now_ist(self) -> datetime:
+        with self._lock:
+            return self._base + timedelta(seconds=time.perf_counter() - self._anchor)
+
+    def utcnow(self) -> datetime:
+        return self.now_ist() - IST_OFFSET
+
+    def jump_to(self, target: datetime):
+        """Move the clock forward to ``target``; never moves backwards."""
+        with self._lock:
+            now = self._base + timedelta(seconds=time.perf_counter() - self._anchor)
+            if target > now:
+                self._base = target
+                self._anchor = time.perf_counter()
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock) -> object:
+    """Install ``clock`` process-wide and return the previous one."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def now_ist() -> datetime:
+    return _clock.now_ist()
+
+
+def utcnow() -> datetime:
+    return _clock.utcnow()
+
+
+def format_ist(utc_naive: datetime) -> str:
+    """Display string for a naive UTC timestamp in IST, e.g. ``2026-10-19 09:15:00 IST``."""
+    return (utc_naive + IST_OFFSET).strftime('%Y-%m-%d %H:%M:%S IST')
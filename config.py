@@ -16,3 +16,96 @@ DATABASE_URL = os.environ.get("DATABASE_URL") or f"sqlite:///{os.path.join(BASE_
 # Set these env vars to auto-create an admin on first run
 DEFAULT_ADMIN_USERNAME = os.environ.get("DEFAULT_ADMIN_USERNAME", "")
 DEFAULT_ADMIN_PASSWORD = os.environ.get("DEFAULT_ADMIN_PASSWORD", "")
+
+# Startup mode. Controls what create_app() does besides registering routes:
+# - 'all': run migrations and start the scheduler in-process (used by `python app.py`)
+# - 'web': serve HTTP only (Gunicorn workers via wsgi.py)
+# - 'scheduler': dispatcher process only (run_scheduler.py)
+# - 'cli': management commands; no scheduler, no schema changes
+# Leave empty to let each entry point pick its own default.
+APP_MODE = os.environ.get("APP_MODE", "").lower()
+
+# Number of dispatcher worker processes. 0 keeps dispatch on the scheduler's own
+# thread pool; K > 0 spawns K processes, each owning the users with user_id % K == shard.
+DISPATCH_PROCESSES = int(os.environ.get("DISPATCH_PROCESSES", "0"))
+
+# Scheduler heartbeat file read by /health and /ready in web workers.
+# Set HEARTBEAT_PATH to an empty string to disable publishing.
+HEARTBEAT_PATH = os.environ.get("HEARTBEAT_PATH", os.path.join(BASE_DIR, 'scheduler_heartbeat.json'))
+# /ready fails when the last scheduler loop is older than this
+HEARTBEAT_STALE_SECONDS = float(os.environ.get("HEARTBEAT_STALE_SECONDS", "30"))
+# /ready fails when the earliest pending order is overdue by more than this
+DISPATCH_LAG_SECONDS = float(os.environ.get("DISPATCH_LAG_SECONDS", "60"))
+
+# Exchange holiday calendar used by recurring schedules: one ISO date (YYYY-MM-DD) per line
+HOLIDAYS_FILE = os.environ.get("HOLIDAYS_FILE", os.path.join(BASE_DIR, 'holidays.txt'))
+
+# Push notification of pending-order changes to the scheduler ('auto' or 'off').
+# 'auto' uses LISTEN/NOTIFY on PostgreSQL (psycopg2) and a Unix datagram socket on SQLite;
+# the scheduler then only polls as a safety sweep every SAFETY_SWEEP_SECONDS.
+ORDER_NOTIFY = os.environ.get("ORDER_NOTIFY", "auto").lower()
+NOTIFY_SOCKET_PATH = os.environ.get("NOTIFY_SOCKET_PATH", os.path.join(BASE_DIR, 'order_notify.sock'))
+SAFETY_SWEEP_SECONDS = float(os.environ.get("SAFETY_SWEEP_SECONDS", "60"))
+
+# On-demand profiling (see profiling.py): output directory, request file shared with
+# the scheduler process, default capture length and stack sampling interval
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, 'profiles'))
+PROFILE_CONTROL_PATH = os.environ.get("PROFILE_CONTROL_PATH", os.path.join(BASE_DIR, 'profile_request.json'))
+PROFILE_DEFAULT_SECONDS = float(os.environ.get("PROFILE_DEFAULT_SECONDS", "30"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+# SQL accounting (see query_stats.py): per-request/job query counts and DB time,
+# N+1 warnings for a statement repeated this many times with different parameters,
+# and a JSON-lines log (with EXPLAIN plans) of statements slower than SLOW_QUERY_MS.
+# Off by default (timing every statement costs the dispatch path); set QUERY_STATS=true to enable.
+# Set SLOW_QUERY_LOG to an empty string to disable the log.
+QUERY_STATS = os.environ.get("QUERY_STATS", "false").lower() == "true"
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", "10"))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", os.path.join(BASE_DIR, 'slow_queries.log'))
+
+# Freeze-limit slicing (see slicing.py): child orders per second per user (Kite allows
+# 10 order requests/second), retries of a slice rejected for rate limiting, and the size of
+# the thread pool that streams sliced orders (separate from the dispatch workers)
+SLICE_ORDERS_PER_SECOND = float(os.environ.get("SLICE_ORDERS_PER_SECOND", "8"))
+SLICE_RATE_LIMIT_RETRIES = int(os.environ.get("SLICE_RATE_LIMIT_RETRIES", "3"))
+SLICE_WORKERS = int(os.environ.get("SLICE_WORKERS", "4"))
+
+# Price-triggered orders (see triggers.py). TICK_SOURCE: '' (off), 'kite' (KiteTicker, using
+# TICK_FEED_USER_ID's token or the first valid one) or 'replay:<csv path>' with TICK_REPLAY_SPEED
+# (0 = as fast as possible, 1 = real time). Armed triggers are reloaded at most every TRIGGER_REFRESH_SECONDS.
+TICK_SOURCE = os.environ.get("TICK_SOURCE", "")
+TICK_FEED_USER_ID = int(os.environ.get("TICK_FEED_USER_ID", "0")) or None
+TICK_REPLAY_SPEED = float(os.environ.get("TICK_REPLAY_SPEED", "0"))
+TRIGGER_REFRESH_SECONDS = float(os.environ.get("TRIGGER_REFRESH_SECONDS", "1"))
+
+# Kite login bookkeeping (see kite_sessions.py): profile hydration batches (size, and how long
+# to wait for more logins before writing) and parallelism of the bulk token re-validation,
+# which the scheduler also runs daily at TOKEN_REVALIDATE_AT (HH:MM IST; empty = off)
+HYDRATE_BATCH_SIZE = int(os.environ.get("HYDRATE_BATCH_SIZE", "100"))
+HYDRATE_BATCH_WAIT_SECONDS = float(os.environ.get("HYDRATE_BATCH_WAIT_SECONDS", "0.5"))
+TOKEN_VALIDATION_WORKERS = int(os.environ.get("TOKEN_VALIDATION_WORKERS", "16"))
+TOKEN_REVALIDATE_AT = os.environ.get("TOKEN_REVALIDATE_AT", "")
+
+# Order log export (see log_export.py): rows fetched and gzip-compressed per streamed
+# chunk, and the longest date range a single GET /logs/export may cover
+LOG_EXPORT_CHUNK_ROWS = int(os.environ.get("LOG_EXPORT_CHUNK_ROWS", "2000"))
+LOG_EXPORT_MAX_DAYS = int(os.environ.get("LOG_EXPORT_MAX_DAYS", "31"))
+
+# Rendered dashboard/logs fragments kept in memory per web process (see fragment_cache.py);
+# each /logs filter and page combination takes one entry
+FRAGMENT_CACHE_ENTRIES = int(os.environ.get("FRAGMENT_CACHE_ENTRIES", "256"))
+
+# Dispatch journal (see dispatch_journal.py): path of the memory-mapped journal that records order
+# claims and broker results during bursts ('' = off; ignored with DISPATCH_PROCESSES), its size, how
+# long the fsync thread waits so concurrent workers share one flush, and the background applier's
+# batch size and wait for more results before writing them to the database
+DISPATCH_JOURNAL = os.environ.get("DISPATCH_JOURNAL", "")
+JOURNAL_SIZE_MB = int(os.environ.get("JOURNAL_SIZE_MB", "64"))
+JOURNAL_FSYNC_DELAY_MS = float(os.environ.get("JOURNAL_FSYNC_DELAY_MS", "1"))
+JOURNAL_APPLY_BATCH = int(os.environ.get("JOURNAL_APPLY_BATCH", "500"))
+JOURNAL_APPLY_WAIT_SECONDS = float(os.environ.get("JOURNAL_APPLY_WAIT_SECONDS", "0.05"))
+
+# Versions touched by the dispatch path (claims, results) are bumped by a background thread at most
+# this often, instead of inside every order's transaction (see change_tracking.py)
+VERSION_PUBLISH_SECONDS = float(os.environ.get("VERSION_PUBLISH_SECONDS", "0.5"))
\ No newline at end of file
@@ -0,0 +1,360 @@
+"""Append-only, memory-mapped journal of order dispatch events.
+
+With ``DISPATCH_JOURNAL`` set, the journal is the system of record for orders
+in flight. The poller claims each batch of due orders with one UPDATE and
+records a ``claim`` for every claimed order before that UPDATE commits. From
+then on, a worker only appends to the journal. It writes ``sent`` before the
+broker call and ``ack`` or ``fail`` with the broker's answer afterwards, so it
+never waits for the database write lock. :class:`JournalApplier` copies the
+outcomes into ``scheduled_orders`` / ``scheduled_order_logs`` in batches in the
+background.
+
+Records are appended to a preallocated file mapped into memory. A record is
+durable once the fsync thread has ``msync``-ed it. Writers that need durability
+wait for the next flush, and every record appended meanwhile shares that one
+flush. Each record carries a CRC, so a torn tail left by a crash is dropped.
+Records also carry the journal's epoch, so records from before the last reset
+are never read back.
+
+On start, :func:`replay` runs before the first poll. For each order in the
+journal:
+
+- an ``ack`` / ``fail`` not yet in the database is applied;
+- an order that was claimed but never sent goes back to ``pending``;
+- an order that was sent without a recorded outcome is not sent again. It stays
+  ``processing`` with an ``interrupted`` log entry, for reconciliation against
+  the broker's order book.
+"""
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+import clock
+import dispatch_sql
+from change_tracking import bump
+from config import JOURNAL_APPLY_BATCH, JOURNAL_APPLY_WAIT_SECONDS, JOURNAL_FSYNC_DELAY_MS, JOURNAL_SIZE_MB
+
+logger = logging.getLogger(__name__)
+
+# Record kinds. HANDOFF: the outcome was written to the database by another path
+# (freeze-limit slices); RELEASE: the claim did not commit.
+CLAIM, SENT, ACK, FAIL, HANDOFF, RELEASE = range(1, 7)
+OUTCOME_KINDS = {ACK: 'completed', FAIL: 'failed'}
+_CLOSING_KINDS = (ACK, FAIL, HANDOFF, RELEASE)
+
+_MAGIC = b'DJOURNL1'
+# magic, epoch
+_FILE_HEADER = struct.Struct('<8sQ')
+# crc32 (of everything after it, body included), epoch, body length, kind, order id, user id, UTC timestamp
+_RECORD = struct.Struct('<IQIBqqd')
+# Space kept free per order in flight for its remaining records
+RECORD_RESERVE_BYTES = 2 * _RECORD.size + 4096
+
+INTERRUPTED_MESSAGE = ('Dispatcher stopped after sending this order to the broker and before recording the result. '
+                      'It was not re-sent; check the broker order book.')
+
+_UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+class JournalFull(RuntimeError):
+    pass
+
+
+class JournalEntry(NamedTuple):
+    kind: int
+    order_id: int
+    user_id: int
+    created_at: datetime  # naive UTC
+    kite_order_id: Optional[str] = None
+    message: Optional[str] = None
+
+    @property
+    def status(self) -> Optional[str]:
+        return OUTCOME_KINDS.get(self.kind)
+
+
+def _timestamp(moment: datetime) -> float:
+    return (moment - _UNIX_EPOCH).total_seconds()
+
+
+class DispatchJournal:
+    """A preallocated journal file, appended through ``mmap`` and flushed by a group-fsync thread."""
+
+    def __init__(self, path: str, size_bytes: int = JOURNAL_SIZE_MB * 1024 * 1024,
+                 fsync_delay: float = JOURNAL_FSYNC_DELAY_MS / 1000.0):
+        self.path = path
+        self.fsync_delay = fsync_delay
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size_bytes:
+            os.ftruncate(self._fd, size_bytes)
+        self._size = os.fstat(self._fd).st_size
+        self._map = mmap.mmap(self._fd, self._size)
+        self._cond = threading.Condition()
+        magic, epoch = _FILE_HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            epoch = 1
+            self._write_header(epoch)
+        self._epoch = epoch
+        #: Entries found on open, for :func:`replay`
+        self.recovered, self._offset = self._scan()
+        # bytes ever appended / made durable; unlike offsets these never move back on reset
+        self._written = 0
+        self._durable = 0
+        self._open = set()
+        self._unapplied = 0
+        self._closed = False
+        self.fsyncs = 0
+        self._flusher = threading.Thread(target=self._flush_loop, name='journal-fsync', daemon=True)
+        self._flusher.start()
+
+    def _write_header(self, epoch: int):
+        _FILE_HEADER.pack_into(self._map, 0, _MAGIC, epoch)
+        self._map.flush(0, mmap.PAGESIZE)
+
+    def _scan(self):
+        entries = []
+        offset = _FILE_HEADER.size
+        while offset + _RECORD.size <= self._size:
+            crc, epoch, length, kind, order_id, user_id, ts = _RECORD.unpack_from(self._map, offset)
+            end = offset + _RECORD.size + length
+            if epoch != self._epoch or end > self._size:
+                break
+            if zlib.crc32(self._map[offset + 4:end]) != crc:
+                break  # torn write at the tail
+            kite_order_id = message = None
+            if length:
+                kite_order_id, message = json.loads(self._map[offset + _RECORD.size:end])
+            created_at = _UNIX_EPOCH + timedelta(seconds=ts)
+            entries.append(JournalEntry(kind, order_id, user_id, created_at, kite_order_id, message))
+            offset = end
+        return entries, offset
+
+    def _encode(self, entry: JournalEntry) -> bytes:
+        body = b''
+        if entry.kind in OUTCOME_KINDS:
+            body = json.dumps([entry.kite_order_id, entry.message]).encode('utf-8')
+        head = _RECORD.pack(0, self._epoch, len(body), entry.kind, entry.order_id, entry.user_id,
+                            _timestamp(entry.created_at))
+        return struct.pack('<I', zlib.crc32(head[4:] + body)) + head[4:] + body
+
+    def append(self, entries, durable: bool = True):
+        """Append ``entries`` and, with ``durable``, wait until they are on disk."""
+        with self._cond:
+            if self._closed:
+                raise JournalFull('journal is closed')
+            data = b''.join(self._encode(entry) for entry in entries)
+            if self._offset + len(data) > self._size:
+                raise JournalFull(f'{self.path} has no room for {len(data)} more bytes')
+            self._map[self._offset:self._offset + len(data)] = data
+            self._offset += len(data)
+            self._written += len(data)
+            written = self._written
+            for entry in entries:
+                if entry.kind == CLAIM:
+                    self._open.add(entry.order_id)
+                elif entry.kind in _CLOSING_KINDS:
+                    self._open.discard(entry.order_id)
+                if entry.kind in OUTCOME_KINDS:
+                    self._unapplied += 1
+            self._cond.notify_all()
+            if durable:
+                while self._durable < written and not self._closed:
+                    self._cond.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._durable >= self._written and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            if self.fsync_delay:
+                # let writers arriving in the meantime share this flush
+                time.sleep(self.fsync_delay)
+            with self._cond:
+                target, end = self._written, self._offset
+                start = end - (target - self._durable)
+            start -= start % mmap.PAGESIZE
+            self._map.flush(start, end - start)
+            with self._cond:
+                self._durable = target
+                self.fsyncs += 1
+                self._cond.notify_all()
+
+    def has_room(self, orders: int) -> bool:
+        with self._cond:
+            return self._size - self._offset >= (orders + len(self._open)) * RECORD_RESERVE_BYTES
+
+    def in_flight(self) -> int:
+        return len(self._open)
+
+    def forget(self, order_id: int):
+        """Stop tracking an order whose outcome went to the database directly (journal full)."""
+        with self._cond:
+            self._open.discard(order_id)
+
+    def applied(self, count: int):
+        with self._cond:
+            self._unapplied = max(0, self._unapplied - count)
+
+    def reset(self) -> bool:
+        """Start a new epoch at the top of the file once nothing in it is still needed."""
+        with self._cond:
+            if self._open or self._unapplied or self._durable < self._written:
+                return False
+            if self._offset == _FILE_HEADER.size:
+                return True
+            self._epoch += 1
+            self._write_header(self._epoch)
+            self._offset = _FILE_HEADER.size
+            return True
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join(timeout=5)
+        self._map.flush()
+        self._map.close()
+        os.close(self._fd)
+
+    # Event helpers used by the dispatcher
+
+    def claim(self, records):
+        now = clock.utcnow()
+        self.append([JournalEntry(CLAIM, r.id, r.user_id, now) for r in records])
+
+    def release(self, records):
+        now = clock.utcnow()
+        self.append([JournalEntry(RELEASE, r.id, r.user_id, now) for r in records])
+
+    def sent(self, record):
+        self.append([JournalEntry(SENT, record.id, record.user_id, clock.utcnow())])
+
+    def handoff(self, record):
+        self.append([JournalEntry(HANDOFF, record.id, record.user_id, clock.utcnow())])
+
+    def outcome(self, record, status: str, kite_order_id: Optional[str], message: Optional[str]) -> JournalEntry:
+        entry = JournalEntry(ACK if status == 'completed' else FAIL, record.id, record.user_id, clock.utcnow(),
+                             kite_order_id, message)
+        self.append([entry])
+        return entry
+
+
+def _finish_params(entry: JournalEntry) -> dict:
+    return {'order_id': entry.order_id, 'status': entry.status, 'kite_order_id': entry.kite_order_id}
+
+
+def _log_params(entry: JournalEntry, status: str = None, message: str = None) -> dict:
+    return {
+        'scheduled_order_id': entry.order_id,
+        'user_id': entry.user_id,
+        'status': status or entry.status,
+        'message': message if status else entry.message,
+        'created_at': entry.created_at,
+    }
+
+
+class JournalApplier(threading.Thread):
+    """Copies journaled outcomes into the order and log tables, many per transaction."""
+
+    def __init__(self, engine, journal: DispatchJournal, batch_size: int = JOURNAL_APPLY_BATCH,
+                 wait: float = JOURNAL_APPLY_WAIT_SECONDS):
+        super().__init__(name='journal-applier', daemon=True)
+        self.engine = engine
+        self.journal = journal
+        self.batch_size = batch_size
+        self.wait = wait
+        self._queue = queue.Queue()
+
+    def submit(self, entry: JournalEntry):
+        self._queue.put(entry)
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            while True:
+                try:
+                    self.write(batch)
+                    break
+                except Exception:
+                    # the outcomes are durable in the journal; keep retrying (or replay on restart)
+                    logger.exception('Failed to apply %s journaled order outcomes; retrying', len(batch))
+                    time.sleep(1)
+            for _ in batch:
+                self._queue.task_done()
+            self.journal.applied(len(batch))
+            if self._queue.empty():
+                self.journal.reset()
+
+    def write(self, batch: list):
+        with self.engine.begin() as conn:
+            conn.execute(dispatch_sql.FINISH_ORDER, [_finish_params(entry) for entry in batch])
+            conn.execute(dispatch_sql.INSERT_LOG, [_log_params(entry) for entry in batch])
+            bump(conn, 'logs', 'orders')
+
+    def drain(self, timeout: float = 10) -> bool:
+        """Wait until every submitted outcome is in the database."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+def replay(engine, journal: DispatchJournal) -> Counter:
+    """Reconcile the database with the journal left by the previous run, then reset the journal."""
+    last = {}
+    outcomes = {}
+    for entry in journal.recovered:
+        last[entry.order_id] = entry
+        if entry.kind in OUTCOME_KINDS:
+            outcomes[entry.order_id] = entry
+
+    counts = Counter()
+    with engine.begin() as conn:
+        for order_id, entry in last.items():
+            if order_id in outcomes:
+                outcome = outcomes[order_id]
+                if conn.execute(dispatch_sql.FINISH_CLAIMED, _finish_params(outcome)).rowcount:
+                    conn.execute(dispatch_sql.INSERT_LOG, _log_params(outcome))
+                    counts['applied'] += 1
+            elif entry.kind == CLAIM:
+                if conn.execute(dispatch_sql.REQUEUE_CLAIMED, {'order_id': order_id}).rowcount:
+                    counts['requeued'] += 1
+            elif entry.kind == SENT:
+                if conn.execute(dispatch_sql.SELECT_ORDER_STATUS, {'order_id': order_id}).scalar() != 'processing':
+                    continue
+                # a crash after this commit but before the reset below replays the same records
+                if conn.execute(dispatch_sql.SELECT_HAS_LOG, {'order_id': order_id, 'status': 'interrupted'}).first():
+                    continue
+                conn.execute(dispatch_sql.INSERT_LOG, _log_params(entry, 'interrupted', INTERRUPTED_MESSAGE))
+                counts['interrupted'] += 1
+        if counts:
+            bump(conn, 'logs', 'orders')
+    journal.recovered = []
+    journal.reset()
+    if counts:
+        logger.warning('Dispatch journal replay: %s', dict(counts))
+    return counts
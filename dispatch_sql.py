@@ -0,0 +1,204 @@
+"""SQLAlchemy Core statements for the dispatch hot path.
+
+The scheduler poll and the order workers never hydrate ORM objects: every
+statement here is built once at import time and executed on a plain
+connection, so SQLAlchemy's compiled-statement cache serves them on every poll,
+and results come back as small named tuples holding only what is needed to
+place an order.
+"""
+import json
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from change_tracking import touch
+from models import Instrument, KiteUser, ScheduledOrder, ScheduledOrderLog
+
+orders = ScheduledOrder.__table__
+users = KiteUser.__table__
+order_logs = ScheduledOrderLog.__table__
+instruments = Instrument.__table__
+
+
+class OrderRecord(NamedTuple):
+    """Everything a worker needs to place one order. User fields are None if the user is gone."""
+    id: int
+    user_id: int
+    stock_symbol: str
+    quantity: int
+    order_type: str
+    user_exists: bool
+    api_key: Optional[str]
+    api_secret: Optional[str]
+    access_token: Optional[str]
+    lot_size: Optional[int]
+    freeze_qty: Optional[int]  # None when the symbol has no instrument row or no freeze limit
+
+
+# Due pending orders with the fields needed for fair ordering (see fair_dispatch.DueOrder)
+_SELECT_DUE_ROWS = (
+    select(
+        orders.c.id,
+        orders.c.user_id,
+        orders.c.scheduled_time,
+        orders.c.priority,
+        users.c.dispatch_priority,
+        orders.c.dispatch_position,
+        orders.c.bulk_audit_id,
+        orders.c.basket_leg,
+    )
+    .select_from(orders.outerjoin(users, users.c.id == orders.c.user_id))
+    .where(orders.c.status == 'pending', orders.c.scheduled_time <= bindparam('now'))
+)
+
+SELECT_DUE = _SELECT_DUE_ROWS.order_by(orders.c.scheduled_time.asc(), orders.c.id.asc()).limit(bindparam('limit'))
+
+# Due basket legs of the given bulk schedules, to complete baskets a limited SELECT_DUE cut short
+SELECT_DUE_BASKET_LEGS = _SELECT_DUE_ROWS.where(
+    orders.c.bulk_audit_id.in_(bindparam('bulk_audit_ids', expanding=True)),
+    orders.c.basket_leg.isnot(None),
+)
+
+# Pending backlog size and highest order id, for the scheduler heartbeat's periodic recount
+SELECT_PENDING_SUMMARY = select(
+    func.count(orders.c.id).filter(orders.c.status == 'pending'),
+    func.max(orders.c.id),
+)
+
+# Pending orders and highest id among orders inserted after ``after_id``, between recounts
+SELECT_PENDING_ADDED = select(
+    func.count(orders.c.id).filter(orders.c.status == 'pending'),
+    func.max(orders.c.id),
+).where(orders.c.id > bindparam('after_id'))
+
+SELECT_NEXT_DEADLINE = select(func.min(orders.c.scheduled_time)).where(orders.c.status == 'pending')
+
+SELECT_MAX_POSITION = select(func.max(orders.c.dispatch_position)).where(
+    orders.c.scheduled_time == bindparam('scheduled_time'),
+)
+
+SET_POSITION = (
+    update(orders)
+    .where(orders.c.id == bindparam('order_id'), orders.c.dispatch_position.is_(None))
+    .values(dispatch_position=bindparam('position'))
+)
+
+# pending -> processing; the time guard skips orders rescheduled after being queued
+CLAIM_ORDER = (
+    update(orders)
+    .where(
+        orders.c.id == bindparam('order_id'),
+        orders.c.status == 'pending',
+        orders.c.scheduled_time <= bindparam('now'),
+    )
+    .values(status='processing')
+)
+
+_SELECT_ORDER_RECORDS = (
+    select(
+        orders.c.id,
+        orders.c.user_id,
+        orders.c.stock_symbol,
+        orders.c.quantity,
+        orders.c.order_type,
+        users.c.id.isnot(None),
+        users.c.api_key,
+        users.c.api_secret,
+        users.c.access_token,
+        instruments.c.lot_size,
+        instruments.c.freeze_qty,
+    )
+    .select_from(
+        orders.outerjoin(users, users.c.id == orders.c.user_id)
+        .outerjoin(instruments, instruments.c.tradingsymbol == orders.c.stock_symbol)
+    )
+)
+
+SELECT_ORDER_RECORD = _SELECT_ORDER_RECORDS.where(orders.c.id == bindparam('order_id'))
+
+# Batch claim used with the dispatch journal: one statement for a whole poll batch
+CLAIM_ORDERS = (
+    update(orders)
+    .where(
+        orders.c.id.in_(bindparam('order_ids', expanding=True)),
+        orders.c.status == 'pending',
+        orders.c.scheduled_time <= bindparam('now'),
+    )
+    .values(status='processing')
+    .returning(orders.c.id)
+)
+
+SELECT_ORDER_RECORDS = (
+    _SELECT_ORDER_RECORDS
+    .where(orders.c.id.in_(bindparam('order_ids', expanding=True)))
+    .order_by(orders.c.id)
+)
+
+FINISH_ORDER = (
+    update(orders)
+    .where(orders.c.id == bindparam('order_id'))
+    .values(status=bindparam('status'), kite_order_id=bindparam('kite_order_id'))
+)
+
+# Journal replay: only orders still in flight, so re-applying an outcome is a no-op
+FINISH_CLAIMED = (
+    update(orders)
+    .where(orders.c.id == bindparam('order_id'), orders.c.status == 'processing')
+    .values(status=bindparam('status'), kite_order_id=bindparam('kite_order_id'))
+)
+
+SELECT_ORDER_STATUS = select(orders.c.status).where(orders.c.id == bindparam('order_id'))
+
+# Whether an order already has a log entry with the given status (replay must not repeat one)
+SELECT_HAS_LOG = select(order_logs.c.id).where(
+    order_logs.c.scheduled_order_id == bindparam('order_id'), order_logs.c.status == bindparam('status'),
+).limit(1)
+
+REQUEUE_CLAIMED = (
+    update(orders)
+    .where(orders.c.id == bindparam('order_id'), orders.c.status == 'processing')
+    .values(status='pending')
+)
+
+INSERT_LOG = insert(order_logs)
+
+
+def encode_result(res) -> str:
+    try:
+        return json.dumps(res)
+    except Exception:
+        return str(res)
+
+
+def load_order_record(conn, order_id: int) -> Optional[OrderRecord]:
+    row = conn.execute(SELECT_ORDER_RECORD, {'order_id': order_id}).first()
+    return OrderRecord._make(row) if row is not None else None
+
+
+def claim_order(conn, order_id: int, now) -> bool:
+    claimed = conn.execute(CLAIM_ORDER, {'order_id': order_id, 'now': now}).rowcount > 0
+    if claimed:
+        touch(conn, 'orders')
+    return claimed
+
+
+def claim_orders(conn, order_ids, now) -> list:
+    """Claim due pending orders among ``order_ids`` in one UPDATE; returns their records in id order."""
+    claimed = [row[0] for row in conn.execute(CLAIM_ORDERS, {'order_ids': list(order_ids), 'now': now})]
+    if not claimed:
+        return []
+    touch(conn, 'orders')
+    rows = conn.execute(SELECT_ORDER_RECORDS, {'order_ids': claimed})
+    return [OrderRecord._make(row) for row in rows]
+
+
+def finish_order(conn, record: OrderRecord, status: str, kite_order_id: Optional[str], message: Optional[str]):
+    """Record the outcome and its execution log in the caller's transaction."""
+    conn.execute(FINISH_ORDER, {'order_id': record.id, 'status': status, 'kite_order_id': kite_order_id})
+    conn.execute(INSERT_LOG, {
+        'scheduled_order_id': record.id,
+        'user_id': record.user_id,
+        'status': status,
+        'message': message,
+    })
+    touch(conn, 'logs', 'orders')
@@ -0,0 +1,117 @@
+"""Fair ordering of orders that share a dispatch deadline.
+
+Orders due at the same ``scheduled_time`` form a burst. Within a burst the
+dispatch order is:
+
+1. higher priority tier first (max of the order's bulk-schedule priority and
+   the user's ``dispatch_priority``),
+2. round-robin across users (every user's first order before anyone's second),
+3. a per-burst pseudo-random rotation of users, seeded by the deadline.
+
+A user's legs of one basket schedule count as a single turn and stay adjacent,
+in leg order, so they can be dispatched as one unit (see dispatch_units).
+
+The rotation is a pure function of ``(scheduled_time, user_id)``, so every poll
+and every process agrees on it, yet the user who goes first changes from one
+burst to the next instead of always being the lowest id.
+"""
+import hashlib
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+
+class DueOrder(NamedTuple):
+    id: int
+    user_id: int
+    scheduled_time: object
+    priority: int
+    dispatch_position: Optional[int]
+    basket_id: Optional[int] = None  # bulk audit id for basket legs
+    basket_leg: Optional[int] = None
+
+
+def burst_seed(scheduled_time) -> str:
+    return scheduled_time.isoformat() if hasattr(scheduled_time, 'isoformat') else str(scheduled_time)
+
+
+def rotation_rank(user_id: int, seed: str) -> int:
+    """Stable pseudo-random rank of ``user_id`` within the burst identified by ``seed``.
+
+    Uses a real hash rather than crc32: crc32 is linear, so nearby seeds would
+    produce the same permutation.
+    """
+    digest = hashlib.blake2b(f'{seed}:{user_id}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def order_fairly(rows) -> list:
+    """Return ``rows`` (DueOrder-like) in fair dispatch order, earliest deadline first."""
+    bursts = defaultdict(list)
+    for row in rows:
+        bursts[row.scheduled_time].append(row)
+
+    ordered = []
+    for deadline in sorted(bursts):
+        burst = sorted(bursts[deadline], key=lambda r: r.id)
+        seed = burst_seed(deadline)
+        seen_per_user = defaultdict(int)
+        basket_turns = {}
+        keyed = []
+        for row in burst:
+            unit = (row.user_id, row.basket_id) if row.basket_id is not None else None
+            if unit is not None and unit in basket_turns:
+                turn = basket_turns[unit]
+            else:
+                turn = seen_per_user[row.user_id]
+                seen_per_user[row.user_id] += 1
+                if unit is not None:
+                    basket_turns[unit] = turn
+            leg = row.basket_leg if row.basket_leg is not None else 0
+            keyed.append(((-row.priority, turn, rotation_rank(row.user_id, seed), leg, row.id), row))
+        keyed.sort(key=lambda item: item[0])
+        ordered.extend(row for _, row in keyed)
+    return ordered
+
+
+def dispatch_units(ordered_rows) -> list:
+    """Group fairly ordered rows into dispatch units: a user's basket legs become one
+    list (in leg order), every other order a list of one."""
+    units = []
+    previous = None
+    for row in ordered_rows:
+        key = (row.user_id, row.basket_id, row.scheduled_time) if row.basket_id is not None else None
+        if key is not None and key == previous:
+            units[-1].append(row)
+        else:
+            units.append([row])
+        previous = key
+    return units
+
+
+class BurstPositions:
+    """Hands out 0-based dispatch positions per burst, continuing across polls.
+
+    ``start_for(scheduled_time)`` is asked once per burst for the highest position
+    already recorded (e.g. by a previous scheduler process) so positions stay
+    unique after restarts.
+    """
+
+    def __init__(self, max_bursts: int = 256):
+        self._next = {}
+        self._max_bursts = max_bursts
+
+    def assign(self, ordered_rows, start_for) -> list:
+        """Return ``[(order_id, position)]`` for rows that have no position yet."""
+        assigned = []
+        for row in ordered_rows:
+            if row.dispatch_position is not None:
+                continue
+            key = row.scheduled_time
+            if key not in self._next:
+                if len(self._next) >= self._max_bursts:
+                    self._next.pop(next(iter(self._next)))
+                last = start_for(key)
+                self._next[key] = 0 if last is None else last + 1
+            assigned.append((row.id, self._next[key]))
+            self._next[key] += 1
+        return assigned
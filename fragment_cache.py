@@ -0,0 +1,77 @@
+"""Rendered HTML fragments for the dashboard and logs pages, cached per resource version.
+
+Each fragment (the users table, the orders table, the recent-log panel, a page
+of /logs) is rendered from its own partial template and stored with the
+``resource_versions`` tag it was built from (see change_tracking). A refresh
+checks the versions with one small query. If no write has bumped them, the
+stored HTML is reused, and both the row queries and the Jinja rendering are
+skipped. Any write invalidates the fragments built from that resource, because
+its version changes.
+
+A fragment whose content also depends on the clock sets ``valid_until``. The
+users table uses it, since a token shows as expired once its expiry passes.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from flask import render_template
+from markupsafe import Markup
+
+from change_tracking import read_versions
+from config import FRAGMENT_CACHE_ENTRIES
+
+
+class FragmentCache:
+    """Thread-safe LRU of ``key -> (tag, valid_until, html)``."""
+
+    def __init__(self, max_entries: int = FRAGMENT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, tag: str, now: datetime) -> Optional[Markup]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != tag or (entry[1] is not None and now >= entry[1]):
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, tag: str, html: Markup, valid_until: Optional[datetime] = None):
+        with self._lock:
+            self._entries[key] = (tag, valid_until, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+fragments = FragmentCache()
+
+
+def version_tags(session, resources) -> dict:
+    """``{resource: tag}`` for ``resources``, read in one query; missing rows map to None."""
+    versions = read_versions(session, resources)
+    return {name: f'{name}.{versions[name][0]}' if name in versions else None for name in resources}
+
+
+def render_cached(key, tag: Optional[str], template: str, load, now: datetime) -> Markup:
+    """Return the cached ``template`` fragment for ``key`` or render it from ``load()``.
+
+    ``load`` returns ``(context, valid_until)`` and only runs on a miss. A None
+    ``tag`` (versions unavailable) always renders and caches nothing.
+    """
+    if tag is not None:
+        html = fragments.get(key, tag, now)
+        if html is not None:
+            return html
+    context, valid_until = load()
+    html = Markup(render_template(template, **context))
+    if tag is not None:
+        fragments.put(key, tag, html, valid_until)
+    return html
@@ -0,0 +1,148 @@
+"""Scheduler heartbeat snapshot for DB-free health and readiness probes.
+
+The scheduler updates the snapshot at the end of every poll and publishes it
+to ``HEARTBEAT_PATH`` (atomic rename), so web workers in other processes can
+serve ``/health`` and ``/ready`` from memory plus one ``stat()`` call instead of
+querying the database on every probe.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from config import HEARTBEAT_PATH, HEARTBEAT_STALE_SECONDS, DISPATCH_LAG_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat:
+    """Mutable snapshot owned by the scheduler process."""
+
+    def __init__(self, path: Optional[str] = HEARTBEAT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Optional callable overriding the local in-flight counter (shard processes)
+        self.in_flight_source = None
+        # Optional callable returning per-job SQL totals published with each loop
+        self.query_stats_source = None
+        self._state = {
+            'pid': os.getpid(),
+            'started_at': time.time(),
+            'last_loop_at': None,
+            'last_loop_ms': None,
+            'next_deadline': None,
+            'pending': None,
+            'in_flight': 0,
+            'loops': 0,
+            # longest expected gap between loops (the safety sweep in push mode)
+            'interval_seconds': None,
+        }
+
+    def set_interval(self, seconds: float):
+        with self._lock:
+            self._state['interval_seconds'] = seconds
+
+    def order_started(self, count: int = 1):
+        with self._lock:
+            self._in_flight += count
+
+    def order_finished(self, count: int = 1):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - count)
+
+    def in_flight(self) -> int:
+        source = self.in_flight_source
+        return source() if source is not None else self._in_flight
+
+    def loop_finished(self, started: float, pending: Optional[int], next_deadline: Optional[datetime]):
+        """Record a completed poll and publish the snapshot."""
+        now = time.time()
+        in_flight = self.in_flight()
+        with self._lock:
+            self._state.update({
+                'last_loop_at': now,
+                'last_loop_ms': round((now - started) * 1000, 2),
+                'next_deadline': next_deadline.isoformat() if next_deadline else None,
+                'pending': pending,
+                'in_flight': in_flight,
+                'loops': self._state['loops'] + 1,
+            })
+            if self.query_stats_source is not None:
+                self._state['query_stats'] = self.query_stats_source()
+            snapshot = dict(self._state)
+        self._publish(snapshot)
+
+    def snapshot(self) -> dict:
+        in_flight = self.in_flight()
+        with self._lock:
+            return dict(self._state, in_flight=in_flight)
+
+    def _publish(self, snapshot: dict):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.heartbeat-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(snapshot, fh)
+            os.replace(tmp, self.path)
+        except Exception:
+            logger.exception('Failed to publish scheduler heartbeat to %s', self.path)
+
+
+class HeartbeatReader:
+    """Reads the published snapshot, re-parsing the file only when its mtime changes."""
+
+    def __init__(self, path: Optional[str] = HEARTBEAT_PATH):
+        self.path = path
+        self._mtime = None
+        self._snapshot = None
+
+    def read(self) -> Optional[dict]:
+        if not self.path:
+            return None
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            try:
+                with open(self.path) as fh:
+                    self._snapshot = json.load(fh)
+                self._mtime = mtime
+            except (OSError, ValueError):
+                return self._snapshot
+        return self._snapshot
+
+
+def assess(snapshot: Optional[dict], now: Optional[float] = None, now_ist: Optional[datetime] = None) -> dict:
+    """Evaluate a snapshot against the staleness thresholds.
+
+    Returns ``{'ready': bool, 'reasons': [...], 'heartbeat_age_seconds': float|None, 'scheduler': snapshot}``.
+    """
+    now = time.time() if now is None else now
+    reasons = []
+    age = None
+    if not snapshot or snapshot.get('last_loop_at') is None:
+        reasons.append('no scheduler heartbeat')
+    else:
+        age = round(now - snapshot['last_loop_at'], 3)
+        limit = max(HEARTBEAT_STALE_SECONDS, 2 * (snapshot.get('interval_seconds') or 0))
+        if age > limit:
+            reasons.append(f'heartbeat is {age:.1f}s old (limit {limit:g}s)')
+        deadline = snapshot.get('next_deadline')
+        if deadline and now_ist is not None and snapshot.get('pending'):
+            lag = (now_ist - datetime.fromisoformat(deadline)).total_seconds()
+            if lag > DISPATCH_LAG_SECONDS:
+                reasons.append(f'pending orders overdue by {lag:.1f}s (limit {DISPATCH_LAG_SECONDS}s)')
+    return {
+        'ready': not reasons,
+        'reasons': reasons,
+        'heartbeat_age_seconds': age,
+        'scheduler': snapshot,
+    }
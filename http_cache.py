@@ -0,0 +1,100 @@
+"""Conditional GET support and in-memory payload cache for JSON endpoints.
+
+A response is identified by the versions of the resources it is built from
+(see change_tracking). Checking them is one primary-key lookup on the small
+``resource_versions`` table, so an unchanged resource is answered with
+``304 Not Modified`` (or the cached serialized body) without touching the main
+tables. Cached bodies are invalidated implicitly: any write bumps the version
+and the next request rebuilds. Order claims and results reach the versions up
+to ``VERSION_PUBLISH_SECONDS`` after they commit (see change_tracking).
+"""
+import logging
+import threading
+from email.utils import format_datetime
+from datetime import timezone
+
+from flask import Response, jsonify, request
+
+from change_tracking import read_versions
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadCache:
+    """Thread-safe ``key -> (etag, last_modified, body)`` store."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == etag:
+            return entry
+        return None
+
+    def put(self, key, etag, last_modified, body):
+        with self._lock:
+            self._entries[key] = (etag, last_modified, body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+payload_cache = PayloadCache()
+
+
+def current_etag(key: str, resources) -> tuple:
+    """Return ``(etag, last_modified)`` for ``key`` built from ``resources``, or ``(None, None)``."""
+    try:
+        versions = read_versions(db.session, resources)
+    except Exception:
+        logger.exception('Could not read resource versions for %s', key)
+        db.session.rollback()
+        return None, None
+    if len(versions) != len(resources):
+        return None, None
+    tag = '-'.join(f'{name}.{versions[name][0]}' for name in resources)
+    stamps = [versions[name][1] for name in resources if versions[name][1] is not None]
+    last_modified = max(stamps).replace(tzinfo=timezone.utc) if stamps else None
+    return f'"{key}:{tag}"', last_modified
+
+
+def _not_modified(etag, last_modified) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains(etag.strip('"'))
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _with_validators(response: Response, etag, last_modified) -> Response:
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+    response.headers.setdefault('Cache-Control', 'no-cache')
+    return response
+
+
+def cached_json(key: str, resources, build):
+    """Serve ``build()`` as JSON with ETag/Last-Modified, a 304 or a cached body.
+
+    ``resources`` lists the change-tracked resources the payload depends on;
+    ``build`` is only called when one of them changed since the cached body.
+    """
+    resources = tuple(resources)
+    etag, last_modified = current_etag(key, resources)
+    if etag is None:
+        return jsonify(build())
+    if _not_modified(etag, last_modified):
+        return _with_validators(Response(status=304), etag, last_modified)
+
+    entry = payload_cache.get(key, etag)
+    if entry is None:
+        body = jsonify(build()).get_data()
+        payload_cache.put(key, etag, last_modified, body)
+    else:
+        body = entry[2]
+    return _with_validators(Response(body, mimetype='application/json'), etag, last_modified)
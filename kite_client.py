@@ -1,12 +1,26 @@
 import logging
+import threading
 from config import KITE_ENABLE_REAL
-try:
-    from kiteconnect import KiteConnect
-except Exception:
-    KiteConnect = None
 
 logger = logging.getLogger(__name__)
 
+# kiteconnect pulls in requests/urllib3/etc., so it is only imported the first
+# time a client is actually needed. False means the import was tried and failed.
+_kiteconnect_cls = None
+
+
+def get_kiteconnect_class():
+    """Return the KiteConnect class, importing it on first use (None if unavailable)."""
+    global _kiteconnect_cls
+    if _kiteconnect_cls is None:
+        try:
+            from kiteconnect import KiteConnect
+        except Exception:
+            logger.exception("kiteconnect is not available")
+            KiteConnect = False
+        _kiteconnect_cls = KiteConnect
+    return _kiteconnect_cls or None
+
 
 class KiteClientWrapper:
     """Wrapper that either calls real KiteConnect or simulates orders.
@@ -23,6 +37,7 @@ class KiteClientWrapper:
 
         if KITE_ENABLE_REAL:
             try:
+                KiteConnect = get_kiteconnect_class()
                 self.kite = KiteConnect(api_key=self.api_key)
                 if access_token:
                     self.kite.set_access_token(access_token)
@@ -58,3 +73,32 @@ class KiteClientWrapper:
         logger.info("Simulating %s order for %s x%d", tx, tradingsymbol, quantity)
         fake_order_id = f"SIM-{tradingsymbol}-{tx}-{quantity}"
         return {"status": "success", "order_id": fake_order_id, "raw": {"simulated": True}}
+
+
+class ClientCache:
+    """Thread-safe cache of KiteClientWrapper instances keyed by KiteUser id.
+
+    Reusing a client keeps its HTTP session (and pooled connection to the broker)
+    warm across orders. An entry is rebuilt when the user's credentials change.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, api_key: str, api_secret: str, access_token: str = None) -> KiteClientWrapper:
+        key = (api_key, api_secret, access_token)
+        entry = self._clients.get(user_id)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        client = KiteClientWrapper(api_key, api_secret, access_token)
+        with self._lock:
+            self._clients[user_id] = (key, client)
+        return client
+
+    def discard(self, user_id: int):
+        with self._lock:
+            self._clients.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._clients)
@@ -0,0 +1,273 @@
+"""Kite login bookkeeping off the request path: profile hydration and token re-validation.
+
+The login callback only exchanges the request token and stores the access
+token (see app.kite_callback). Copying profile fields (name, e-mail, exchanges,
+products, avatar...) onto the KiteUser is queued to :data:`hydrator`. This
+background thread drains the queue in batches and writes each batch with one
+executemany UPDATE. If one row conflicts with another user (``user_id`` is
+unique), the batch is written row by row so only that row is lost.
+``generate_session`` already returns the profile, so
+hydration normally costs no broker call. ``profile()`` is only fetched when the
+payload lacks it.
+
+A user whose token is newer than ``profile_synced_at`` still needs hydration.
+The scheduler re-queues such users when it starts, so nothing is lost when a web
+worker restarts mid-rush.
+
+:func:`revalidate_tokens` checks every stored token against ``profile()`` from a
+thread pool. Valid tokens refresh the profile. Rejected tokens are cleared, so
+bulk schedules stop targeting those users.
+"""
+import logging
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import bindparam, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+import clock
+from change_tracking import bump
+from config import HYDRATE_BATCH_SIZE, HYDRATE_BATCH_WAIT_SECONDS, TOKEN_VALIDATION_WORKERS
+from kite_client import get_kiteconnect_class
+from models import KiteUser
+
+logger = logging.getLogger(__name__)
+
+# Kite access tokens expire at 06:00 IST the next morning
+TOKEN_EXPIRY_HOUR_IST = 6
+
+_users = KiteUser.__table__
+
+# profile key -> KiteUser column; list values are stored comma-separated
+PROFILE_FIELDS = {
+    'user_id': 'user_id',
+    'email': 'email',
+    'user_name': 'user_name',
+    'user_shortname': 'user_shortname',
+    'broker': 'broker',
+    'exchanges': 'exchanges',
+    'products': 'products',
+    'order_types': 'order_types',
+    'avatar_url': 'avatar_url',
+}
+
+
+def token_expiry(now_ist: datetime) -> datetime:
+    """Next 06:00 IST after ``now_ist`` (naive IST), as a naive UTC datetime comparable with utcnow()."""
+    expiry = now_ist.replace(hour=TOKEN_EXPIRY_HOUR_IST, minute=0, second=0, microsecond=0)
+    if now_ist.hour >= TOKEN_EXPIRY_HOUR_IST:
+        expiry += timedelta(days=1)
+    return expiry - clock.IST_OFFSET
+
+
+def profile_values(profile: dict) -> dict:
+    """KiteUser column values from a Kite profile / session payload."""
+    values = {}
+    for key, column in PROFILE_FIELDS.items():
+        value = profile.get(key)
+        if isinstance(value, (list, tuple)):
+            value = ','.join(value)
+        elif key == 'user_id' and value is not None:
+            value = str(value)
+        values[column] = value
+    return values
+
+
+def _kite(api_key: str, access_token: str):
+    KiteConnect = get_kiteconnect_class()
+    if KiteConnect is None:
+        raise RuntimeError('kiteconnect package is not installed')
+    kite = KiteConnect(api_key=api_key)
+    kite.set_access_token(access_token)
+    return kite
+
+
+# Profile write guarded by the token it was read with, so a hydration that was
+# overtaken by a newer login never overwrites the newer profile
+HYDRATE_USER = (
+    update(_users)
+    .where(_users.c.id == bindparam('uid'), _users.c.access_token == bindparam('token'))
+    .values(profile_synced_at=bindparam('synced_at'),
+            **{column: bindparam(f'p_{column}') for column in PROFILE_FIELDS.values()})
+)
+
+# Users whose current token has not been hydrated yet
+SELECT_UNHYDRATED = select(_users.c.id, _users.c.api_key, _users.c.access_token).where(
+    _users.c.access_token.isnot(None),
+    _users.c.token_expiry > bindparam('now'),
+    or_(_users.c.profile_synced_at.is_(None), _users.c.profile_synced_at < _users.c.token_set_at),
+)
+
+
+def _hydrate_params(user_id: int, access_token: str, profile: dict, synced_at: datetime) -> dict:
+    params = {'uid': user_id, 'token': access_token, 'synced_at': synced_at}
+    params.update({f'p_{column}': value for column, value in profile_values(profile).items()})
+    return params
+
+
+def _write_profiles(engine, params: list) -> int:
+    """Write ``HYDRATE_USER`` rows in one transaction, or row by row if the batch hits a conflict.
+
+    ``user_id`` is unique, so two KiteUser rows on the same Zerodha client make
+    one row fail. Only that row is skipped; the rest of the batch is written.
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(HYDRATE_USER, params)
+            bump(conn, 'users')
+        return len(params)
+    except IntegrityError:
+        if len(params) == 1:
+            logger.error('Could not write the Kite profile of user %s: it conflicts with another user',
+                         params[0]['uid'])
+            return 0
+        logger.warning('Profile batch of %s users hit a conflict; writing them one by one', len(params))
+    return sum(_write_profiles(engine, [row]) for row in params)
+
+
+class ProfileHydrator(threading.Thread):
+    """Background queue of ``(user_id, api_key, access_token, payload)`` written in batches."""
+
+    def __init__(self, batch_size: int = HYDRATE_BATCH_SIZE, wait: float = HYDRATE_BATCH_WAIT_SECONDS):
+        super().__init__(name='profile-hydrator', daemon=True)
+        self.batch_size = batch_size
+        self.wait = wait
+        self.engine = None
+        self._queue = queue.Queue()
+        self._running = False
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self, engine):
+        if self._running:
+            return
+        with self._start_lock:
+            if self._running:
+                return
+            self.engine = engine
+            self.start()
+            self._running = True
+
+    def enqueue(self, engine, user_id: int, api_key: str, access_token: str, payload: Optional[dict] = None):
+        self.ensure_started(engine)
+        self._queue.put((user_id, api_key, access_token, payload))
+
+    def requeue_unhydrated(self, engine) -> int:
+        """Queue users whose current token was never hydrated (e.g. a web worker died mid-rush)."""
+        with engine.connect() as conn:
+            rows = conn.execute(SELECT_UNHYDRATED, {'now': clock.utcnow()}).all()
+        for row in rows:
+            self.enqueue(engine, row.id, row.api_key, row.access_token)
+        if rows:
+            logger.info('Re-queued %s users awaiting profile hydration', len(rows))
+        return len(rows)
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        # keep collecting while logins keep arriving within ``wait`` of each other
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=self.wait))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception('Failed to hydrate profiles for users %s', [item[0] for item in batch])
+
+    def write(self, batch: list) -> int:
+        """Fetch missing profiles and write the batch, normally in one transaction."""
+        synced_at = clock.now_ist()
+        params = []
+        for user_id, api_key, access_token, payload in batch:
+            profile = payload if payload and 'exchanges' in payload else None
+            if profile is None:
+                try:
+                    profile = _kite(api_key, access_token).profile()
+                except Exception:
+                    logger.exception('Failed to fetch Kite profile for user %s', user_id)
+                    continue
+            params.append(_hydrate_params(user_id, access_token, profile, synced_at))
+        if not params:
+            return 0
+        written = _write_profiles(self.engine, params)
+        logger.info('Hydrated Kite profiles for %s users', written)
+        return written
+
+
+hydrator = ProfileHydrator()
+
+
+CLEAR_TOKEN = (
+    update(_users)
+    .where(_users.c.id == bindparam('uid'), _users.c.access_token == bindparam('token'))
+    .values(access_token=None, token_expiry=None, token_checked_at=bindparam('checked_at'))
+)
+
+MARK_CHECKED = (
+    update(_users)
+    .where(_users.c.id == bindparam('uid'))
+    .values(token_checked_at=bindparam('checked_at'))
+)
+
+
+def _is_token_error(exc: Exception) -> bool:
+    return type(exc).__name__ in ('TokenException', 'PermissionException')
+
+
+def _check_token(user) -> tuple:
+    try:
+        return user, 'valid', _kite(user.api_key, user.access_token).profile()
+    except Exception as e:
+        return user, ('invalid' if _is_token_error(e) else 'error'), str(e)
+
+
+def revalidate_tokens(engine, workers: int = TOKEN_VALIDATION_WORKERS) -> Counter:
+    """Check every unexpired token in parallel; refresh valid profiles, clear rejected tokens.
+
+    Returns counts of ``valid``, ``invalid`` (cleared) and ``error`` (network or
+    other failures; left untouched).
+    """
+    with engine.connect() as conn:
+        users = conn.execute(
+            select(_users.c.id, _users.c.api_key, _users.c.access_token)
+            .where(_users.c.access_token.isnot(None), _users.c.token_expiry > clock.utcnow())
+        ).all()
+    counts = Counter()
+    if not users:
+        return counts
+
+    checked_at = clock.now_ist()
+    hydrate, clear, checked = [], [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(users)))) as pool:
+        for user, outcome, detail in pool.map(_check_token, users):
+            counts[outcome] += 1
+            if outcome == 'valid':
+                hydrate.append(_hydrate_params(user.id, user.access_token, detail, checked_at))
+                checked.append({'uid': user.id, 'checked_at': checked_at})
+            elif outcome == 'invalid':
+                logger.info('Clearing rejected Kite token of user %s: %s', user.id, detail)
+                clear.append({'uid': user.id, 'token': user.access_token, 'checked_at': checked_at})
+            else:
+                logger.warning('Could not validate Kite token of user %s: %s', user.id, detail)
+
+    # token bookkeeping first and on its own, so a profile conflict cannot keep a rejected token live
+    if clear or checked:
+        with engine.begin() as conn:
+            if checked:
+                conn.execute(MARK_CHECKED, checked)
+            if clear:
+                conn.execute(CLEAR_TOKEN, clear)
+            bump(conn, 'users')
+    if hydrate:
+        _write_profiles(engine, hydrate)
+    logger.info('Token re-validation: %s', dict(counts))
+    return counts
@@ -0,0 +1,143 @@
+"""Streaming gzip export of scheduled order logs for reconciliation.
+
+``GET /logs/export`` walks ``scheduled_order_logs`` in ``created_at`` order
+(migration 11 indexes it) on a server-side cursor. Rows are encoded as CSV or
+NDJSON in chunks of ``LOG_EXPORT_CHUNK_ROWS``, and each chunk goes through one
+streaming gzip compressor before it is yielded. Memory stays constant whatever
+the range. Back-pressure comes from WSGI itself: the next chunk is only fetched
+once the server has written the previous one to the client.
+
+Log ``created_at`` is stored as naive UTC. Range filters are given in IST like
+every other time in the UI, and are converted here.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import select
+
+import clock
+from config import LOG_EXPORT_CHUNK_ROWS, LOG_EXPORT_MAX_DAYS
+from models import ScheduledOrder, ScheduledOrderLog
+
+FORMATS = ('csv', 'ndjson')
+
+_logs = ScheduledOrderLog.__table__
+_orders = ScheduledOrder.__table__
+
+FIELDS = ['id', 'created_at', 'scheduled_order_id', 'user_id', 'status', 'message',
+          'stock_symbol', 'order_type', 'quantity', 'kite_order_id', 'bulk_audit_id', 'parent_order_id']
+
+SELECT_EXPORT = (
+    select(
+        _logs.c.id, _logs.c.created_at, _logs.c.scheduled_order_id, _logs.c.user_id, _logs.c.status,
+        _logs.c.message, _orders.c.stock_symbol, _orders.c.order_type, _orders.c.quantity,
+        _orders.c.kite_order_id, _orders.c.bulk_audit_id, _orders.c.parent_order_id,
+    )
+    .select_from(_logs.outerjoin(_orders, _orders.c.id == _logs.c.scheduled_order_id))
+    .order_by(_logs.c.created_at, _logs.c.id)
+)
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def _ist_bound(value: str, end: bool) -> datetime:
+    """An IST date or datetime as naive UTC; a bare date covers the whole day."""
+    try:
+        if len(value) == 10:
+            day = date.fromisoformat(value)
+            moment = datetime.combine(day + timedelta(days=1) if end else day, time())
+        else:
+            moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportFilterError(f'{value!r} is not an ISO date or datetime')
+    return moment - clock.IST_OFFSET
+
+
+def parse_export_args(args) -> dict:
+    """Validate ``date`` or ``from``/``to`` (IST), ``user_id``, ``status`` (comma-separated) and ``format``."""
+    fmt = (args.get('format') or 'csv').lower()
+    if fmt not in FORMATS:
+        raise ExportFilterError(f"format must be one of {', '.join(FORMATS)}")
+    if args.get('date'):
+        start, end = _ist_bound(args['date'], False), _ist_bound(args['date'], True)
+    elif args.get('from'):
+        start = _ist_bound(args['from'], False)
+        end = _ist_bound(args['to'], True) if args.get('to') else clock.utcnow()
+    else:
+        raise ExportFilterError('date or from (IST) is required')
+    if end <= start:
+        raise ExportFilterError('to must be after from')
+    if end - start > timedelta(days=LOG_EXPORT_MAX_DAYS):
+        raise ExportFilterError(f'at most {LOG_EXPORT_MAX_DAYS} days per export')
+
+    filters = {'format': fmt, 'start': start, 'end': end}
+    user_ids = [u for value in args.getlist('user_id') for u in value.split(',') if u.strip()]
+    if user_ids:
+        try:
+            filters['user_ids'] = [int(u) for u in user_ids]
+        except ValueError:
+            raise ExportFilterError('user_id must be an integer')
+    statuses = [s.strip().lower() for value in args.getlist('status') for s in value.split(',') if s.strip()]
+    if statuses:
+        filters['statuses'] = statuses
+    return filters
+
+
+def export_query(filters: dict):
+    query = SELECT_EXPORT.where(_logs.c.created_at >= filters['start'], _logs.c.created_at < filters['end'])
+    if filters.get('user_ids'):
+        query = query.where(_logs.c.user_id.in_(filters['user_ids']))
+    if filters.get('statuses'):
+        query = query.where(_logs.c.status.in_(filters['statuses']))
+    return query
+
+
+def export_filename(filters: dict) -> str:
+    start = (filters['start'] + clock.IST_OFFSET).strftime('%Y%m%dT%H%M')
+    end = (filters['end'] + clock.IST_OFFSET).strftime('%Y%m%dT%H%M')
+    extension = 'csv' if filters['format'] == 'csv' else 'ndjson'
+    return f'order-logs-{start}-{end}.{extension}.gz'
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _csv_encoder(buffer):
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+
+    def encode(rows):
+        writer.writerows([_value(v) for v in row] for row in rows)
+    return encode
+
+
+def _ndjson_encoder(buffer):
+    def encode(rows):
+        buffer.writelines(json.dumps(dict(zip(FIELDS, map(_value, row)))) + '\n' for row in rows)
+    return encode
+
+
+def stream_export(engine, filters: dict, chunk_rows: int = LOG_EXPORT_CHUNK_ROWS):
+    """Yield gzip-compressed chunks of the export; the connection closes when the generator does."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    buffer = io.StringIO()
+    encode = (_csv_encoder if filters['format'] == 'csv' else _ndjson_encoder)(buffer)
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(export_query(filters))
+        for rows in result.partitions():
+            encode(rows)
+            chunk = compressor.compress(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+            if chunk:
+                yield chunk
+    tail = compressor.compress(buffer.getvalue().encode('utf-8')) + compressor.flush()
+    if tail:
+        yield tail
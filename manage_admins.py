@@ -13,13 +13,27 @@ def cli():
     pass
 
 
+@cli.command()
+def migrate():
+    """Create or upgrade the database schema."""
+    from migrations import upgrade, bootstrap_default_admin
+    app = create_app(mode='cli')
+    with app.app_context():
+        applied = upgrade(db.engine)
+        bootstrap_default_admin()
+    if applied:
+        click.echo(f"✓ Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        click.echo("Schema is up to date.")
+
+
 @cli.command()
 @click.option('--username', prompt='Username', help='Admin username')
 @click.option('--password', prompt=True, hide_input=True, confirmation_prompt=True, help='Admin password')
 @click.option('--email', prompt='Email (optional)', default='', help='Admin email')
 def create_admin(username, password, email):
     """Create a new admin user."""
-    app = create_app()
+    app = create_app(mode='cli')
     with app.app_context():
         # Check if admin already exists
         existing = Admin.query.filter_by(username=username).first()
@@ -46,7 +60,7 @@ def create_admin(username, password, email):
 @cli.command()
 def list_admins():
     """List all admin users."""
-    app = create_app()
+    app = create_app(mode='cli')
     with app.app_context():
         admins = Admin.query.all()
         if not admins:
@@ -68,7 +82,7 @@ def list_admins():
 @click.confirmation_option(prompt='Are you sure you want to delete this admin?')
 def delete_admin(username):
     """Delete an admin user."""
-    app = create_app()
+    app = create_app(mode='cli')
     with app.app_context():
         admin = Admin.query.filter_by(username=username).first()
         if not admin:
@@ -89,7 +103,7 @@ def delete_admin(username):
 @click.option('--password', prompt=True, hide_input=True, confirmation_prompt=True, help='New password')
 def change_password(username, password):
     """Change admin password."""
-    app = create_app()
+    app = create_app(mode='cli')
     with app.app_context():
         admin = Admin.query.filter_by(username=username).first()
         if not admin:
@@ -105,5 +119,26 @@ def change_password(username, password):
             click.echo(f"Error: {str(e)}", err=True)
 
 
+
+@cli.command()
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+def load_instruments(csv_path):
+    """Load per-symbol lot sizes and freeze quantities used to slice large orders.
+
+    CSV columns: tradingsymbol (or symbol), lot_size, freeze_qty, optional exchange and
+    instrument_token (needed for price triggers on the live tick feed).
+    """
+    from slicing import SliceError, load_instruments as load
+    app = create_app(mode='cli')
+    with app.app_context():
+        try:
+            with db.engine.begin() as conn:
+                count = load(conn, csv_path)
+        except SliceError as e:
+            click.echo(f"Error: {e}", err=True)
+            return
+    click.echo(f"✓ Loaded {count} instruments from {csv_path}")
+
+
 if __name__ == '__main__':
     cli()
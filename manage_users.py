@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Bulk Kite user management CLI tool for Kite Order Scheduler."""
+
+import json
+import sys
+from collections import Counter
+
+import click
+from app import create_app
+from models import db
+from bulk_users import DEFAULT_BATCH_SIZE, detect_format, export_users, iter_records, upsert_users
+
+
+@click.group()
+def cli():
+    """Kite user bulk import/export commands."""
+    pass
+
+
+@cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Input format (default: from file extension, csv otherwise)')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per transaction')
+@click.option('--no-update', is_flag=True, help='Leave existing users untouched even if api_secret differs')
+@click.option('--report', type=click.File('w'), default=None, help='Write per-row results as JSONL to this file')
+@click.option('--quiet', is_flag=True, help='Only print the summary')
+def import_users(path, fmt, batch_size, no_update, report, quiet):
+    """Upsert users from a CSV/JSONL file with api_key and api_secret fields."""
+    fmt = detect_format(path, fmt)
+    app = create_app(mode='cli')
+    counts = Counter()
+    with app.app_context():
+        stream = sys.stdin if path == '-' else open(path, newline='' if fmt == 'csv' else None, encoding='utf-8')
+        try:
+            records = iter_records(stream, fmt)
+            for result in upsert_users(db.session, records, batch_size=batch_size, update_existing=not no_update):
+                counts[result.status] += 1
+                if report:
+                    report.write(json.dumps(result.to_dict()) + '\n')
+                if not quiet and result.status in ('invalid', 'duplicate'):
+                    click.echo(f"line {result.line}: {result.status} {result.api_key_preview} {result.message}".rstrip(),
+                               err=True)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    summary = ', '.join(f"{k}={counts[k]}" for k in ('created', 'updated', 'unchanged', 'duplicate', 'invalid'))
+    click.echo(f"✓ Import finished: {summary}")
+
+
+@cli.command('export-users')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Output file (default: stdout)')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--include-secrets', is_flag=True, help='Include api_secret so the file can be re-imported')
+def export_users_cmd(output, fmt, include_secrets):
+    """Stream all users to CSV/JSONL."""
+    app = create_app(mode='cli')
+    with app.app_context():
+        count = export_users(db.session, output, fmt, include_secrets=include_secrets)
+    click.echo(f"✓ Exported {count} users", err=True)
+
+
+@cli.command('revalidate-tokens')
+@click.option('--workers', default=None, type=int, help='Parallel profile() checks (default: TOKEN_VALIDATION_WORKERS)')
+def revalidate_tokens_cmd(workers):
+    """Check every stored access token; refresh profiles of valid ones and clear rejected ones."""
+    from kite_sessions import revalidate_tokens
+    from config import TOKEN_VALIDATION_WORKERS
+    app = create_app(mode='cli')
+    with app.app_context():
+        counts = revalidate_tokens(db.engine, workers or TOKEN_VALIDATION_WORKERS)
+    summary = ', '.join(f"{k}={counts[k]}" for k in ('valid', 'invalid', 'error'))
+    click.echo(f"✓ Token re-validation finished: {summary}")
+
+
+if __name__ == '__main__':
+    cli()
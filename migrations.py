@@ -0,0 +1,192 @@
+"""Explicit schema management.
+
+Web workers and CLI commands no longer create tables on boot; instead the schema
+is brought up to date by running ``python manage_admins.py migrate`` (or by
+starting the app in ``all`` mode, which does it for local development).
+
+Each migration is a ``(version, description, fn)`` tuple. ``fn`` receives an open
+connection inside a transaction and must be idempotent, because a fresh database
+gets every table from ``create_all`` in the baseline migration and later
+migrations then run against tables that may already have their columns.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+
+from models import db, Admin, ResourceVersion
+
+logger = logging.getLogger(__name__)
+
+_meta = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _meta,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(256), nullable=True),
+    Column('applied_at', DateTime, default=datetime.utcnow),
+)
+
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    """Add ``column`` to ``table`` unless it already exists."""
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def _create_index(conn, name: str, table: str, columns: str):
+    existing = {i['name'] for i in inspect(conn).get_indexes(table)}
+    if name not in existing:
+        conn.execute(text(f'CREATE INDEX {name} ON {table} ({columns})'))
+
+
+def _baseline(conn):
+    db.metadata.create_all(bind=conn)
+
+
+def _order_bulk_audit_link(conn):
+    _add_column(conn, 'scheduled_orders', 'bulk_audit_id', 'INTEGER REFERENCES scheduled_order_bulk_audits(id)')
+    _create_index(conn, 'ix_scheduledorder_bulk_audit_id', 'scheduled_orders', 'bulk_audit_id')
+
+
+def _dispatch_fairness(conn):
+    _add_column(conn, 'kite_users', 'dispatch_priority', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'scheduled_order_bulk_audits', 'priority', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'scheduled_orders', 'priority', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column(conn, 'scheduled_orders', 'dispatch_position', 'INTEGER')
+
+
+def _seed_resource_versions(conn):
+    """Insert a counter row for every tracked resource that does not have one yet."""
+    from change_tracking import RESOURCES
+    table = ResourceVersion.__table__
+    existing = {row[0] for row in conn.execute(select(table.c.name))}
+    for name in RESOURCES:
+        if name not in existing:
+            conn.execute(table.insert().values(name=name, version=0, updated_at=datetime.utcnow()))
+
+
+def _resource_versions(conn):
+    ResourceVersion.__table__.create(bind=conn, checkfirst=True)
+    _seed_resource_versions(conn)
+
+
+def _recurring_schedules(conn):
+    from models import RecurringSchedule
+    RecurringSchedule.__table__.create(bind=conn, checkfirst=True)
+    _seed_resource_versions(conn)
+
+
+def _basket_schedules(conn):
+    _add_column(conn, 'scheduled_order_bulk_audits', 'kind', "VARCHAR(16) NOT NULL DEFAULT 'single'")
+    _add_column(conn, 'scheduled_order_bulk_audits', 'legs', 'TEXT')
+    _add_column(conn, 'scheduled_orders', 'basket_leg', 'INTEGER')
+
+
+def _order_notify_trigger(conn):
+    """PostgreSQL only: NOTIFY the scheduler when a row becomes or stays pending."""
+    if conn.dialect.name != 'postgresql':
+        return
+    from order_notify import CHANNEL
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION notify_scheduled_orders() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{CHANNEL}', NEW.scheduled_time::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text('DROP TRIGGER IF EXISTS scheduled_orders_notify ON scheduled_orders'))
+    conn.execute(text("""
+        CREATE TRIGGER scheduled_orders_notify
+        AFTER INSERT OR UPDATE OF status, scheduled_time ON scheduled_orders
+        FOR EACH ROW WHEN (NEW.status = 'pending')
+        EXECUTE PROCEDURE notify_scheduled_orders()
+    """))
+
+
+def _order_slicing(conn):
+    from models import Instrument
+    Instrument.__table__.create(bind=conn, checkfirst=True)
+    _add_column(conn, 'scheduled_orders', 'parent_order_id', 'INTEGER REFERENCES scheduled_orders(id)')
+    _add_column(conn, 'scheduled_orders', 'slice_index', 'INTEGER')
+    _create_index(conn, 'ix_scheduledorder_parent_order_id', 'scheduled_orders', 'parent_order_id')
+    _seed_resource_versions(conn)
+
+
+def _price_triggers(conn):
+    _add_column(conn, 'scheduled_orders', 'trigger_price', 'FLOAT')
+    _add_column(conn, 'scheduled_orders', 'trigger_direction', 'VARCHAR(8)')
+    _add_column(conn, 'instruments', 'instrument_token', 'INTEGER')
+    _create_index(conn, 'ix_scheduledorder_status', 'scheduled_orders', 'status')
+
+
+def _kite_session_tracking(conn):
+    _add_column(conn, 'kite_users', 'profile_synced_at', 'TIMESTAMP')
+    _add_column(conn, 'kite_users', 'token_checked_at', 'TIMESTAMP')
+
+
+def _log_export(conn):
+    _create_index(conn, 'ix_scheduledorderlog_created_at', 'scheduled_order_logs', 'created_at')
+    if conn.dialect.name == 'postgresql':
+        # full broker responses; SQLite never enforced the old VARCHAR(1024)
+        conn.execute(text('ALTER TABLE scheduled_order_logs ALTER COLUMN message TYPE TEXT'))
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline),
+    (2, 'link scheduled orders to their bulk audit', _order_bulk_audit_link),
+    (3, 'dispatch priority tiers and burst positions', _dispatch_fairness),
+    (4, 'resource version counters', _resource_versions),
+    (5, 'recurring schedules', _recurring_schedules),
+    (6, 'basket schedules', _basket_schedules),
+    (7, 'scheduled order notification trigger', _order_notify_trigger),
+    (8, 'instruments and freeze-limit order slices', _order_slicing),
+    (9, 'price-triggered orders', _price_triggers),
+    (10, 'kite profile hydration and token checks', _kite_session_tracking),
+    (11, 'order log created_at index and untruncated messages', _log_export),
+]
+
+
+def applied_versions(engine) -> set:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table('schema_migrations'):
+            return set()
+        return {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def upgrade(engine) -> list:
+    """Apply pending migrations in order. Returns the list of versions applied."""
+    _meta.create_all(bind=engine)
+    done = applied_versions(engine)
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow(),
+            ))
+        logger.info('Applied migration %s: %s', version, description)
+        applied.append(version)
+    return applied
+
+
+def bootstrap_default_admin():
+    """Create the admin named by DEFAULT_ADMIN_USERNAME/PASSWORD if it does not exist.
+
+    Must be called inside an application context.
+    """
+    from config import DEFAULT_ADMIN_USERNAME, DEFAULT_ADMIN_PASSWORD
+    if not (DEFAULT_ADMIN_USERNAME and DEFAULT_ADMIN_PASSWORD):
+        return False
+    existing = Admin.query.filter_by(username=DEFAULT_ADMIN_USERNAME).first()
+    if existing:
+        return False
+    admin = Admin(username=DEFAULT_ADMIN_USERNAME)
+    admin.set_password(DEFAULT_ADMIN_PASSWORD)
+    db.session.add(admin)
+    db.session.commit()
+    print(f"[INFO] Default admin '{DEFAULT_ADMIN_USERNAME}' created from environment variables")
+    return True
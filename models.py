@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+import json
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Index
@@ -24,6 +25,9 @@ class KiteUser(db.Model):
     order_types = db.Column(db.String(256), nullable=True)  # comma-separated list
     avatar_url = db.Column(db.String(1024), nullable=True)
     token_set_at = db.Column(db.DateTime, nullable=True)
+    profile_synced_at = db.Column(db.DateTime, nullable=True)  # IST, like token_set_at; older means hydration pending
+    token_checked_at = db.Column(db.DateTime, nullable=True)  # IST time of the last bulk re-validation
+    dispatch_priority = db.Column(db.Integer, nullable=False, default=0)  # higher tiers are dispatched first
 
     @property
     def api_key_preview(self) -> str:
@@ -52,6 +56,9 @@ class KiteUser(db.Model):
             "products": self.products.split(",") if self.products else [],
             "order_types": self.order_types.split(",") if self.order_types else [],
             "avatar_url": self.avatar_url,
+            "dispatch_priority": self.dispatch_priority,
+            "profile_synced_at": self.profile_synced_at.isoformat() if self.profile_synced_at else None,
+            "token_checked_at": self.token_checked_at.isoformat() if self.token_checked_at else None,
         }
 
 
@@ -63,13 +70,24 @@ class ScheduledOrder(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     order_type = db.Column(db.String(8), nullable=False)  # buy or sell
     scheduled_time = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(32), default="pending")  # pending, completed, failed
+    status = db.Column(db.String(32), default="pending")  # armed, pending, processing, completed, failed, cancelled, partial
     kite_order_id = db.Column(db.String(128), nullable=True)
+    bulk_audit_id = db.Column(db.Integer, db.ForeignKey('scheduled_order_bulk_audits.id'), nullable=True)
+    priority = db.Column(db.Integer, nullable=False, default=0)  # copied from the bulk schedule
+    dispatch_position = db.Column(db.Integer, nullable=True)  # 0-based position within its same-second burst
+    basket_leg = db.Column(db.Integer, nullable=True)  # 0-based leg index when part of a basket schedule
+    parent_order_id = db.Column(db.Integer, db.ForeignKey('scheduled_orders.id'), nullable=True)  # set on freeze-limit slices
+    slice_index = db.Column(db.Integer, nullable=True)  # 0-based position among the parent's slices
+    trigger_price = db.Column(db.Float, nullable=True)  # price-triggered orders wait as 'armed' until LTP crosses it
+    trigger_direction = db.Column(db.String(8), nullable=True)  # above (LTP >= price) or below (LTP <= price)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     __table_args__ = (
         Index('ix_scheduledorder_scheduled_time_status', 'scheduled_time', 'status'),
+        Index('ix_scheduledorder_bulk_audit_id', 'bulk_audit_id'),
+        Index('ix_scheduledorder_parent_order_id', 'parent_order_id'),
+        Index('ix_scheduledorder_status', 'status'),
     )
 
     def to_dict(self):
@@ -82,6 +100,14 @@ class ScheduledOrder(db.Model):
             "scheduled_time": self.scheduled_time.isoformat(),
             "status": self.status,
             "kite_order_id": self.kite_order_id,
+            "bulk_audit_id": self.bulk_audit_id,
+            "priority": self.priority,
+            "dispatch_position": self.dispatch_position,
+            "basket_leg": self.basket_leg,
+            "parent_order_id": self.parent_order_id,
+            "slice_index": self.slice_index,
+            "trigger_price": self.trigger_price,
+            "trigger_direction": self.trigger_direction,
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
         }
@@ -93,9 +119,13 @@ class ScheduledOrderLog(db.Model):
     scheduled_order_id = db.Column(db.Integer, db.ForeignKey('scheduled_orders.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('kite_users.id'), nullable=False)
     status = db.Column(db.String(64), nullable=False)
-    message = db.Column(db.String(1024), nullable=True)
+    message = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_scheduledorderlog_created_at', 'created_at'),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -117,24 +147,102 @@ class ScheduledOrderBulkAudit(db.Model):
     scheduled_time = db.Column(db.DateTime, nullable=False)
     users_targeted = db.Column(db.Integer, nullable=False, default=0)
     users_created = db.Column(db.Integer, nullable=False, default=0)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    kind = db.Column(db.String(16), nullable=False, default='single')  # single or basket
+    legs = db.Column(db.Text, nullable=True)  # basket legs as JSON [{stock_symbol, quantity, order_type}]
     message = db.Column(db.String(1024), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @property
+    def leg_list(self):
+        return json.loads(self.legs) if self.legs else []
+
     def to_dict(self):
         return {
             'id': self.id,
             'initiator': self.initiator,
+            'kind': self.kind,
+            'legs': self.leg_list,
             'stock_symbol': self.stock_symbol,
             'quantity': self.quantity,
             'order_type': self.order_type,
             'scheduled_time': self.scheduled_time.isoformat(),
             'users_targeted': self.users_targeted,
             'users_created': self.users_created,
+            'priority': self.priority,
             'message': self.message,
             'created_at': self.created_at.isoformat(),
         }
 
 
+class Instrument(db.Model):
+    """Per-symbol exchange limits used to slice large orders (see slicing.py)."""
+    __tablename__ = 'instruments'
+    id = db.Column(db.Integer, primary_key=True)
+    tradingsymbol = db.Column(db.String(64), unique=True, nullable=False)
+    exchange = db.Column(db.String(16), nullable=False, default='NSE')
+    lot_size = db.Column(db.Integer, nullable=False, default=1)
+    freeze_qty = db.Column(db.Integer, nullable=True)  # orders of this quantity or more are rejected
+    instrument_token = db.Column(db.Integer, nullable=True)  # KiteTicker subscription id for price triggers
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tradingsymbol': self.tradingsymbol,
+            'exchange': self.exchange,
+            'lot_size': self.lot_size,
+            'freeze_qty': self.freeze_qty,
+            'instrument_token': self.instrument_token,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
+class RecurringSchedule(db.Model):
+    """A bulk schedule that repeats on given weekdays.
+
+    Rows are only turned into ScheduledOrders shortly before each occurrence
+    (see recurring.py), so scheduled_orders never holds pre-expanded future days.
+    """
+    __tablename__ = 'recurring_schedules'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128), nullable=True)
+    weekdays = db.Column(db.String(32), nullable=False, default='0,1,2,3,4')  # Monday=0, comma-separated
+    time_of_day = db.Column(db.Time, nullable=False)  # IST
+    stock_symbol = db.Column(db.String(64), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    order_type = db.Column(db.String(16), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    user_ids = db.Column(db.String(4096), nullable=True)  # comma-separated KiteUser ids; empty = all active users
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    last_materialized_on = db.Column(db.Date, nullable=True)  # IST date of the last occurrence materialized
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def weekday_list(self):
+        return [int(d) for d in self.weekdays.split(',') if d.strip()]
+
+    @property
+    def user_id_list(self):
+        return [int(u) for u in self.user_ids.split(',') if u.strip()] if self.user_ids else []
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'weekdays': self.weekday_list,
+            'time_of_day': self.time_of_day.strftime('%H:%M:%S'),
+            'stock_symbol': self.stock_symbol,
+            'quantity': self.quantity,
+            'order_type': self.order_type,
+            'priority': self.priority,
+            'user_ids': self.user_id_list,
+            'active': self.active,
+            'last_materialized_on': self.last_materialized_on.isoformat() if self.last_materialized_on else None,
+            'created_at': self.created_at.isoformat(),
+        }
+
+
 class Admin(db.Model):
     __tablename__ = 'admins'
     id = db.Column(db.Integer, primary_key=True)
@@ -158,3 +266,22 @@ class Admin(db.Model):
             'email': self.email,
             'created_at': self.created_at.isoformat(),
         }
+
+
+class ResourceVersion(db.Model):
+    """Change counter per resource, bumped in the same transaction as every write.
+
+    Read-heavy endpoints derive ETag/Last-Modified from this small table instead
+    of re-querying the main tables (see change_tracking.py).
+    """
+    __tablename__ = 'resource_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -0,0 +1,134 @@
+"""Set-based cancel/reschedule of pending scheduled orders.
+
+Every action is a single conditional ``UPDATE ... WHERE status = 'pending'`` so
+it is race-safe against the scheduler's claim (which flips pending -> processing
+under the same condition): whichever commits first wins and the other matches
+zero rows for that order. Cancel also covers ``armed`` price-triggered orders,
+whose firing is guarded the same way (see triggers.py).
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, insert, select, update
+
+import clock
+from change_tracking import bump
+from models import ScheduledOrder, ScheduledOrderLog
+
+FILTER_FIELDS = ('bulk_audit_id', 'stock_symbol', 'user_id', 'scheduled_from', 'scheduled_to')
+
+
+class OrderFilterError(ValueError):
+    pass
+
+
+def parse_filters(data) -> dict:
+    """Build a filter dict from request JSON/form data, validating types.
+
+    At least one filter is required so a bare request can never touch every order.
+    """
+    filters = {}
+    for key in ('bulk_audit_id', 'user_id'):
+        value = data.get(key)
+        if value not in (None, ''):
+            try:
+                filters[key] = int(value)
+            except (TypeError, ValueError):
+                raise OrderFilterError(f'{key} must be an integer')
+    symbol = data.get('stock_symbol')
+    if symbol:
+        filters['stock_symbol'] = symbol.strip().upper()
+    for key in ('scheduled_from', 'scheduled_to'):
+        value = data.get(key)
+        if value:
+            try:
+                filters[key] = datetime.fromisoformat(value)
+            except ValueError:
+                raise OrderFilterError(f'{key} must be ISO format')
+    if not filters:
+        raise OrderFilterError(f"at least one of {', '.join(FILTER_FIELDS)} is required")
+    return filters
+
+
+def _conditions(filters: dict, statuses=('pending',)) -> list:
+    conds = [ScheduledOrder.status.in_(statuses)]
+    if 'bulk_audit_id' in filters:
+        conds.append(ScheduledOrder.bulk_audit_id == filters['bulk_audit_id'])
+    if 'stock_symbol' in filters:
+        conds.append(ScheduledOrder.stock_symbol == filters['stock_symbol'])
+    if 'user_id' in filters:
+        conds.append(ScheduledOrder.user_id == filters['user_id'])
+    if 'scheduled_from' in filters:
+        conds.append(ScheduledOrder.scheduled_time >= filters['scheduled_from'])
+    if 'scheduled_to' in filters:
+        conds.append(ScheduledOrder.scheduled_time <= filters['scheduled_to'])
+    return conds
+
+
+def _log_rows(session, rows, status: str, message: str):
+    if rows:
+        session.execute(insert(ScheduledOrderLog), [
+            {'scheduled_order_id': r.id, 'user_id': r.user_id, 'status': status, 'message': message}
+            for r in rows
+        ])
+        bump(session, 'logs', 'orders')
+
+
+def cancel_pending_orders(session, filters: dict, reason: Optional[str] = None) -> list:
+    """Cancel all pending (or armed price-triggered) orders matching ``filters``. Returns the cancelled order ids."""
+    now = clock.utcnow()
+    rows = session.execute(
+        update(ScheduledOrder)
+        .where(*_conditions(filters, ('pending', 'armed')))
+        .values(status='cancelled', updated_at=now)
+        .returning(ScheduledOrder.id, ScheduledOrder.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _log_rows(session, rows, 'cancelled', reason or 'Cancelled by bulk action')
+    session.commit()
+    return [r.id for r in rows]
+
+
+def _shifted(column, shift: timedelta, dialect: str):
+    """``column + shift`` evaluated in SQL, for a whole number of seconds."""
+    if dialect == 'sqlite':
+        # datetime() drops the fraction; a whole-second shift leaves the stored '.ffffff' suffix as it is
+        moved = func.strftime('%Y-%m-%d %H:%M:%S', column, f'{int(shift.total_seconds()):+d} seconds')
+        return moved.op('||')(func.substr(column, 20))
+    return column + shift
+
+
+def reschedule_pending_orders(session, filters: dict, new_time: Optional[datetime] = None,
+                              shift: Optional[timedelta] = None) -> list:
+    """Move pending orders matching ``filters`` to ``new_time`` or by ``shift``.
+
+    Either way it is one UPDATE; a shift is computed per row by the database.
+    Returns the rescheduled order ids.
+    """
+    if (new_time is None) == (shift is None):
+        raise OrderFilterError('exactly one of scheduled_time or shift_seconds is required')
+    now = clock.utcnow()
+    conds = _conditions(filters)
+    if new_time is not None:
+        if new_time <= clock.now_ist():
+            raise OrderFilterError('Cannot reschedule orders into the past')
+        target = new_time
+    else:
+        earliest = session.execute(select(func.min(ScheduledOrder.scheduled_time)).where(*conds)).scalar()
+        if earliest is not None and earliest + shift <= clock.now_ist():
+            session.rollback()
+            raise OrderFilterError('Cannot reschedule orders into the past')
+        target = _shifted(ScheduledOrder.scheduled_time, shift, session.get_bind().dialect.name)
+
+    rows = session.execute(
+        update(ScheduledOrder)
+        .where(*conds)
+        .values(scheduled_time=target, dispatch_position=None, updated_at=now)
+        .returning(ScheduledOrder.id, ScheduledOrder.user_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    message = f"Rescheduled to {new_time.isoformat()}" if new_time is not None else \
+        f"Rescheduled by {int(shift.total_seconds())}s"
+    _log_rows(session, rows, 'rescheduled', message)
+    session.commit()
+    return [r.id for r in rows]
@@ -0,0 +1,187 @@
+"""Cross-process "pending orders changed" notifications for the scheduler.
+
+On PostgreSQL a trigger on ``scheduled_orders`` (migration 7) runs
+``pg_notify('scheduled_orders', scheduled_time)`` for every row that becomes or
+stays pending; NOTIFY is transactional, so the scheduler hears about an order
+exactly when it is committed, whichever process or tool wrote it.
+
+SQLite has no NOTIFY, so committed ORM sessions that changed orders send a
+datagram to a Unix socket the scheduler binds at ``NOTIFY_SOCKET_PATH``. Core
+writers on plain connections do not publish; in this app those run inside the
+scheduler process, which wakes itself.
+
+The listener only says "something changed"; the scheduler re-reads the next
+pending deadline and arms its next run for it (see scheduler.py).
+"""
+import logging
+import os
+import select
+import socket
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import NOTIFY_SOCKET_PATH, ORDER_NOTIFY
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'scheduled_orders'
+
+# Reconnect delay after the listener loses its connection or socket
+RETRY_SECONDS = 2.0
+
+_SESSION_KEY = 'orders_changed'
+
+
+def channel_kind(engine):
+    """'postgresql', 'socket' or None when push notifications are unavailable for ``engine``."""
+    if ORDER_NOTIFY == 'off':
+        return None
+    if engine.dialect.name == 'postgresql' and engine.dialect.driver == 'psycopg2':
+        return 'postgresql'
+    if engine.dialect.name == 'sqlite' and hasattr(socket, 'AF_UNIX') and NOTIFY_SOCKET_PATH:
+        return 'socket'
+    return None
+
+
+class SocketPublisher:
+    """Fire-and-forget datagrams to the scheduler's socket; never blocks or raises."""
+
+    def __init__(self, path=NOTIFY_SOCKET_PATH):
+        self.path = path
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def publish(self):
+        if not self.path or not hasattr(socket, 'AF_UNIX'):
+            return False
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                    self._sock.setblocking(False)
+                self._sock.sendto(b'1', self.path)
+                return True
+            except (FileNotFoundError, ConnectionRefusedError):
+                return False  # no scheduler listening
+            except BlockingIOError:
+                return True  # queue full: a wake-up is already pending
+            except OSError:
+                logger.exception('Failed to publish order notification to %s', self.path)
+                return False
+
+
+publisher = SocketPublisher()
+
+
+def mark_orders_changed(session):
+    session.info[_SESSION_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_on_commit(session):
+    if not session.info.pop(_SESSION_KEY, False):
+        return
+    try:
+        bind = session.get_bind()
+    except Exception:
+        return
+    if channel_kind(bind) == 'socket':
+        publisher.publish()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop(_SESSION_KEY, None)
+
+
+class OrderNotificationListener:
+    """Background thread calling ``on_change()`` whenever pending orders change."""
+
+    def __init__(self, engine, on_change, socket_path=NOTIFY_SOCKET_PATH):
+        self.engine = engine
+        self.on_change = on_change
+        self.socket_path = socket_path
+        self.kind = channel_kind(engine)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> bool:
+        if self.kind is None:
+            return False
+        target = self._listen_postgres if self.kind == 'postgresql' else self._listen_socket
+        self._thread = threading.Thread(target=self._run, args=(target,), name='order-notify', daemon=True)
+        self._thread.start()
+        logger.info('Listening for order notifications via %s', self.kind)
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(RETRY_SECONDS + 1)
+
+    def _fire(self):
+        try:
+            self.on_change()
+        except Exception:
+            logger.exception('Order notification callback failed')
+
+    def _run(self, listen):
+        while not self._stop.is_set():
+            try:
+                listen()
+            except Exception:
+                logger.exception('Order notification listener failed; retrying in %ss', RETRY_SECONDS)
+                self._stop.wait(RETRY_SECONDS)
+            # notifications may have been missed while (re)connecting
+            if not self._stop.is_set():
+                self._fire()
+
+    def _listen_postgres(self):
+        raw = self.engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN {CHANNEL}')
+            while not self._stop.is_set():
+                ready, _, _ = select.select([conn], [], [], 1.0)
+                if not ready:
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    self._fire()
+        finally:
+            raw.invalidate()
+
+    def _listen_socket(self):
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind(self.socket_path)
+            sock.settimeout(1.0)
+            while not self._stop.is_set():
+                try:
+                    sock.recv(64)
+                except socket.timeout:
+                    continue
+                # coalesce a burst of datagrams into one wake-up
+                sock.setblocking(False)
+                try:
+                    while sock.recv(64):
+                        pass
+                except (BlockingIOError, InterruptedError):
+                    pass
+                sock.settimeout(1.0)
+                self._fire()
+        finally:
+            sock.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
@@ -0,0 +1,295 @@
+"""On-demand stack sampling and per-order phase timings.
+
+Nothing here runs unless a capture is started, from the admin endpoint
+(``POST /admin/profiling``), by sending ``SIGUSR2`` to the scheduler process, or
+per HTTP request with an ``X-Profile`` header from a logged-in admin. While
+disabled the dispatch path only pays for one ``is None`` check per order.
+
+A capture writes, into ``PROFILE_DIR``:
+
+- ``<name>.folded``: collapsed stacks (``thread;frame;frame count``), the input
+  format of flamegraph.pl, speedscope and inferno;
+- ``<name>.phases.jsonl``: one line per order with milliseconds spent queued in
+  the executor, claiming, getting the broker client, in the broker call,
+  encoding the result and writing it back;
+- ``<name>.summary.json``: sample count and sampler lag. The sampler needs the
+  GIL to take a sample, so lag well above the interval means GIL contention.
+
+The web process cannot reach the scheduler's memory, so the endpoint writes the
+request to ``PROFILE_CONTROL_PATH`` and signals the scheduler (its pid is in the
+heartbeat); the scheduler also re-checks that file once per poll.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+import clock
+from config import PROFILE_CONTROL_PATH, PROFILE_DEFAULT_SECONDS, PROFILE_DIR, PROFILE_SAMPLE_INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+# Hard cap on a single capture, whatever was requested
+MAX_CAPTURE_SECONDS = 600
+
+_NAME_RE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def safe_name(name: str) -> str:
+    return _NAME_RE.sub('_', name or '').strip('._') or 'capture'
+
+
+def _thread_label(name: str) -> str:
+    # aggregate pool workers: ThreadPoolExecutor-0_7 -> ThreadPoolExecutor-0
+    return re.sub(r'_\d+$', '', name)
+
+
+class StackSampler(threading.Thread):
+    """Samples every (or selected) thread's stack with sys._current_frames()."""
+
+    def __init__(self, interval: float, thread_ids=None):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.stacks = Counter()
+        self.samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        expected = time.perf_counter()
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            frames = sys._current_frames()
+            if len(names) != threading.active_count():
+                names = {t.ident: _thread_label(t.name) for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            expected = time.perf_counter() + self.interval
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class PhaseTimer:
+    """Laps for one order; ``lap(phase)`` charges the time since the previous lap."""
+    __slots__ = ('capture', 'order_id', 'start', 'last', 'phases')
+
+    def __init__(self, capture, order_id, start: float):
+        self.capture = capture
+        self.order_id = order_id
+        self.start = start
+        self.last = start
+        self.phases = {}
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self.last) * 1000
+        self.last = now
+
+    def done(self, status: Optional[str] = None):
+        row = {'order_id': self.order_id, 'status': status, 'thread': threading.current_thread().name}
+        row.update({phase: round(ms, 3) for phase, ms in self.phases.items()})
+        row['total'] = round((time.perf_counter() - self.start) * 1000, 3)
+        self.capture.add_phases(row)
+
+
+class Capture:
+    def __init__(self, name: str, seconds: float, thread_ids=None, interval: float = None):
+        self.name = safe_name(name)
+        self.seconds = min(float(seconds), MAX_CAPTURE_SECONDS)
+        self.started_at = clock.now_ist()
+        self.sampler = StackSampler(interval or PROFILE_SAMPLE_INTERVAL_MS / 1000, thread_ids)
+        self._phases = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self, on_expire=None):
+        self.sampler.start()
+        if on_expire is not None:
+            self._timer = threading.Timer(self.seconds, on_expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def add_phases(self, row):
+        with self._lock:
+            self._phases.append(row)
+
+    def finish(self, directory: str = PROFILE_DIR) -> str:
+        """Stop sampling and write the capture files; returns the ``.folded`` path."""
+        if self._timer is not None:
+            self._timer.cancel()
+        self.sampler.stop()
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.name}-{self.started_at.strftime('%Y%m%dT%H%M%S%f')}")
+        with open(base + '.folded', 'w') as fh:
+            for stack, count in self.sampler.stacks.most_common():
+                fh.write(f'{stack} {count}\n')
+        with self._lock:
+            phases, self._phases = self._phases, []
+        with open(base + '.phases.jsonl', 'w') as fh:
+            for row in phases:
+                fh.write(json.dumps(row) + '\n')
+        sampler = self.sampler
+        summary = {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'seconds': round((clock.now_ist() - self.started_at).total_seconds(), 3),
+            'samples': sampler.samples,
+            'interval_ms': sampler.interval * 1000,
+            'mean_sampler_lag_ms': round(sampler.lag_total / sampler.samples * 1000, 3) if sampler.samples else None,
+            'max_sampler_lag_ms': round(sampler.lag_max * 1000, 3),
+            'orders': len(phases),
+        }
+        with open(base + '.summary.json', 'w') as fh:
+            json.dump(summary, fh, indent=2)
+        logger.info('Profile %s written to %s.* (%s samples, %s orders)', self.name, base, sampler.samples, len(phases))
+        return base + '.folded'
+
+
+# Process-wide capture used by the dispatch path; None while profiling is off
+_active = None
+_lock = threading.Lock()
+
+
+def active() -> Optional[Capture]:
+    return _active
+
+
+def order_timer(order_id, start: Optional[float] = None) -> Optional[PhaseTimer]:
+    """A PhaseTimer for ``order_id`` while a capture runs, else None."""
+    capture = _active
+    if capture is None:
+        return None
+    return PhaseTimer(capture, order_id, start if start is not None else time.perf_counter())
+
+
+def start(name: str, seconds: float = PROFILE_DEFAULT_SECONDS) -> bool:
+    """Start the process-wide capture; False if one is already running."""
+    global _active
+    with _lock:
+        if _active is not None:
+            return False
+        capture = Capture(name, seconds)
+        _active = capture
+    capture.start(on_expire=stop)
+    logger.info('Profiling capture %s started for %ss', capture.name, capture.seconds)
+    return True
+
+
+def stop() -> Optional[str]:
+    global _active
+    with _lock:
+        capture, _active = _active, None
+    if capture is None:
+        return None
+    try:
+        return capture.finish()
+    except Exception:
+        logger.exception('Failed to write profile %s', capture.name)
+        return None
+
+
+class ProfileControl:
+    """Capture requests handed from the web process to the scheduler through a JSON file.
+
+    A request is ``{"action": "start"|"stop", "name", "seconds", "start_at"}``;
+    ``start_at`` (naive IST ISO time, optional) delays the capture to a burst window.
+    """
+
+    def __init__(self, path: Optional[str] = PROFILE_CONTROL_PATH):
+        self.path = path
+        self._pending = None
+        self._lock = threading.RLock()
+        # a request left over from before this process started is not replayed
+        try:
+            self._mtime = os.stat(path).st_mtime_ns if path else None
+        except OSError:
+            self._mtime = None
+
+    def write(self, request: dict):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(request, fh)
+        os.replace(tmp, self.path)
+
+    def read(self) -> Optional[dict]:
+        """The request if the file changed since the last read, else None."""
+        if not self.path:
+            return None
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            logger.warning('Ignoring unreadable profiling request in %s', self.path)
+            return None
+
+    def apply(self, toggle_if_unchanged: bool = False):
+        """Act on a new request; with ``toggle_if_unchanged`` (a bare SIGUSR2) start/stop a default capture."""
+        with self._lock:
+            self._apply(toggle_if_unchanged)
+
+    def _apply(self, toggle_if_unchanged: bool):
+        request = self.read()
+        if request is None:
+            if toggle_if_unchanged:
+                if _active is None:
+                    start('signal', PROFILE_DEFAULT_SECONDS)
+                else:
+                    stop()
+            elif self._pending is not None and clock.now_ist() >= self._pending[0]:
+                _, name, seconds = self._pending
+                self._pending = None
+                start(name, seconds)
+            return
+        if request.get('action') == 'stop':
+            self._pending = None
+            stop()
+            return
+        name = request.get('name') or 'burst'
+        seconds = float(request.get('seconds') or PROFILE_DEFAULT_SECONDS)
+        start_at = request.get('start_at')
+        if start_at:
+            begin = datetime.fromisoformat(start_at)
+            if begin > clock.now_ist():
+                self._pending = (begin, name, seconds)
+                delay = (begin - clock.now_ist()) / timedelta(seconds=1)
+                timer = threading.Timer(delay, self.apply)
+                timer.daemon = True
+                timer.start()
+                logger.info('Profiling capture %s armed for %s', name, start_at)
+                return
+        start(name, seconds)
+
+
+control = ProfileControl()
@@ -0,0 +1,262 @@
+"""Per-request and per-job SQL accounting, N+1 detection and a slow-query log.
+
+Engine-wide cursor events time every statement. While a unit of work is being
+tracked (an HTTP request, or a scheduler job wrapped in :func:`track`), its
+statements are counted into a :class:`QueryStats` held in a context variable,
+so concurrent requests and worker threads never mix. At the end of the unit:
+
+- a statement repeated ``N_PLUS_ONE_THRESHOLD`` times or more with different
+  parameters is logged as a probable N+1 pattern;
+- totals are folded into per-endpoint/per-job aggregates (``GET /admin/query-stats``);
+- in debug mode, HTTP responses get a ``Server-Timing: db;dur=...`` header.
+
+Statements slower than ``SLOW_QUERY_MS`` are appended to ``SLOW_QUERY_LOG`` as
+JSON lines with their EXPLAIN plan. The plan is fetched by a background thread
+through a one-connection engine of its own, so EXPLAIN never takes a
+connection from the pool the dispatch workers share.
+
+Accounting is off unless ``QUERY_STATS=true``: the cursor events run on every
+statement, including the dispatch hot path.
+"""
+import contextvars
+import json
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+import clock
+from config import N_PLUS_ONE_THRESHOLD, QUERY_STATS, SLOW_QUERY_LOG, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# Statements kept per unit for N+1 detection before further ones are only counted
+MAX_TRACKED_STATEMENTS = 500
+# Slow statements waiting for EXPLAIN; beyond this they are dropped
+SLOW_QUEUE_SIZE = 1000
+
+_EXPLAINABLE = ('select', 'with', 'update', 'delete', 'insert')
+
+
+class QueryStats:
+    """Statements executed by one request or job."""
+    __slots__ = ('label', 'count', 'db_seconds', '_statements', '_params')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.db_seconds = 0.0
+        self._statements = Counter()
+        self._params = {}
+
+    def record(self, statement: str, parameters, elapsed: float):
+        self.count += 1
+        self.db_seconds += elapsed
+        if statement in self._statements or len(self._statements) < MAX_TRACKED_STATEMENTS:
+            self._statements[statement] += 1
+            seen = self._params.setdefault(statement, set())
+            if len(seen) < 2:
+                seen.add(repr(parameters))
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list:
+        """``[(statement, count)]`` run at least ``threshold`` times with differing parameters."""
+        return [
+            (statement, count) for statement, count in self._statements.most_common()
+            if count >= threshold and len(self._params.get(statement, ())) > 1
+        ]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.db_seconds * 1000:.2f};desc="{self.count} queries"'
+
+
+class Aggregates:
+    """Running totals per request endpoint / scheduler job."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def add(self, stats: QueryStats, n_plus_one: bool):
+        with self._lock:
+            entry = self._totals.setdefault(stats.label, {
+                'units': 0, 'queries': 0, 'db_ms': 0.0, 'max_queries': 0, 'n_plus_one': 0,
+            })
+            entry['units'] += 1
+            entry['queries'] += stats.count
+            entry['db_ms'] += stats.db_seconds * 1000
+            entry['max_queries'] = max(entry['max_queries'], stats.count)
+            entry['n_plus_one'] += int(n_plus_one)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                label: dict(entry, db_ms=round(entry['db_ms'], 2),
+                            mean_queries=round(entry['queries'] / entry['units'], 2))
+                for label, entry in sorted(self._totals.items())
+            }
+
+
+aggregates = Aggregates()
+
+_current = contextvars.ContextVar('query_stats', default=None)
+
+
+class SlowQueryLog(threading.Thread):
+    """Appends slow statements with their EXPLAIN plan to a JSON-lines file."""
+
+    def __init__(self, path: Optional[str] = SLOW_QUERY_LOG):
+        super().__init__(name='slow-query-log', daemon=True)
+        self.path = path
+        self._queue = queue.Queue(SLOW_QUEUE_SIZE)
+        self._running = False
+        self._start_lock = threading.Lock()
+        # source engine url -> single-connection engine used only for EXPLAIN
+        self._explain_engines = {}
+
+    def submit(self, engine, statement, parameters, elapsed, label):
+        if not self.path:
+            return
+        if not self._running:
+            with self._start_lock:
+                if not self._running:
+                    self.start()
+                    self._running = True
+        try:
+            self._queue.put_nowait((engine, statement, parameters, elapsed, label, clock.utcnow()))
+        except queue.Full:
+            pass
+
+    def run(self):
+        while True:
+            engine, statement, parameters, elapsed, label, at = self._queue.get()
+            entry = {
+                'at': at.isoformat(),
+                'ms': round(elapsed * 1000, 2),
+                'unit': label,
+                'statement': statement,
+                'parameters': repr(parameters)[:1000],
+                'plan': self._explain(engine, statement, parameters),
+            }
+            try:
+                with open(self.path, 'a') as fh:
+                    fh.write(json.dumps(entry) + '\n')
+            except OSError:
+                logger.exception('Failed to write slow query log %s', self.path)
+
+    def _explain_engine(self, engine):
+        """A one-connection engine on the same database as ``engine``, created on first use."""
+        key = engine.url.render_as_string(hide_password=False)
+        explain_engine = self._explain_engines.get(key)
+        if explain_engine is None:
+            explain_engine = create_engine(engine.url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+            self._explain_engines[key] = explain_engine
+        return explain_engine
+
+    def _explain(self, engine, statement, parameters):
+        if not statement.lstrip().lower().startswith(_EXPLAINABLE) or isinstance(parameters, list):
+            return None
+        if engine.dialect.name == 'sqlite' and engine.url.database in (None, '', ':memory:'):
+            # a private in-memory database cannot be reached from another engine
+            return None
+        prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        raw = None
+        try:
+            raw = self._explain_engine(engine).raw_connection()
+            cursor = raw.cursor()
+            cursor.execute(prefix + statement, parameters or ())
+            plan = [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+            cursor.close()
+            raw.rollback()
+            return plan
+        except Exception as e:
+            return [f'EXPLAIN failed: {e}']
+        finally:
+            if raw is not None:
+                raw.close()
+
+
+slow_log = SlowQueryLog()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, parameters, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS and not statement.lstrip().upper().startswith('EXPLAIN'):
+        slow_log.submit(conn.engine, statement, None if executemany else parameters, elapsed,
+                        stats.label if stats is not None else None)
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+
+if QUERY_STATS:
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+
+
+def begin(label: str):
+    """Start accounting this context's statements to ``label``; pass the result to :func:`end`."""
+    if not QUERY_STATS:
+        return None
+    stats = QueryStats(label)
+    stats_token = _current.set(stats)
+    return stats, stats_token
+
+
+def end(started) -> Optional[QueryStats]:
+    """Finish a unit from :func:`begin`: log N+1 patterns and fold it into the aggregates."""
+    if started is None:
+        return None
+    stats, token = started
+    _current.reset(token)
+    repeated = stats.repeated()
+    for statement, count in repeated[:3]:
+        logger.warning('Possible N+1 in %s: statement ran %s times with different parameters: %s',
+                       stats.label, count, ' '.join(statement.split())[:300])
+    aggregates.add(stats, bool(repeated))
+    return stats
+
+
+@contextmanager
+def track(label: str):
+    """Account the statements run inside the block (in this thread) to ``label``."""
+    started = begin(label)
+    try:
+        yield started[0] if started else None
+    finally:
+        end(started)
+
+
+def init_app(app):
+    """Track every request, labelled by endpoint; add Server-Timing in debug mode."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_query_stats():
+        g.query_stats = begin(f'request:{request.endpoint or request.path}')
+
+    @app.after_request
+    def _finish_query_stats(response):
+        stats = end(g.pop('query_stats', None))
+        if stats is not None and app.debug:
+            response.headers.add('Server-Timing', stats.server_timing())
+        return response
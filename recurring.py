@@ -0,0 +1,283 @@
+"""Recurring bulk schedules with just-in-time materialization.
+
+A :class:`models.RecurringSchedule` is stored once. Shortly before each
+occurrence (``MATERIALIZE_LEAD_SECONDS``) the scheduler turns it into a
+ScheduledOrderBulkAudit plus one ScheduledOrder per targeted user with a single
+``INSERT ... SELECT`` from ``kite_users``, so the orders table only ever holds
+imminent work. Exchange holidays are read from a local calendar file.
+"""
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, insert, literal, or_, select, update
+
+import clock
+from change_tracking import bump
+from config import HOLIDAYS_FILE
+from models import KiteUser, RecurringSchedule, ScheduledOrder, ScheduledOrderBulkAudit, ScheduledOrderLog
+
+logger = logging.getLogger(__name__)
+
+# How far ahead of an occurrence its orders are created
+MATERIALIZE_LEAD_SECONDS = 120
+
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+_schedules = RecurringSchedule.__table__
+_orders = ScheduledOrder.__table__
+_users = KiteUser.__table__
+_logs = ScheduledOrderLog.__table__
+_audits = ScheduledOrderBulkAudit.__table__
+
+
+class RecurringScheduleError(ValueError):
+    pass
+
+
+class HolidayCalendar:
+    """Exchange holidays from a text file: one ISO date per line, ``#`` starts a comment.
+
+    The file is re-read only when its mtime changes.
+    """
+
+    def __init__(self, path: Optional[str] = HOLIDAYS_FILE):
+        self.path = path
+        self._mtime = None
+        self._dates = frozenset()
+
+    def dates(self) -> frozenset:
+        if not self.path:
+            return self._dates
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return self._dates
+        if mtime != self._mtime:
+            parsed = set()
+            with open(self.path) as fh:
+                for lineno, line in enumerate(fh, start=1):
+                    line = line.split('#', 1)[0].strip()
+                    if not line:
+                        continue
+                    try:
+                        parsed.add(date.fromisoformat(line.split()[0]))
+                    except ValueError:
+                        logger.warning('Ignoring invalid holiday on line %s of %s: %r', lineno, self.path, line)
+            self._dates = frozenset(parsed)
+            self._mtime = mtime
+        return self._dates
+
+    def is_holiday(self, day: date) -> bool:
+        return day in self.dates()
+
+    def covers(self, year: int) -> bool:
+        """Whether the calendar lists any holiday in ``year``; an uncovered year cannot be trusted."""
+        return any(day.year == year for day in self.dates())
+
+
+holidays = HolidayCalendar()
+
+# Years already reported as missing from the calendar, so each poll does not log again
+_uncovered_years = set()
+
+
+def require_calendar(year: int):
+    """Refuse to enable recurring schedules while the holiday calendar has no dates for ``year``."""
+    if not holidays.covers(year):
+        raise RecurringScheduleError(
+            f'The holiday calendar ({HOLIDAYS_FILE}) has no {year} dates; add the exchange holidays '
+            'before enabling recurring schedules')
+
+
+def parse_schedule(data, allowed_symbols: Iterable[str]) -> dict:
+    """Validate request JSON/form data into RecurringSchedule column values."""
+    symbol = (data.get('stock_symbol') or '').strip().upper()
+    if symbol not in set(allowed_symbols):
+        raise RecurringScheduleError('Invalid stock symbol selected. Please choose from the allowed list.')
+    try:
+        quantity = int(data.get('quantity'))
+    except (TypeError, ValueError):
+        raise RecurringScheduleError('quantity must be an integer')
+    if quantity <= 0:
+        raise RecurringScheduleError('quantity must be positive')
+    order_type = (data.get('order_type') or '').lower()
+    if order_type not in ('buy', 'sell'):
+        raise RecurringScheduleError('order_type must be buy or sell')
+    try:
+        time_of_day = time.fromisoformat(data.get('time_of_day') or '')
+    except ValueError:
+        raise RecurringScheduleError('time_of_day must be HH:MM[:SS]')
+    if not (time(9, 30) <= time_of_day <= time(15, 30)):
+        raise RecurringScheduleError('Orders can only be scheduled between 09:30 and 15:30')
+
+    weekdays = data.get('weekdays')
+    if isinstance(weekdays, str):
+        weekdays = weekdays.split(',')
+    try:
+        weekdays = sorted({int(d) for d in (weekdays or [])})
+    except (TypeError, ValueError):
+        raise RecurringScheduleError('weekdays must be integers 0 (Mon) to 6 (Sun)')
+    if not weekdays or any(d < 0 or d > 6 for d in weekdays):
+        raise RecurringScheduleError('weekdays must be integers 0 (Mon) to 6 (Sun)')
+
+    user_ids = data.get('user_ids') or []
+    if isinstance(user_ids, str):
+        user_ids = [u for u in user_ids.split(',') if u.strip()]
+    try:
+        user_ids = sorted({int(u) for u in user_ids})
+    except (TypeError, ValueError):
+        raise RecurringScheduleError('user_ids must be integers')
+    try:
+        priority = int(data.get('priority') or 0)
+    except (TypeError, ValueError):
+        raise RecurringScheduleError('priority must be an integer')
+
+    return {
+        'name': (data.get('name') or '').strip() or None,
+        'weekdays': ','.join(str(d) for d in weekdays),
+        'time_of_day': time_of_day.replace(microsecond=0),
+        'stock_symbol': symbol,
+        'quantity': quantity,
+        'order_type': order_type,
+        'priority': priority,
+        'user_ids': ','.join(str(u) for u in user_ids) or None,
+    }
+
+
+def occurrence_on(schedule, day: date) -> Optional[datetime]:
+    """The schedule's IST occurrence on ``day``, or None if it does not run that day."""
+    weekdays = {int(d) for d in schedule.weekdays.split(',') if d.strip()}
+    if day.weekday() not in weekdays or holidays.is_holiday(day):
+        return None
+    return datetime.combine(day, schedule.time_of_day)
+
+
+def next_occurrence(schedule, after: datetime, horizon_days: int = 14) -> Optional[datetime]:
+    """First occurrence strictly after ``after`` (IST, naive) within ``horizon_days``."""
+    for offset in range(horizon_days + 1):
+        day = after.date() + timedelta(days=offset)
+        if schedule.last_materialized_on is not None and day <= schedule.last_materialized_on:
+            continue
+        occurrence = occurrence_on(schedule, day)
+        if occurrence is not None and occurrence > after:
+            return occurrence
+    return None
+
+
+def _materialize(conn, schedule, occurrence: datetime, now_utc: datetime) -> Optional[int]:
+    """Create the audit, orders and logs for one occurrence. Returns the audit id, or None if
+    another process already claimed it."""
+    day = occurrence.date()
+    claimed = conn.execute(
+        update(_schedules)
+        .where(
+            _schedules.c.id == schedule.id,
+            _schedules.c.active.is_(True),
+            or_(_schedules.c.last_materialized_on.is_(None), _schedules.c.last_materialized_on < day),
+        )
+        .values(last_materialized_on=day)
+    ).rowcount
+    if not claimed:
+        return None
+
+    audit_id = conn.execute(
+        insert(_audits).values(
+            initiator=f'recurring:{schedule.id}',
+            stock_symbol=schedule.stock_symbol,
+            quantity=schedule.quantity,
+            order_type=schedule.order_type,
+            scheduled_time=occurrence,
+            priority=schedule.priority,
+            created_at=now_utc,
+        ).returning(_audits.c.id)
+    ).scalar_one()
+
+    # Same eligibility as the dashboard bulk schedule: a token that is still valid
+    targets = and_(
+        _users.c.access_token.isnot(None),
+        _users.c.token_expiry.isnot(None),
+        _users.c.token_expiry > now_utc,
+    )
+    user_ids = [int(u) for u in (schedule.user_ids or '').split(',') if u.strip()]
+    if user_ids:
+        targets = and_(targets, _users.c.id.in_(user_ids))
+
+    created = conn.execute(
+        insert(_orders).from_select(
+            ['user_id', 'stock_symbol', 'quantity', 'order_type', 'scheduled_time', 'status',
+             'bulk_audit_id', 'priority', 'created_at', 'updated_at'],
+            select(
+                _users.c.id,
+                literal(schedule.stock_symbol),
+                literal(schedule.quantity),
+                literal(schedule.order_type),
+                literal(occurrence),
+                literal('pending'),
+                literal(audit_id),
+                literal(schedule.priority),
+                literal(now_utc),
+                literal(now_utc),
+            ).where(targets),
+        )
+    ).rowcount
+
+    conn.execute(
+        insert(_logs).from_select(
+            ['scheduled_order_id', 'user_id', 'status', 'message', 'created_at'],
+            select(
+                _orders.c.id,
+                _orders.c.user_id,
+                literal('scheduled'),
+                literal(f'Created from recurring schedule {schedule.id}'),
+                literal(now_utc),
+            ).where(_orders.c.bulk_audit_id == audit_id),
+        )
+    )
+    targeted = len(user_ids) if user_ids else created
+    conn.execute(
+        update(_audits).where(_audits.c.id == audit_id).values(
+            users_targeted=targeted,
+            users_created=created,
+            message=f'Recurring schedule {schedule.id}: created orders for {created} users',
+        )
+    )
+    bump(conn, 'recurring', 'bulk_audits', 'orders', 'logs')
+    return audit_id
+
+
+def materialize_due(engine, now_ist: datetime, lead_seconds: int = MATERIALIZE_LEAD_SECONDS) -> list:
+    """Materialize every active schedule whose next occurrence is within ``lead_seconds``.
+
+    Safe to run from several processes: each occurrence is claimed by a conditional
+    update of ``last_materialized_on`` in the same transaction as the inserts.
+    Returns the created bulk audit ids.
+    """
+    horizon = now_ist + timedelta(seconds=lead_seconds)
+    with engine.connect() as conn:
+        schedules = conn.execute(select(_schedules).where(_schedules.c.active.is_(True))).all()
+    created = []
+    for schedule in schedules:
+        occurrence = occurrence_on(schedule, now_ist.date())
+        if occurrence is None or occurrence < now_ist or occurrence > horizon:
+            continue
+        if not holidays.covers(occurrence.year):
+            # without the year's holidays an exchange holiday would be traded as a normal day
+            if occurrence.year not in _uncovered_years:
+                _uncovered_years.add(occurrence.year)
+                logger.error('Holiday calendar %s has no %s dates; not materializing recurring schedules',
+                             HOLIDAYS_FILE, occurrence.year)
+            continue
+        if schedule.last_materialized_on is not None and schedule.last_materialized_on >= occurrence.date():
+            continue
+        try:
+            with engine.begin() as conn:
+                audit_id = _materialize(conn, schedule, occurrence, clock.utcnow())
+        except Exception:
+            logger.exception('Failed to materialize recurring schedule %s for %s', schedule.id, occurrence)
+            continue
+        if audit_id is not None:
+            logger.info('Materialized recurring schedule %s for %s as bulk audit %s', schedule.id, occurrence, audit_id)
+            created.append(audit_id)
+    return created
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""Run the order scheduler as a standalone process (no HTTP server)."""
+
+import logging
+import signal
+import threading
+
+import profiling
+from app import create_app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    app = create_app(mode='scheduler')
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    if hasattr(signal, 'SIGUSR2'):
+        # apply a request from POST /admin/profiling, or toggle a default capture
+        signal.signal(signal.SIGUSR2, lambda *_: profiling.control.apply(toggle_if_unchanged=True))
+    stop.wait()
+    app.extensions['order_scheduler'].shutdown(wait=True)
+    profiling.stop()
+
+
+if __name__ == '__main__':
+    main()
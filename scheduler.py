@@ -1,25 +1,132 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
-from zoneinfo import ZoneInfo
-from models import ScheduledOrder, KiteUser
+from datetime import datetime, timedelta
+from models import ScheduledOrder, KiteUser, Instrument
 from models import ScheduledOrderLog
+import atexit
+import clock
 import json
-from kite_client import KiteClientWrapper
+from kite_client import KiteClientWrapper, ClientCache
+from fair_dispatch import BurstPositions, DueOrder, dispatch_units, order_fairly
+import dispatch_sql
+import profiling
+import query_stats
+import slicing
+from change_tracking import VersionPublisher, bump, touch
+from heartbeat import Heartbeat
 import logging
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 # Polling and concurrency configuration
 POLL_INTERVAL_SECONDS = 5
+# How often recurring schedules are checked for occurrences to materialize
+RECURRING_CHECK_SECONDS = 30
 BATCH_SIZE = 50
 MAX_WORKERS = 10
+# Upper bound on due orders considered per poll when computing the fair order
+FAIR_SCAN_LIMIT = 5000
+# In push mode, how soon to poll again while a burst is still being drained
+BURST_REPOLL_SECONDS = 0.25
+# The heartbeat's pending count is kept from deltas and recounted in full this often
+PENDING_RECOUNT_SECONDS = 60
 
-# Module-level executor reused across polls
-executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+# Module-level executor reused across polls; created on first dispatch so that
+# importing this module (web workers, CLI) does not spin up threads.
+_executor = None
+_executor_lock = threading.Lock()
 
 
-def place_order(session, order: ScheduledOrder):
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+# Broker clients reused across orders by the in-process thread pool
+client_cache = ClientCache()
+
+# Next dispatch position per burst (scheduled_time)
+burst_positions = BurstPositions()
+
+# Snapshot served by /health and /ready (published to HEARTBEAT_PATH every poll)
+heartbeat = Heartbeat()
+
+
+class PendingCounter:
+    """Pending-order count for the heartbeat, kept without re-counting the table every poll.
+
+    Orders inserted since the last look are counted past an id watermark, and
+    this process's claims and re-queues adjust the count as they happen. Changes
+    made elsewhere to existing orders (cancels, other processes' claims, fired
+    triggers) are picked up by the full recount every PENDING_RECOUNT_SECONDS.
+    """
+
+    def __init__(self, recount_seconds: float = PENDING_RECOUNT_SECONDS):
+        self.recount_seconds = recount_seconds
+        self.count = None
+        self.max_id = 0
+        self._recounted = 0.0
+        self._lock = threading.Lock()
+
+    def _adjust(self, order_ids, sign: int):
+        with self._lock:
+            if self.count is not None:
+                # orders past the watermark are not in the count yet
+                self.count += sign * sum(1 for order_id in order_ids if order_id <= self.max_id)
+
+    def claimed(self, order_ids):
+        self._adjust(order_ids, -1)
+
+    def requeued(self, order_ids):
+        self._adjust(order_ids, 1)
+
+    def refresh(self, conn) -> tuple:
+        """Return ``(pending count, earliest pending deadline)``."""
+        now = time.monotonic()
+        with self._lock:
+            if self.count is None or now - self._recounted >= self.recount_seconds:
+                count, max_id = conn.execute(dispatch_sql.SELECT_PENDING_SUMMARY).one()
+                self.count, self.max_id, self._recounted = count, max_id or 0, now
+            else:
+                added, max_id = conn.execute(dispatch_sql.SELECT_PENDING_ADDED, {'after_id': self.max_id}).one()
+                if max_id is not None:
+                    self.count, self.max_id = self.count + added, max_id
+            count = self.count
+        return max(count, 0), conn.execute(dispatch_sql.SELECT_NEXT_DEADLINE).scalar()
+
+
+pending_counter = PendingCounter()
+
+# Multi-process dispatcher, when DISPATCH_PROCESSES > 0 (see sharded_dispatch.py)
+_sharded_dispatcher = None
+
+# Push notifications of order changes (see order_notify.py); when running, the
+# poll job is only a safety sweep and each run arms the next one for the next deadline
+_notify_listener = None
+
+# Price trigger engine (see triggers.py), when TICK_SOURCE is set
+_trigger_engine = None
+
+# Dispatch journal and its database applier (see dispatch_journal.py), when DISPATCH_JOURNAL is set
+_journal = None
+_journal_applier = None
+
+# Publishes the versions the dispatch path touched (see change_tracking.py)
+_version_publisher = None
+
+
+def _bump_sliced(engine):
+    """Publish a sliced stream's writes; the web process runs no VersionPublisher to bump what they touched."""
+    with engine.begin() as conn:
+        bump(conn, 'orders', 'logs')
+
+
+def place_order(session, order: ScheduledOrder, clients: ClientCache = None):
     user = session.query(KiteUser).get(order.user_id)
     if not user:
         order.status = "failed"
@@ -39,7 +146,22 @@ def place_order(session, order: ScheduledOrder):
             logger.exception('Failed to write order log for missing user')
         return {"status": "error", "error": "kite user not found"}
 
-    kc = KiteClientWrapper(user.api_key, user.api_secret, user.access_token)
+    if clients is not None:
+        kc = clients.get(user.id, user.api_key, user.api_secret, user.access_token)
+    else:
+        kc = KiteClientWrapper(user.api_key, user.api_secret, user.access_token)
+    instrument = session.query(Instrument).filter_by(tradingsymbol=order.stock_symbol).first()
+    if instrument is not None and instrument.freeze_qty and order.quantity >= instrument.freeze_qty:
+        order.status = "processing"
+        session.add(order)
+        session.commit()
+        engine = session.get_bind()
+        with engine.connect() as conn:
+            record = dispatch_sql.load_order_record(conn, order.id)
+        # streamed on the slicing pool, not inside the caller's (web) request
+        slicing.submit_sliced(engine, record, kc, done=lambda summary: _bump_sliced(engine))
+        session.expire(order)
+        return {"status": "sliced", "order_status": "processing"}
     tx = "BUY" if order.order_type.lower() == "buy" else "SELL"
     res = kc.place_order(order.stock_symbol, order.quantity, tx)
     if res.get("status") == "success":
@@ -70,82 +192,613 @@ def place_order(session, order: ScheduledOrder):
     return res
 
 
-def _process_order_worker(app, session_maker, order_id):
-    """Background worker that claims an order atomically and processes it with its own session."""
+def _engine_of(session_maker):
+    return session_maker.kw['bind']
+
+
+def process_order(session_maker, order_id, clients: ClientCache = None, submitted: float = None):
+    """Claim an order atomically and place it on its own connection.
+
+    Runs entirely on the Core statements in dispatch_sql (no ORM objects) and
+    does not need a Flask app context, so it is shared by the in-process thread
+    pool and the shard worker processes. ``submitted`` (perf_counter) lets a
+    profiling capture charge the time spent queued in the executor.
+    """
+    timer = profiling.order_timer(order_id, submitted)
+    if timer:
+        timer.lap('queued')
+    engine = _engine_of(session_maker)
+    now_ist = clock.now_ist()
+    # Atomically claim the order (pending -> processing). If another worker claimed it, rowcount will be 0.
+    with engine.begin() as conn:
+        if not dispatch_sql.claim_order(conn, order_id, now_ist):
+            # already claimed/processed by another worker
+            return
+        pending_counter.claimed([order_id])
+        record = dispatch_sql.load_order_record(conn, order_id)
+    if timer:
+        timer.lap('claim')
+    if record is None:
+        logger.warning('Order %s was claimed but not found afterwards', order_id)
+        return
+
+    if not record.user_exists:
+        with engine.begin() as conn:
+            dispatch_sql.finish_order(conn, record, 'failed', None, 'Kite user not found during execution')
+        return {"status": "error", "error": "kite user not found"}
+
+    logger.info("Worker placing scheduled order id=%s for %s", record.id, record.stock_symbol)
     try:
-        with app.app_context():
-            session = session_maker()
-            try:
-                # Atomically claim the order (pending -> processing). If another worker claimed it, rowcount will be 0.
-                rows = session.query(ScheduledOrder).filter(
-                    ScheduledOrder.id == order_id,
-                    ScheduledOrder.status == "pending",
-                ).update({"status": "processing"}, synchronize_session=False)
-                session.commit()
-                if not rows:
-                    # already claimed/processed by another worker
-                    return
-
-                # Re-load the order within this session
-                order = session.query(ScheduledOrder).filter_by(id=order_id).one_or_none()
-                if not order:
-                    logger.warning('Order %s was claimed but not found afterwards', order_id)
-                    return
-
-                logger.info("Worker placing scheduled order id=%s for %s", order.id, order.stock_symbol)
-                try:
-                    place_order(session, order)
-                except Exception:
-                    logger.exception("Failed to place order %s in worker", order.id)
-            finally:
+        if clients is not None:
+            kc = clients.get(record.user_id, record.api_key, record.api_secret, record.access_token)
+        else:
+            kc = KiteClientWrapper(record.api_key, record.api_secret, record.access_token)
+        if timer:
+            timer.lap('client')
+        if slicing.needs_slicing(record):
+            # streamed on the slicing pool; the children record their own results and the parent's aggregate
+            slicing.submit_sliced(engine, record, kc)
+            if timer:
+                timer.done('sliced')
+            return {"status": "sliced", "order_status": "processing"}
+        tx = "BUY" if record.order_type.lower() == "buy" else "SELL"
+        res = kc.place_order(record.stock_symbol, record.quantity, tx)
+    except Exception as e:
+        logger.exception("Failed to place order %s in worker", record.id)
+        res = {"status": "error", "error": str(e)}
+    if timer:
+        timer.lap('broker')
+
+    status = "completed" if res.get("status") == "success" else "failed"
+    kite_order_id = res.get("order_id") if status == "completed" else None
+    message = dispatch_sql.encode_result(res)
+    if timer:
+        timer.lap('encode')
+    try:
+        with engine.begin() as conn:
+            dispatch_sql.finish_order(conn, record, status, kite_order_id, message)
+    except Exception:
+        logger.exception('Failed to record execution result for order %s', record.id)
+    if timer:
+        timer.lap('finish')
+        timer.done(status)
+    return res
+
+
+def process_journaled_order(engine, record, journal, applier, clients: ClientCache = None, submitted: float = None):
+    """Place an order the poller already claimed, recording progress in the dispatch journal only.
+
+    ``sent`` is durable before the broker call and the outcome right after it;
+    ``applier`` writes the outcome to the database in the background. If the
+    journal fills up, the order falls back to the database path.
+    """
+    from dispatch_journal import JournalFull
+    timer = profiling.order_timer(record.id, submitted)
+    if timer:
+        timer.lap('queued')
+    if not record.user_exists:
+        res = {"status": "error", "error": "kite user not found"}
+        status, kite_order_id, message = 'failed', None, 'Kite user not found during execution'
+    else:
+        logger.info("Worker placing journaled order id=%s for %s", record.id, record.stock_symbol)
+        try:
+            journal.sent(record)
+        except JournalFull:
+            logger.warning('Dispatch journal full; returning order %s to the database path', record.id)
+            journal.forget(record.id)
+            with engine.begin() as conn:
+                conn.execute(dispatch_sql.REQUEUE_CLAIMED, {'order_id': record.id})
+                touch(conn, 'orders')
+            pending_counter.requeued([record.id])
+            return
+        try:
+            if clients is not None:
+                kc = clients.get(record.user_id, record.api_key, record.api_secret, record.access_token)
+            else:
+                kc = KiteClientWrapper(record.api_key, record.api_secret, record.access_token)
+            if timer:
+                timer.lap('client')
+            if slicing.needs_slicing(record):
+                # the slices record themselves and the parent in the database, then the journal lets go
+                slicing.submit_sliced(engine, record, kc, done=lambda summary: journal.handoff(record))
+                if timer:
+                    timer.done('sliced')
+                return {"status": "sliced", "order_status": "processing"}
+            tx = "BUY" if record.order_type.lower() == "buy" else "SELL"
+            res = kc.place_order(record.stock_symbol, record.quantity, tx)
+        except Exception as e:
+            logger.exception("Failed to place journaled order %s in worker", record.id)
+            res = {"status": "error", "error": str(e)}
+        if timer:
+            timer.lap('broker')
+        status = "completed" if res.get("status") == "success" else "failed"
+        kite_order_id = res.get("order_id") if status == "completed" else None
+        message = dispatch_sql.encode_result(res)
+        if timer:
+            timer.lap('encode')
+    try:
+        applier.submit(journal.outcome(record, status, kite_order_id, message))
+    except JournalFull:
+        journal.forget(record.id)
+        with engine.begin() as conn:
+            dispatch_sql.finish_order(conn, record, status, kite_order_id, message)
+    if timer:
+        timer.lap('finish')
+        timer.done(status)
+    return res
+
+
+def process_basket(session_maker, order_ids, clients: ClientCache = None):
+    """Claim one user's basket legs together and place them back-to-back.
+
+    All legs are claimed in one transaction, placed in leg order on the same
+    broker client without DB round trips in between, and their results written
+    in one transaction. A failed leg does not stop the remaining legs; the
+    basket's aggregated status shows it as partial. A leg above its freeze limit
+    is handed to the slicing pool in its turn and finishes on its own.
+    """
+    engine = _engine_of(session_maker)
+    now_ist = clock.now_ist()
+    records = []
+    with engine.begin() as conn:
+        for order_id in order_ids:
+            if dispatch_sql.claim_order(conn, order_id, now_ist):
+                pending_counter.claimed([order_id])
+                record = dispatch_sql.load_order_record(conn, order_id)
+                if record is not None:
+                    records.append(record)
+    if not records:
+        return []
+
+    outcomes = []
+    sliced = []
+    first = records[0]
+    if not first.user_exists:
+        outcomes = [(record, 'failed', None, 'Kite user not found during execution') for record in records]
+    else:
+        logger.info("Worker placing %s basket legs for user %s", len(records), first.user_id)
+        kc = None
+        try:
+            if clients is not None:
+                kc = clients.get(first.user_id, first.api_key, first.api_secret, first.access_token)
+            else:
+                kc = KiteClientWrapper(first.api_key, first.api_secret, first.access_token)
+        except Exception as e:
+            logger.exception("Failed to create broker client for user %s", first.user_id)
+            outcomes = [(record, 'failed', None, dispatch_sql.encode_result({"status": "error", "error": str(e)})) for record in records]
+        if kc is not None:
+            for record in records:
+                if slicing.needs_slicing(record):
+                    try:
+                        slicing.submit_sliced(engine, record, kc)
+                        sliced.append('processing')
+                    except Exception:
+                        logger.exception("Failed to hand sliced basket leg %s to the slicing pool", record.id)
+                        outcomes.append((record, 'failed', None, 'Failed to slice order'))
+                    continue
                 try:
-                    session.close()
-                except Exception:
-                    pass
+                    tx = "BUY" if record.order_type.lower() == "buy" else "SELL"
+                    res = kc.place_order(record.stock_symbol, record.quantity, tx)
+                except Exception as e:
+                    logger.exception("Failed to place basket leg %s in worker", record.id)
+                    res = {"status": "error", "error": str(e)}
+                status = "completed" if res.get("status") == "success" else "failed"
+                kite_order_id = res.get("order_id") if status == "completed" else None
+                outcomes.append((record, status, kite_order_id, dispatch_sql.encode_result(res)))
+
+    try:
+        with engine.begin() as conn:
+            for record, status, kite_order_id, message in outcomes:
+                dispatch_sql.finish_order(conn, record, status, kite_order_id, message)
+    except Exception:
+        logger.exception('Failed to record execution results for basket legs %s', [r.id for r in records])
+    return [status for _, status, _, _ in outcomes] + sliced
+
+
+def _process_order_worker(app, session_maker, order_id, submitted=None):
+    """Background worker that claims an order atomically and processes it with its own session."""
+    try:
+        with app.app_context(), query_stats.track('job:process_order'):
+            process_order(session_maker, order_id, client_cache, submitted)
     except Exception:
         logger.exception('Unhandled exception in order worker for order %s', order_id)
+    finally:
+        heartbeat.order_finished()
+
+
+def _process_journaled_worker(app, engine, record, submitted=None):
+    try:
+        with app.app_context(), query_stats.track('job:process_order'):
+            process_journaled_order(engine, record, _journal, _journal_applier, client_cache, submitted)
+    except Exception:
+        logger.exception('Unhandled exception in journaled order worker for order %s', record.id)
+    finally:
+        heartbeat.order_finished()
+
+
+def _process_basket_worker(app, session_maker, order_ids):
+    try:
+        with app.app_context(), query_stats.track('job:process_basket'):
+            process_basket(session_maker, order_ids, client_cache)
+    except Exception:
+        logger.exception('Unhandled exception in basket worker for orders %s', order_ids)
+    finally:
+        heartbeat.order_finished(len(order_ids))
+
+
+def _refresh_pending_summary(conn):
+    """Pending count and next deadline; the count is incremental between periodic recounts."""
+    try:
+        summary = pending_counter.refresh(conn)
+        conn.commit()
+        return summary
+    except Exception:
+        conn.rollback()
+        logger.exception('Failed to refresh pending order summary')
+        return pending_counter.count, None
+
+
+def _due_orders(conn, now_ist):
+    """Lightweight rows for pending orders due by ``now_ist``, in fair dispatch order.
+
+    The scan stops at FAIR_SCAN_LIMIT rows, which can fall between the legs of
+    a basket (baskets are inserted leg by leg across users). When it is full,
+    the missing legs of every basket it returned are fetched, so a unit is
+    never dispatched with part of its legs.
+    """
+    rows = conn.execute(dispatch_sql.SELECT_DUE, {'now': now_ist, 'limit': FAIR_SCAN_LIMIT}).all()
+    if len(rows) >= FAIR_SCAN_LIMIT:
+        baskets = {(r[1], r[6]) for r in rows if r[7] is not None}
+        if baskets:
+            seen = {r[0] for r in rows}
+            legs = conn.execute(dispatch_sql.SELECT_DUE_BASKET_LEGS, {
+                'now': now_ist, 'bulk_audit_ids': sorted({bulk_audit_id for _, bulk_audit_id in baskets}),
+            })
+            rows.extend(r for r in legs if r[0] not in seen and (r[1], r[6]) in baskets)
+    return order_fairly(
+        DueOrder(r[0], r[1], r[2], max(r[3] or 0, r[4] or 0), r[5], r[6] if r[7] is not None else None, r[7])
+        for r in rows
+    )
+
+
+def _next_batch(ordered):
+    """Leading dispatch units holding up to BATCH_SIZE orders; a basket unit is never split."""
+    batch = []
+    size = 0
+    for unit in dispatch_units(ordered):
+        if batch and size + len(unit) > BATCH_SIZE:
+            break
+        batch.append(unit)
+        size += len(unit)
+    return batch
+
+
+def _record_positions(conn, batch):
+    """Persist each order's position within its burst the first time it is dispatched."""
+    def start_for(scheduled_time):
+        return conn.execute(dispatch_sql.SELECT_MAX_POSITION, {'scheduled_time': scheduled_time}).scalar()
+
+    assigned = burst_positions.assign(batch, start_for)
+    if not assigned:
+        return
+    try:
+        conn.execute(
+            dispatch_sql.SET_POSITION,
+            [{'order_id': order_id, 'position': position} for order_id, position in assigned],
+        )
+        bump(conn, 'orders')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        logger.exception('Failed to record dispatch positions')
+
+
+def _dispatch_journaled(app, conn, units, now_ist, executor):
+    """Claim the batch's single orders in one statement and hand them to journaled workers.
+
+    The claims are journaled before the UPDATE commits, so a crash in between
+    leaves them pending. Returns the units left for the regular path: baskets,
+    or the whole batch when the journal has no room.
+    """
+    singles = [unit[0] for unit in units if len(unit) == 1]
+    if not singles or not _journal.has_room(len(singles)):
+        return units
+    rest = [unit for unit in units if len(unit) > 1]
+    records = []
+    try:
+        records = dispatch_sql.claim_orders(conn, [order.id for order in singles], now_ist)
+        _journal.claim(records)
+        conn.commit()
+        pending_counter.claimed([record.id for record in records])
+    except Exception:
+        logger.exception('Failed to claim journaled orders %s', [order.id for order in singles])
+        conn.rollback()
+        if records:
+            try:
+                _journal.release(records)
+            except Exception:
+                logger.exception('Failed to release journaled claims')
+        return rest
+
+    engine = conn.engine
+    for record in records:
+        try:
+            heartbeat.order_started()
+            logger.info("Submitting journaled order id=%s for user %s to executor", record.id, record.user_id)
+            executor.submit(_process_journaled_worker, app, engine, record, time.perf_counter())
+        except Exception:
+            heartbeat.order_finished()
+            logger.exception("Failed to submit journaled order %s to executor", record.id)
+            try:
+                with engine.begin() as requeue:
+                    requeue.execute(dispatch_sql.REQUEUE_CLAIMED, {'order_id': record.id})
+                _journal.release([record])
+                pending_counter.requeued([record.id])
+            except Exception:
+                logger.exception('Failed to return journaled order %s to pending', record.id)
+    return rest
 
 
 def place_pending_orders(app, session_maker):
     """Find pending orders scheduled <= now and submit them to executor for background processing."""
-    with app.app_context():
-        session = session_maker()
+    started = time.time()
+    repoll_soon = False
+    try:
+        # one stat() unless an admin asked for a profiling capture
+        profiling.control.apply()
+    except Exception:
+        logger.exception('Failed to apply profiling request')
+    with app.app_context(), query_stats.track('job:place_pending_orders'):
+        conn = _engine_of(session_maker).connect()
         try:
-            # Get current time in IST (same timezone as stored scheduled_time)
-            ist = ZoneInfo('Asia/Kolkata')
-            now_ist = datetime.now(ist).replace(tzinfo=None)
+            if _notify_listener is not None and heartbeat.in_flight() >= BATCH_SIZE:
+                # the previous batch is still running; look again shortly instead of re-queueing it
+                repoll_soon = True
+                return
+
+            # Current time in IST (same timezone as stored scheduled_time)
+            now_ist = clock.now_ist()
+
+            # Take the next batch in fair order rather than insertion order, so the
+            # lowest user ids do not always go first within a same-second burst
+            units = _next_batch(_due_orders(conn, now_ist))
+            conn.commit()
+
+            if not units:
+                return
+            repoll_soon = sum(len(unit) for unit in units) >= BATCH_SIZE
 
-            # Fetch a small ordered batch of pending orders and submit each to executor by id
-            pending = session.query(ScheduledOrder).filter(
-                ScheduledOrder.status == "pending",
-                ScheduledOrder.scheduled_time <= now_ist,
-            ).order_by(ScheduledOrder.scheduled_time.asc()).limit(BATCH_SIZE).all()
+            _record_positions(conn, [order for unit in units for order in unit])
 
-            if not pending:
+            if _sharded_dispatcher is not None:
+                # Split the batch across worker processes by user shard
+                _sharded_dispatcher.dispatch([
+                    (tuple(order.id for order in unit), unit[0].user_id) for unit in units
+                ])
                 return
 
-            for order in pending:
-                logger.info("Submitting scheduled order id=%s for %s to executor", order.id, order.stock_symbol)
+            executor = get_executor()
+            if _journal is not None:
+                units = _dispatch_journaled(app, conn, units, now_ist, executor)
+            for unit in units:
+                order = unit[0]
                 try:
-                    # Submit the background worker with order id so each worker uses its own session
-                    executor.submit(_process_order_worker, app, session_maker, order.id)
+                    # Each worker uses its own connection; a user's basket legs go to one worker
+                    heartbeat.order_started(len(unit))
+                    if len(unit) == 1:
+                        logger.info("Submitting scheduled order id=%s for user %s to executor", order.id, order.user_id)
+                        executor.submit(_process_order_worker, app, session_maker, order.id, time.perf_counter())
+                    else:
+                        order_ids = [leg.id for leg in unit]
+                        logger.info("Submitting basket legs %s for user %s to executor", order_ids, order.user_id)
+                        executor.submit(_process_basket_worker, app, session_maker, order_ids)
                 except Exception:
-                    logger.exception("Failed to submit order %s to executor", order.id)
+                    heartbeat.order_finished(len(unit))
+                    logger.exception("Failed to submit orders %s to executor", [leg.id for leg in unit])
         finally:
             try:
-                session.close()
+                pending_count, next_deadline = _refresh_pending_summary(conn)
+                heartbeat.loop_finished(started, pending_count, next_deadline)
+                if _notify_listener is not None:
+                    _arm_next_run(next_deadline, repoll_soon)
+            except Exception:
+                logger.exception('Failed to update scheduler heartbeat')
+            try:
+                conn.close()
             except Exception:
                 pass
 
 
+def materialize_recurring(app, session_maker):
+    """Create orders for recurring schedules whose next occurrence is imminent."""
+    from recurring import materialize_due
+    try:
+        with app.app_context(), query_stats.track('job:materialize_recurring'):
+            now_ist = clock.now_ist()
+            if materialize_due(_engine_of(session_maker), now_ist):
+                wake_dispatcher()
+    except Exception:
+        logger.exception('Failed to materialize recurring schedules')
+
+
+def hydrate_pending_profiles(app, session_maker):
+    """Queue profile hydration for logins a web worker did not finish (see kite_sessions)."""
+    import kite_sessions
+    try:
+        kite_sessions.hydrator.requeue_unhydrated(_engine_of(session_maker))
+    except Exception:
+        logger.exception('Failed to re-queue profile hydration')
+
+
+def revalidate_tokens(app, session_maker):
+    import kite_sessions
+    try:
+        with app.app_context(), query_stats.track('job:revalidate_tokens'):
+            kite_sessions.revalidate_tokens(_engine_of(session_maker))
+    except Exception:
+        logger.exception('Failed to re-validate Kite tokens')
+
+
+# Scheduler started in this process, if any (see wake_dispatcher)
+_active_scheduler = None
+
+
+def wake_dispatcher():
+    """Run the next poll now instead of waiting for the interval.
+
+    Called after pending orders are cancelled/rescheduled/created in this process
+    so the dispatcher reflects the change immediately. No-op if no scheduler runs here.
+    """
+    scheduler = _active_scheduler
+    if scheduler is None:
+        return False
+    try:
+        job = scheduler.get_job('place_pending_orders')
+        if job is None:
+            return False
+        job.modify(next_run_time=datetime.now(scheduler.timezone))
+        return True
+    except Exception:
+        logger.exception('Failed to wake dispatcher')
+        return False
+
+
+def _arm_next_run(next_deadline, soon: bool):
+    """Push mode: move the next poll forward to the next pending deadline (or shortly, mid-burst)."""
+    scheduler = _active_scheduler
+    if scheduler is None:
+        return
+    now = datetime.now(clock.IST)
+    if soon:
+        when = now + timedelta(seconds=BURST_REPOLL_SECONDS)
+    elif next_deadline is not None:
+        # never in the past: APScheduler would treat that as a misfire and skip it
+        when = max(next_deadline.replace(tzinfo=clock.IST), now)
+    else:
+        return
+    job = scheduler.get_job('place_pending_orders')
+    if job is not None and (job.next_run_time is None or when < job.next_run_time):
+        job.modify(next_run_time=when)
+
+
 def start_scheduler(app, session_maker):
+    global _active_scheduler, _sharded_dispatcher, _notify_listener, _version_publisher
+    from config import TICK_SOURCE, TOKEN_REVALIDATE_AT
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from config import DISPATCH_JOURNAL, DISPATCH_PROCESSES, SAFETY_SWEEP_SECONDS
+    from order_notify import OrderNotificationListener, channel_kind
+
+    if DISPATCH_PROCESSES > 0 and _sharded_dispatcher is None:
+        from sharded_dispatch import ShardedDispatcher
+        _sharded_dispatcher = ShardedDispatcher(
+            session_maker.kw['bind'].url.render_as_string(hide_password=False), DISPATCH_PROCESSES, MAX_WORKERS,
+        )
+        _sharded_dispatcher.start()
+        heartbeat.in_flight_source = _sharded_dispatcher.in_flight
+        atexit.register(_sharded_dispatcher.shutdown)
+
+    heartbeat.query_stats_source = query_stats.aggregates.snapshot
+
+    engine = _engine_of(session_maker)
+    try:
+        # before the first poll: settle slices a previous run stopped streaming
+        slicing.recover_interrupted(engine)
+    except Exception:
+        logger.exception('Failed to settle interrupted sliced orders')
+    if _version_publisher is None:
+        _version_publisher = VersionPublisher(engine)
+        _version_publisher.start()
+        atexit.register(_version_publisher.stop)
+    if DISPATCH_JOURNAL and DISPATCH_PROCESSES == 0 and _journal is None:
+        # before the first poll: finish or re-queue what the previous run left in flight
+        _open_journal(engine, DISPATCH_JOURNAL)
+    push = channel_kind(engine) is not None
     scheduler = BackgroundScheduler()
     scheduler.add_job(
         lambda: place_pending_orders(app, session_maker),
         'interval',
-        seconds=POLL_INTERVAL_SECONDS,
+        # with push notifications the interval is only a safety sweep
+        seconds=SAFETY_SWEEP_SECONDS if push else POLL_INTERVAL_SECONDS,
         id='place_pending_orders',
         replace_existing=True,
     )
+    scheduler.add_job(
+        lambda: materialize_recurring(app, session_maker),
+        'interval',
+        seconds=RECURRING_CHECK_SECONDS,
+        id='materialize_recurring',
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
+    scheduler.add_job(
+        lambda: hydrate_pending_profiles(app, session_maker),
+        id='hydrate_pending_profiles',
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
+    if TOKEN_REVALIDATE_AT:
+        hour, minute = (int(part) for part in TOKEN_REVALIDATE_AT.split(':')[:2])
+        scheduler.add_job(
+            lambda: revalidate_tokens(app, session_maker),
+            'cron',
+            hour=hour,
+            minute=minute,
+            timezone=clock.IST,
+            id='revalidate_tokens',
+            replace_existing=True,
+        )
     scheduler.start()
+    _active_scheduler = scheduler
+    if push and _notify_listener is None:
+        listener = OrderNotificationListener(engine, wake_dispatcher)
+        if listener.start():
+            _notify_listener = listener
+            heartbeat.set_interval(SAFETY_SWEEP_SECONDS)
+            atexit.register(listener.stop)
+            # arm the first run for the earliest pending order
+            wake_dispatcher()
+        else:
+            job = scheduler.get_job('place_pending_orders')
+            job.reschedule('interval', seconds=POLL_INTERVAL_SECONDS)
+    if TICK_SOURCE and _trigger_engine is None:
+        _start_trigger_engine(engine)
     return scheduler
+
+
+def _open_journal(engine, path):
+    """Replay the dispatch journal at ``path`` and start applying new outcomes from it."""
+    global _journal, _journal_applier
+    from dispatch_journal import DispatchJournal, JournalApplier, replay
+    journal = None
+    try:
+        journal = DispatchJournal(path)
+        replay(engine, journal)
+    except Exception:
+        # the journal is left as it is, to be replayed by the next start
+        logger.exception('Failed to replay dispatch journal %s; dispatching without it', path)
+        if journal is not None:
+            journal.close()
+        return
+    applier = JournalApplier(engine, journal)
+    applier.start()
+    _journal, _journal_applier = journal, applier
+
+    def close():
+        applier.drain()
+        journal.close()
+    atexit.register(close)
+
+
+def _start_trigger_engine(engine):
+    """Evaluate price triggers from TICK_SOURCE and hand fired orders to this dispatcher."""
+    global _trigger_engine
+    from config import TICK_SOURCE
+    from triggers import TriggerEngine, make_tick_source
+    try:
+        trigger_engine = TriggerEngine(engine, make_tick_source(TICK_SOURCE, engine), wake_dispatcher)
+        trigger_engine.start()
+    except Exception:
+        logger.exception('Failed to start the price trigger engine from %s', TICK_SOURCE)
+        return
+    _trigger_engine = trigger_engine
+    atexit.register(trigger_engine.stop)
@@ -0,0 +1,174 @@
+"""Multi-process order dispatch sharded by user.
+
+The scheduler process stays the coordinator: each poll it splits the due batch
+into K shards by ``user_id % K`` and hands each shard's order ids to a dedicated
+worker process. A worker process owns its users exclusively, so it keeps its own
+DB engine and a pre-warmed broker client per user, and ORM hydration, JSON
+encoding and logging run on K interpreters instead of one.
+
+Claims still go through the conditional pending -> processing UPDATE in
+:func:`scheduler.process_order`, so a duplicate hand-off (e.g. the same pending
+order seen by two polls) is harmless.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# How long the coordinator waits for a worker process to exit on shutdown
+SHUTDOWN_TIMEOUT_SECONDS = 10
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """Shard owning ``user_id``. Integer ids are spread evenly by modulo."""
+    return int(user_id) % shards
+
+
+def _prewarm_clients(session_maker, shard: int, shards: int, clients):
+    from models import KiteUser
+
+    session = session_maker()
+    try:
+        users = session.query(
+            KiteUser.id, KiteUser.api_key, KiteUser.api_secret, KiteUser.access_token,
+        ).filter(KiteUser.access_token.isnot(None), (KiteUser.id % shards) == shard).all()
+        for user in users:
+            clients.get(user.id, user.api_key, user.api_secret, user.access_token)
+        return len(users)
+    finally:
+        session.close()
+
+
+def _shard_main(shard: int, shards: int, database_url: str, max_workers: int, inbox, in_flight):
+    """Entry point of a shard worker process."""
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s %(levelname)s shard-{shard} %(name)s: %(message)s')
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from change_tracking import VersionPublisher
+    from kite_client import ClientCache
+
+    engine = create_engine(database_url, echo=False)
+    session_maker = sessionmaker(bind=engine)
+    publisher = VersionPublisher(engine)
+    publisher.start()
+    clients = ClientCache()
+    try:
+        warmed = _prewarm_clients(session_maker, shard, shards, clients)
+        logger.info('Shard %s/%s ready with %s pre-warmed broker clients', shard, shards, warmed)
+    except Exception:
+        logger.exception('Shard %s failed to pre-warm broker clients', shard)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'shard{shard}')
+    try:
+        while True:
+            units = inbox.get()
+            if units is None:
+                break
+            for order_ids in units:
+                pool.submit(_run_unit, session_maker, order_ids, clients, in_flight)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown(wait=True)
+        publisher.stop()
+        engine.dispose()
+
+
+def _run_unit(session_maker, order_ids, clients, in_flight):
+    """Place one order, or one user's basket legs back-to-back."""
+    from scheduler import process_basket, process_order
+    try:
+        if len(order_ids) == 1:
+            process_order(session_maker, order_ids[0], clients)
+        else:
+            process_basket(session_maker, order_ids, clients)
+    except Exception:
+        logger.exception('Unhandled exception in shard worker for orders %s', order_ids)
+    finally:
+        with in_flight.get_lock():
+            in_flight.value -= len(order_ids)
+
+
+class ShardedDispatcher:
+    """Coordinator that owns K shard worker processes."""
+
+    def __init__(self, database_url: str, processes: int, threads_per_process: int):
+        if processes < 1:
+            raise ValueError('processes must be >= 1')
+        self.database_url = database_url
+        self.processes = processes
+        self.threads_per_process = threads_per_process
+        # spawn (not fork): the scheduler process already runs threads and holds DB connections
+        self._ctx = multiprocessing.get_context('spawn')
+        self._workers = []
+        self._inboxes = []
+        # per shard: orders handed to it and not yet finished, shared with its process
+        self._in_flight = []
+        self._lock = threading.Lock()
+
+    def _spawn(self, shard: int):
+        inbox = self._ctx.Queue()
+        in_flight = self._ctx.Value('i', 0)
+        proc = self._ctx.Process(
+            target=_shard_main,
+            args=(shard, self.processes, self.database_url, self.threads_per_process, inbox, in_flight),
+            name=f'order-shard-{shard}',
+            daemon=True,
+        )
+        proc.start()
+        return proc, inbox, in_flight
+
+    def start(self):
+        for shard in range(self.processes):
+            proc, inbox, in_flight = self._spawn(shard)
+            self._inboxes.append(inbox)
+            self._workers.append(proc)
+            self._in_flight.append(in_flight)
+        logger.info('Started %s dispatch shard processes', self.processes)
+
+    def split(self, units) -> list:
+        """Group ``(order_ids, user_id)`` units into one unit list per shard, keeping order."""
+        shards = [[] for _ in range(self.processes)]
+        for order_ids, user_id in units:
+            shards[shard_for(user_id, self.processes)].append(tuple(order_ids))
+        return shards
+
+    def dispatch(self, units):
+        """Hand a due batch of ``(order_ids, user_id)`` units to the shard processes.
+
+        ``order_ids`` is a single order or one user's basket legs, placed back-to-back.
+        """
+        with self._lock:
+            for shard, shard_units in enumerate(self.split(units)):
+                if not shard_units:
+                    continue
+                if not self._workers[shard].is_alive():
+                    # the dead shard's queued and running orders will never report back;
+                    # drop its counter with it so they stop holding back the next polls
+                    logger.error('Shard %s is not running (%s orders in flight lost); restarting it',
+                                 shard, self._in_flight[shard].value)
+                    self._workers[shard], self._inboxes[shard], self._in_flight[shard] = self._spawn(shard)
+                with self._in_flight[shard].get_lock():
+                    self._in_flight[shard].value += sum(len(ids) for ids in shard_units)
+                self._inboxes[shard].put(shard_units)
+
+    def in_flight(self) -> int:
+        return sum(max(0, counter.value) for counter in self._in_flight)
+
+    def shutdown(self):
+        with self._lock:
+            for inbox in self._inboxes:
+                try:
+                    inbox.put(None)
+                except (ValueError, OSError, queue.Full):
+                    pass
+            for proc in self._workers:
+                proc.join(SHUTDOWN_TIMEOUT_SECONDS)
+                if proc.is_alive():
+                    proc.terminate()
+            self._workers = []
+            self._inboxes = []
+            self._in_flight = []
@@ -0,0 +1,359 @@
+"""Split orders above the exchange freeze limit into paced child orders.
+
+The local ``instruments`` table holds each symbol's lot size and freeze
+quantity (load it with ``python manage_admins.py load-instruments``). An order
+whose quantity reaches the freeze limit is not sent as one MARKET order. When
+the worker claims it, the order becomes a parent: one child row per slice is
+inserted (``parent_order_id``/``slice_index``), and the children are placed
+back-to-back on the user's broker client. They go out at no more than
+``SLICE_ORDERS_PER_SECOND``, and requests rejected for rate limiting are
+retried. Each child records its own result. The parent is then finished with
+the status aggregated from its children.
+
+The pacing sleeps, so the dispatcher hands sliced orders to a small pool of
+their own (``SLICE_WORKERS``, see :func:`submit_sliced`) instead of holding a
+dispatch worker for the whole stream. If the process stops mid-stream, the
+children left ``processing`` are settled on the next start by
+:func:`recover_interrupted`.
+
+Symbols without an instrument row, or without a freeze limit, are sent whole
+as before.
+"""
+import csv
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy import bindparam, insert, literal, select, update
+
+import clock
+import dispatch_sql
+from change_tracking import bump, touch
+from config import SLICE_ORDERS_PER_SECOND, SLICE_RATE_LIMIT_RETRIES, SLICE_WORKERS
+from models import Instrument
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on children per order; larger orders are failed rather than streamed
+MAX_SLICES = 200
+# First back-off after a rate-limit rejection; doubles on every retry
+RATE_LIMIT_BACKOFF_SECONDS = 1.0
+
+INTERRUPTED_MESSAGE = ('Dispatcher stopped while this slice was being sent and before its result was recorded. '
+                       'It was not re-sent; check the broker order book.')
+NOT_SENT_MESSAGE = 'Not sent: the dispatcher stopped before this slice'
+
+_orders = dispatch_sql.orders
+_instruments = Instrument.__table__
+
+
+class SliceError(ValueError):
+    pass
+
+
+def max_slice_quantity(lot_size: Optional[int], freeze_qty: int) -> int:
+    """Largest whole-lot quantity strictly below the freeze limit."""
+    lot = lot_size or 1
+    return ((freeze_qty - 1) // lot) * lot
+
+
+def needs_slicing(record) -> bool:
+    return bool(record.freeze_qty) and record.quantity >= record.freeze_qty
+
+
+def plan_slices(quantity: int, lot_size: Optional[int], freeze_qty: int) -> list:
+    """Child quantities: as many full slices as fit, then the remainder."""
+    lot = lot_size or 1
+    if quantity % lot:
+        raise SliceError(f'quantity {quantity} is not a multiple of the lot size {lot}')
+    largest = max_slice_quantity(lot, freeze_qty)
+    if largest <= 0:
+        raise SliceError(f'freeze quantity {freeze_qty} is smaller than the lot size {lot}')
+    full, remainder = divmod(quantity, largest)
+    slices = [largest] * full + ([remainder] if remainder else [])
+    if len(slices) > MAX_SLICES:
+        raise SliceError(f'quantity {quantity} needs {len(slices)} slices (at most {MAX_SLICES})')
+    return slices
+
+
+def parent_status(statuses: Counter) -> str:
+    """completed when every slice filled, failed when none did, partial otherwise."""
+    completed = statuses.get('completed', 0)
+    if completed == sum(statuses.values()):
+        return 'completed'
+    return 'partial' if completed else 'failed'
+
+
+def _is_rate_limited(res: dict) -> bool:
+    error = str(res.get('error') or '').lower()
+    return 'too many requests' in error or '429' in error
+
+
+# One child per slice, copying the parent's scheduling fields
+INSERT_CHILD = insert(_orders).from_select(
+    ['user_id', 'stock_symbol', 'quantity', 'order_type', 'scheduled_time', 'status', 'bulk_audit_id',
+     'priority', 'basket_leg', 'parent_order_id', 'slice_index', 'created_at', 'updated_at'],
+    select(
+        _orders.c.user_id,
+        _orders.c.stock_symbol,
+        bindparam('quantity'),
+        _orders.c.order_type,
+        _orders.c.scheduled_time,
+        literal('processing'),
+        _orders.c.bulk_audit_id,
+        _orders.c.priority,
+        _orders.c.basket_leg,
+        _orders.c.id,
+        bindparam('slice_index'),
+        bindparam('now'),
+        bindparam('now'),
+    ).where(_orders.c.id == bindparam('parent_id')),
+)
+
+SELECT_CHILDREN = (
+    select(_orders.c.id, _orders.c.quantity)
+    .where(_orders.c.parent_order_id == bindparam('parent_id'))
+    .order_by(_orders.c.slice_index)
+)
+
+# Parents with children still processing, i.e. a stream a stopped process left unfinished
+SELECT_INTERRUPTED_PARENTS = (
+    select(_orders.c.parent_order_id)
+    .where(_orders.c.parent_order_id.isnot(None), _orders.c.status == 'processing')
+    .distinct()
+)
+
+SELECT_FAMILY = (
+    select(_orders.c.id, _orders.c.parent_order_id, _orders.c.user_id, _orders.c.status)
+    .where(_orders.c.parent_order_id.in_(bindparam('parent_ids', expanding=True)))
+    .order_by(_orders.c.parent_order_id, _orders.c.slice_index)
+)
+
+SELECT_PARENTS = select(_orders.c.id, _orders.c.user_id, _orders.c.status).where(
+    _orders.c.id.in_(bindparam('parent_ids', expanding=True)),
+)
+
+# Sliced orders stream on this pool; created on first use like the dispatch executor
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SLICE_WORKERS, thread_name_prefix='slicing')
+    return _executor
+
+
+def _create_children(engine, record, slices: list) -> list:
+    """Insert the child rows (status processing) and return ``[(child_id, quantity)]``."""
+    now_utc = clock.utcnow()
+    with engine.begin() as conn:
+        conn.execute(INSERT_CHILD, [
+            {'parent_id': record.id, 'quantity': quantity, 'slice_index': index, 'now': now_utc}
+            for index, quantity in enumerate(slices)
+        ])
+        conn.execute(dispatch_sql.INSERT_LOG, {
+            'scheduled_order_id': record.id,
+            'user_id': record.user_id,
+            'status': 'sliced',
+            'message': f'Split {record.quantity} into {len(slices)} child orders of at most {slices[0]} '
+                       f'(freeze quantity {record.freeze_qty}, lot size {record.lot_size or 1})',
+        })
+        touch(conn, 'orders', 'logs')
+        return [tuple(row) for row in conn.execute(SELECT_CHILDREN, {'parent_id': record.id})]
+
+
+def place_sliced(engine, record, kc, rate: float = SLICE_ORDERS_PER_SECOND) -> dict:
+    """Place ``record`` (already claimed) as paced child orders and finish the parent.
+
+    A slice that fails for any reason other than rate limiting stops the stream:
+    the remaining children are cancelled rather than sent into the same rejection.
+    """
+    try:
+        slices = plan_slices(record.quantity, record.lot_size, record.freeze_qty)
+    except SliceError as e:
+        res = {'status': 'error', 'order_status': 'failed', 'error': str(e)}
+        with engine.begin() as conn:
+            dispatch_sql.finish_order(conn, record, 'failed', None, dispatch_sql.encode_result(res))
+        return res
+
+    children = _create_children(engine, record, slices)
+    logger.info('Placing order %s as %s slices for user %s', record.id, len(children), record.user_id)
+    tx = 'BUY' if record.order_type.lower() == 'buy' else 'SELL'
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_slot = time.monotonic()
+    statuses = Counter()
+    filled = 0
+    stopped = False
+    for child_id, quantity in children:
+        child = record._replace(id=child_id, quantity=quantity)
+        if stopped:
+            status, kite_order_id, message = 'cancelled', None, f'Not sent: an earlier slice of order {record.id} failed'
+        else:
+            attempt = 0
+            while True:
+                delay = next_slot - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_slot = max(next_slot, time.monotonic()) + interval
+                try:
+                    res = kc.place_order(record.stock_symbol, quantity, tx)
+                except Exception as e:
+                    logger.exception('Failed to place slice %s of order %s', child_id, record.id)
+                    res = {'status': 'error', 'error': str(e)}
+                if res.get('status') == 'success' or not _is_rate_limited(res) or attempt >= SLICE_RATE_LIMIT_RETRIES:
+                    break
+                backoff = RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt)
+                logger.warning('Slice %s of order %s rate limited; retrying in %ss', child_id, record.id, backoff)
+                next_slot = time.monotonic() + backoff
+                attempt += 1
+            status = 'completed' if res.get('status') == 'success' else 'failed'
+            kite_order_id = res.get('order_id') if status == 'completed' else None
+            message = dispatch_sql.encode_result(res)
+            if status == 'completed':
+                filled += quantity
+            else:
+                stopped = True
+        statuses[status] += 1
+        try:
+            with engine.begin() as conn:
+                dispatch_sql.finish_order(conn, child, status, kite_order_id, message)
+        except Exception:
+            logger.exception('Failed to record result for slice %s of order %s', child_id, record.id)
+
+    status = parent_status(statuses)
+    summary = {
+        'status': 'success' if status == 'completed' else 'error',
+        'order_status': status,
+        'slices': len(children),
+        'filled_quantity': filled,
+        'children': dict(statuses),
+    }
+    try:
+        with engine.begin() as conn:
+            dispatch_sql.finish_order(conn, record, status, None, dispatch_sql.encode_result(summary))
+    except Exception:
+        logger.exception('Failed to record aggregated result for order %s', record.id)
+    return summary
+
+
+def _run_sliced(engine, record, kc, done) -> Optional[dict]:
+    try:
+        summary = place_sliced(engine, record, kc)
+    except Exception:
+        logger.exception('Failed to stream sliced order %s', record.id)
+        return None
+    if done is not None:
+        try:
+            done(summary)
+        except Exception:
+            logger.exception('Failed to complete hand-off of sliced order %s', record.id)
+    return summary
+
+
+def submit_sliced(engine, record, kc, done=None) -> Future:
+    """Stream ``record`` (already claimed) on the slicing pool; ``done(summary)`` runs there afterwards."""
+    return get_executor().submit(_run_sliced, engine, record, kc, done)
+
+
+def recover_interrupted(engine) -> Counter:
+    """Settle the slices a stopped process left ``processing``, and finish their parents.
+
+    Slices go out one at a time in ``slice_index`` order, so only the first
+    unfinished slice of a parent may have reached the broker. It is failed with
+    an ``interrupted`` log entry and not re-sent; the slices after it were never
+    sent and are cancelled. Run before the first poll, like the journal replay.
+    """
+    counts = Counter()
+    with engine.begin() as conn:
+        parent_ids = [row[0] for row in conn.execute(SELECT_INTERRUPTED_PARENTS)]
+        if not parent_ids:
+            return counts
+        family = defaultdict(list)
+        for row in conn.execute(SELECT_FAMILY, {'parent_ids': parent_ids}):
+            family[row.parent_order_id].append(row)
+
+        finishes, logs = [], []
+        for parent in conn.execute(SELECT_PARENTS, {'parent_ids': parent_ids}):
+            statuses = Counter()
+            interrupted = False
+            for child in family[parent.id]:
+                status = child.status
+                if status == 'processing':
+                    if not interrupted:
+                        interrupted = True
+                        status, log_status, message = 'failed', 'interrupted', INTERRUPTED_MESSAGE
+                        counts['interrupted'] += 1
+                    else:
+                        status, log_status, message = 'cancelled', 'cancelled', NOT_SENT_MESSAGE
+                        counts['cancelled'] += 1
+                    finishes.append({'order_id': child.id, 'status': status, 'kite_order_id': None})
+                    logs.append({'scheduled_order_id': child.id, 'user_id': child.user_id,
+                                 'status': log_status, 'message': message})
+                statuses[status] += 1
+            if parent.status == 'processing':
+                status = parent_status(statuses)
+                summary = {'status': 'success' if status == 'completed' else 'error', 'order_status': status,
+                           'slices': sum(statuses.values()), 'children': dict(statuses), 'interrupted': True}
+                finishes.append({'order_id': parent.id, 'status': status, 'kite_order_id': None})
+                logs.append({'scheduled_order_id': parent.id, 'user_id': parent.user_id,
+                             'status': status, 'message': dispatch_sql.encode_result(summary)})
+                counts['parents'] += 1
+        if finishes:
+            conn.execute(dispatch_sql.FINISH_CLAIMED, finishes)
+            conn.execute(dispatch_sql.INSERT_LOG, logs)
+            bump(conn, 'orders', 'logs')
+    logger.warning('Settled interrupted sliced orders: %s', dict(counts))
+    return counts
+
+
+def load_instruments(conn, path: str) -> int:
+    """Upsert instruments from a CSV with ``tradingsymbol`` (or ``symbol``), ``lot_size``
+    and ``freeze_qty`` columns, plus optional ``exchange`` and ``instrument_token``
+    (so Kite's instruments dump loads as is). Rows for other exchanges than NSE are
+    skipped. Returns rows written."""
+    with open(path, newline='') as fh:
+        rows = {}
+        for lineno, row in enumerate(csv.DictReader(fh), start=2):
+            row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+            symbol = (row.get('tradingsymbol') or row.get('symbol') or '').upper()
+            if not symbol:
+                continue
+            try:
+                lot_size = int(row.get('lot_size') or 1)
+                freeze_qty = int(row['freeze_qty']) if row.get('freeze_qty') else None
+                token = int(row['instrument_token']) if row.get('instrument_token') else None
+            except ValueError:
+                raise SliceError(f'line {lineno}: lot_size, freeze_qty and instrument_token must be integers')
+            exchange = (row.get('exchange') or 'NSE').upper()
+            if exchange != 'NSE':
+                continue  # orders are only placed on NSE
+            rows[symbol] = {'tradingsymbol': symbol, 'exchange': exchange, 'lot_size': lot_size,
+                            'freeze_qty': freeze_qty, 'instrument_token': token}
+    rows = list(rows.values())
+
+    now_utc = clock.utcnow()
+    existing = {symbol for (symbol,) in conn.execute(select(_instruments.c.tradingsymbol))}
+    inserts = [dict(row, updated_at=now_utc) for row in rows if row['tradingsymbol'] not in existing]
+    updates = [{'symbol': row['tradingsymbol'], 'new_exchange': row['exchange'], 'new_lot_size': row['lot_size'],
+                'new_freeze_qty': row['freeze_qty'], 'new_token': row['instrument_token'], 'now': now_utc}
+               for row in rows if row['tradingsymbol'] in existing]
+    if inserts:
+        conn.execute(insert(_instruments), inserts)
+    if updates:
+        conn.execute(
+            update(_instruments).where(_instruments.c.tradingsymbol == bindparam('symbol')).values(
+                exchange=bindparam('new_exchange'), lot_size=bindparam('new_lot_size'),
+                freeze_qty=bindparam('new_freeze_qty'), instrument_token=bindparam('new_token'),
+                updated_at=bindparam('now'),
+            ),
+            updates,
+        )
+    bump(conn, 'instruments')
+    return len(rows)
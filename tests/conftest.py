@@ -0,0 +1,109 @@
+"""Shared fixtures: a migrated SQLite database per test, one left at the baseline schema, and row helpers.
+
+Settings are read from the environment when config.py is imported, so they are
+set here before any application module is loaded: no real broker calls, no
+heartbeat file, slow-query log, journal or notification socket.
+"""
+import os
+import sys
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['KITE_ENABLE_REAL'] = 'false'
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['HEARTBEAT_PATH'] = ''
+os.environ['SLOW_QUERY_LOG'] = ''
+os.environ['DISPATCH_JOURNAL'] = ''
+os.environ['ORDER_NOTIFY'] = 'off'
+
+import pytest  # noqa: E402
+from sqlalchemy import create_engine, insert, inspect, text  # noqa: E402
+
+import clock  # noqa: E402
+import migrations  # noqa: E402
+from models import KiteUser, ScheduledOrder  # noqa: E402
+
+
+# The tables as the baseline migration created them, before any later migration
+BASELINE_DDL = [
+    """CREATE TABLE kite_users (
+        id INTEGER NOT NULL, user_id VARCHAR(128), api_key VARCHAR(256) NOT NULL,
+        api_secret VARCHAR(256) NOT NULL, access_token VARCHAR(1024), token_expiry DATETIME,
+        email VARCHAR(256), user_name VARCHAR(256), user_shortname VARCHAR(256), broker VARCHAR(32),
+        created_at DATETIME, exchanges VARCHAR(256), products VARCHAR(256), order_types VARCHAR(256),
+        avatar_url VARCHAR(1024), token_set_at DATETIME,
+        PRIMARY KEY (id), UNIQUE (user_id), UNIQUE (api_key))""",
+    """CREATE TABLE scheduled_order_bulk_audits (
+        id INTEGER NOT NULL, initiator VARCHAR(256), stock_symbol VARCHAR(64) NOT NULL,
+        quantity INTEGER NOT NULL, order_type VARCHAR(16) NOT NULL, scheduled_time DATETIME NOT NULL,
+        users_targeted INTEGER NOT NULL, users_created INTEGER NOT NULL, message VARCHAR(1024),
+        created_at DATETIME, PRIMARY KEY (id))""",
+    """CREATE TABLE admins (
+        id INTEGER NOT NULL, username VARCHAR(128) NOT NULL, password_hash VARCHAR(256) NOT NULL,
+        email VARCHAR(256), created_at DATETIME, PRIMARY KEY (id), UNIQUE (username))""",
+    """CREATE TABLE scheduled_orders (
+        id INTEGER NOT NULL, user_id INTEGER NOT NULL, stock_symbol VARCHAR(64) NOT NULL,
+        quantity INTEGER NOT NULL, order_type VARCHAR(8) NOT NULL, scheduled_time DATETIME NOT NULL,
+        status VARCHAR(32), kite_order_id VARCHAR(128), created_at DATETIME, updated_at DATETIME,
+        PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES kite_users (id))""",
+    "CREATE INDEX ix_scheduledorder_scheduled_time_status ON scheduled_orders (scheduled_time, status)",
+    """CREATE TABLE scheduled_order_logs (
+        id INTEGER NOT NULL, scheduled_order_id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+        status VARCHAR(64) NOT NULL, message VARCHAR(1024), created_at DATETIME, PRIMARY KEY (id),
+        FOREIGN KEY(scheduled_order_id) REFERENCES scheduled_orders (id),
+        FOREIGN KEY(user_id) REFERENCES kite_users (id))""",
+]
+
+
+@pytest.fixture
+def baseline_engine(tmp_path):
+    """A database left at migration 1, with one user (id 1) and one pending order (id 1)."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as conn:
+        for ddl in BASELINE_DDL:
+            conn.execute(text(ddl))
+        conn.execute(text(
+            "INSERT INTO kite_users (id, user_id, api_key, api_secret) VALUES (1, 'AB1234', 'key', 'secret')"))
+        conn.execute(text(
+            "INSERT INTO scheduled_orders (id, user_id, stock_symbol, quantity, order_type, scheduled_time, status) "
+            "VALUES (1, 1, 'INFY', 5, 'buy', '2026-01-05 09:30:00.000000', 'pending')"))
+    migrations.schema_migrations.create(engine)
+    with engine.begin() as conn:
+        conn.execute(migrations.schema_migrations.insert().values(version=1, description='baseline schema'))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    migrations.upgrade(engine)
+    yield engine
+    engine.dispose()
+
+
+def add_user(conn, n: int, valid_token: bool = True, **values) -> int:
+    row = {
+        'user_id': f'U{n}', 'api_key': f'key{n}', 'api_secret': 'secret', 'dispatch_priority': 0,
+        'created_at': clock.utcnow(),
+    }
+    if valid_token:
+        row.update(access_token=f'token{n}', token_expiry=clock.utcnow() + timedelta(days=1))
+    row.update(values)
+    return conn.execute(insert(KiteUser.__table__).values(**row)).inserted_primary_key[0]
+
+
+def add_order(conn, user_id: int, **values) -> int:
+    row = {
+        'user_id': user_id, 'stock_symbol': 'INFY', 'quantity': 1, 'order_type': 'buy',
+        'scheduled_time': clock.now_ist() - timedelta(seconds=1), 'status': 'pending',
+        'created_at': clock.utcnow(), 'updated_at': clock.utcnow(),
+    }
+    row.update(values)
+    return conn.execute(insert(ScheduledOrder.__table__).values(**row)).inserted_primary_key[0]
+
+
+def columns(engine, table: str) -> set:
+    return {column['name'] for column in inspect(engine).get_columns(table)}
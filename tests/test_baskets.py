@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from sqlalchemy import text
+
+import clock
+import migrations
+import scheduler
+from baskets import create_basket
+from fair_dispatch import dispatch_units
+from conftest import add_order, add_user, columns
+
+LEGS = [
+    {'stock_symbol': 'INFY', 'quantity': 1, 'order_type': 'buy'},
+    {'stock_symbol': 'TCS', 'quantity': 2, 'order_type': 'sell'},
+]
+
+
+def _due_units(engine):
+    with engine.connect() as conn:
+        return [[order.id for order in unit] for unit in dispatch_units(scheduler._due_orders(conn, clock.now_ist()))]
+
+
+def test_basket_straddling_the_scan_limit_is_completed(engine, monkeypatch):
+    with engine.begin() as conn:
+        for n in range(3):
+            add_user(conn, n)
+        _, created = create_basket(conn, LEGS, clock.now_ist() - timedelta(seconds=5))
+    assert created == 3
+    # legs are inserted leg by leg across users: ids 1-3 are leg 0, ids 4-6 leg 1
+    monkeypatch.setattr(scheduler, 'FAIR_SCAN_LIMIT', 4)
+
+    units = _due_units(engine)
+
+    assert sorted(units) == [[1, 4], [2, 5], [3, 6]]
+
+
+def test_scan_limit_does_not_pull_in_unrelated_orders(engine, monkeypatch):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        create_basket(conn, LEGS, clock.now_ist() - timedelta(seconds=5))
+        for _ in range(3):
+            add_order(conn, user)
+    monkeypatch.setattr(scheduler, 'FAIR_SCAN_LIMIT', 1)
+
+    units = _due_units(engine)
+
+    assert units == [[1, 2]]
+
+
+def test_next_batch_never_splits_a_basket(engine, monkeypatch):
+    with engine.begin() as conn:
+        for n in range(3):
+            add_user(conn, n)
+        create_basket(conn, LEGS, clock.now_ist() - timedelta(seconds=5))
+    monkeypatch.setattr(scheduler, 'BATCH_SIZE', 3)
+
+    with engine.connect() as conn:
+        batch = scheduler._next_batch(scheduler._due_orders(conn, clock.now_ist()))
+
+    assert [len(unit) for unit in batch] == [2]
+
+
+def test_basket_without_eligible_users_creates_no_orders(engine):
+    with engine.begin() as conn:
+        add_user(conn, 1, valid_token=False)
+        _, created = create_basket(conn, LEGS, clock.now_ist() + timedelta(minutes=5))
+
+    assert created == 0
+
+
+def test_migration_adds_basket_columns(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert {'kind', 'legs'} <= columns(baseline_engine, 'scheduled_order_bulk_audits')
+    assert 'basket_leg' in columns(baseline_engine, 'scheduled_orders')
+    with baseline_engine.connect() as conn:
+        assert conn.execute(text('SELECT basket_leg FROM scheduled_orders WHERE id = 1')).scalar() is None
@@ -0,0 +1,79 @@
+import io
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from bulk_users import detect_format, export_users, iter_records, upsert_users
+from conftest import add_user
+from models import KiteUser
+
+users = KiteUser.__table__
+
+
+@pytest.fixture
+def session(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def _import(session, text, fmt='csv', **kwargs):
+    return [(r.line, r.status) for r in upsert_users(session, iter_records(io.StringIO(text), fmt), **kwargs)]
+
+
+def test_detect_format():
+    assert detect_format('users.csv') == 'csv'
+    assert detect_format('users.JSONL') == 'jsonl'
+    assert detect_format('-', 'JSONL') == 'jsonl'
+
+
+def test_csv_import_creates_updates_and_reports_every_row(engine, session):
+    with engine.begin() as conn:
+        add_user(conn, 1, api_key='known', api_secret='old')
+        add_user(conn, 2, api_key='same', api_secret='secret')
+
+    results = _import(session, 'api_key,api_secret\n'
+                               'new1,s1\nknown,new-secret\nsame,secret\nnew1,again\n,missing\nnew2,s2\n',
+                      batch_size=2)
+
+    assert results == [(2, 'created'), (3, 'updated'), (4, 'unchanged'), (5, 'duplicate'), (6, 'invalid'),
+                       (7, 'created')]
+    with engine.connect() as conn:
+        rows = {row.api_key: row for row in conn.execute(select(users))}
+    assert set(rows) == {'known', 'same', 'new1', 'new2'}
+    # a changed secret invalidates the stored token, like an edit in the dashboard
+    assert rows['known'].api_secret == 'new-secret' and rows['known'].access_token is None
+    assert rows['same'].access_token is not None
+
+
+def test_no_update_leaves_existing_users_alone(engine, session):
+    with engine.begin() as conn:
+        add_user(conn, 1, api_key='known', api_secret='old')
+
+    assert _import(session, '{"api_key": "known", "api_secret": "new"}\n', 'jsonl', update_existing=False) \
+        == [(1, 'unchanged')]
+
+
+def test_jsonl_reports_bad_lines():
+    records = list(iter_records(io.StringIO('{"api_key": "a", "api_secret": "b"}\n\nnot json\n[1]\n'), 'jsonl'))
+
+    assert [(line, error is None) for line, _, error in records] == [(1, True), (3, False), (4, False)]
+
+
+def test_export_round_trips_through_import(engine, session):
+    with engine.begin() as conn:
+        for n in range(3):
+            add_user(conn, n)
+    stream = io.StringIO()
+
+    assert export_users(session, stream, 'jsonl', include_secrets=True, batch_size=2) == 3
+
+    other = sessionmaker(bind=engine)()
+    try:
+        assert [status for _, status in _import(other, stream.getvalue(), 'jsonl')] == ['unchanged'] * 3
+    finally:
+        other.close()
+    csv_stream = io.StringIO()
+    export_users(session, csv_stream, 'csv')
+    assert csv_stream.getvalue().splitlines()[0] == 'id,api_key,user_id,user_name,email,broker,created_at,token_expiry'
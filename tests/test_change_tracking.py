@@ -0,0 +1,63 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import change_tracking
+import migrations
+from change_tracking import RESOURCES, VersionPublisher, read_versions, touch
+from conftest import add_user
+from models import KiteUser
+
+
+@pytest.fixture(autouse=True)
+def no_touched_leftovers():
+    change_tracking._touched.clear()
+    yield
+    change_tracking._touched.clear()
+
+
+def _versions(engine, names=RESOURCES):
+    with engine.connect() as conn:
+        return {name: version for name, (version, _) in read_versions(conn, names).items()}
+
+
+def test_migration_seeds_every_resource_version(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert _versions(baseline_engine) == {name: 0 for name in RESOURCES}
+
+
+def test_orm_commit_bumps_the_changed_resources_once(engine):
+    session = sessionmaker(bind=engine)()
+    try:
+        for n in range(3):
+            session.add(KiteUser(user_id=f'U{n}', api_key=f'key{n}', api_secret='secret'))
+            session.flush()
+        session.commit()
+        session.add(KiteUser(user_id='U9', api_key='key9', api_secret='secret'))
+        session.flush()
+        session.rollback()
+    finally:
+        session.close()
+
+    versions = _versions(engine)
+    assert versions['users'] == 1
+    assert all(version == 0 for name, version in versions.items() if name != 'users')
+
+
+def test_publisher_bumps_committed_touches_twice_and_skips_rollbacks(engine):
+    with engine.begin() as conn:
+        add_user(conn, 1)
+        touch(conn, 'users', 'orders')
+    with pytest.raises(RuntimeError):
+        with engine.begin() as conn:
+            touch(conn, 'logs')
+            raise RuntimeError('rolled back')
+    publisher = VersionPublisher(engine, interval=60)
+
+    publisher.publish()
+    assert _versions(engine, ['users', 'orders', 'logs']) == {'users': 1, 'orders': 1, 'logs': 0}
+    # the trailing bump covers a reader that cached the old rows under the first one
+    publisher.publish()
+    assert _versions(engine, ['users', 'orders', 'logs']) == {'users': 2, 'orders': 2, 'logs': 0}
+    publisher.publish()
+    assert _versions(engine, ['users', 'orders', 'logs']) == {'users': 2, 'orders': 2, 'logs': 0}
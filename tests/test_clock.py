@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import clock
+from change_tracking import bump, read_versions
+from conftest import add_order, add_user
+from kite_sessions import ProfileHydrator
+from models import ScheduledOrder
+from triggers import fire_triggers
+
+REPLAY_DAY = datetime(2031, 3, 3, 9, 15)
+
+
+@pytest.fixture
+def virtual_clock():
+    virtual = clock.VirtualClock(REPLAY_DAY)
+    previous = clock.set_clock(virtual)
+    yield virtual
+    clock.set_clock(previous)
+
+
+def _close_to(moment, expected):
+    return abs(moment - expected) < timedelta(minutes=1)
+
+
+def test_fired_triggers_and_version_bumps_use_the_injected_clock(engine, virtual_clock):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        order_id = add_order(conn, user, status='armed', trigger_price=1500.0, trigger_direction='above')
+        assert fire_triggers(conn, [(order_id, 'INFY', 1501.0)], clock.now_ist()) == [order_id]
+        bump(conn, 'orders')
+        updated_at = conn.execute(select(ScheduledOrder.updated_at).where(ScheduledOrder.id == order_id)).scalar()
+        version_at = read_versions(conn, ['orders'])['orders'][1]
+
+    assert _close_to(updated_at, REPLAY_DAY - clock.IST_OFFSET)
+    assert _close_to(version_at, REPLAY_DAY - clock.IST_OFFSET)
+
+
+def test_token_expiry_is_judged_by_the_injected_clock(engine, virtual_clock):
+    with engine.begin() as conn:
+        # valid by the wall clock, long expired on the replayed day
+        add_user(conn, 1, token_expiry=datetime.utcnow() + timedelta(days=1))
+        add_user(conn, 2, token_expiry=REPLAY_DAY + timedelta(days=1))
+    hydrator = ProfileHydrator()
+    queued = []
+    hydrator.enqueue = lambda engine, user_id, api_key, access_token: queued.append(user_id)
+
+    assert hydrator.requeue_unhydrated(engine) == 1
+    assert queued == [2]
@@ -0,0 +1,91 @@
+import shutil
+
+import pytest
+from sqlalchemy import select
+
+import clock
+import dispatch_sql
+from conftest import add_order, add_user
+from dispatch_journal import DispatchJournal, replay
+from models import ScheduledOrder, ScheduledOrderLog
+
+JOURNAL_BYTES = 1024 * 1024
+
+
+@pytest.fixture
+def claimed(engine):
+    """Records of three due orders claimed by a dispatcher."""
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        ids = [add_order(conn, user) for _ in range(3)]
+        records = dispatch_sql.claim_orders(conn, ids, clock.now_ist())
+    assert [r.id for r in records] == ids
+    return records
+
+
+def _journal(tmp_path, records, write):
+    path = str(tmp_path / 'dispatch.journal')
+    journal = DispatchJournal(path, size_bytes=JOURNAL_BYTES)
+    journal.claim(records)
+    write(journal)
+    journal.close()
+    return path
+
+
+def _state(engine):
+    orders = ScheduledOrder.__table__
+    logs = ScheduledOrderLog.__table__
+    with engine.connect() as conn:
+        statuses = dict(conn.execute(select(orders.c.id, orders.c.status)).all())
+        log_rows = conn.execute(select(logs.c.scheduled_order_id, logs.c.status).order_by(logs.c.id)).all()
+    return statuses, [tuple(row) for row in log_rows]
+
+
+def _replay(engine, path):
+    journal = DispatchJournal(path, size_bytes=JOURNAL_BYTES)
+    try:
+        return replay(engine, journal)
+    finally:
+        journal.close()
+
+
+def test_claimed_orders_go_back_to_pending(engine, claimed, tmp_path):
+    path = _journal(tmp_path, claimed, lambda journal: None)
+
+    assert _replay(engine, path) == {'requeued': 3}
+    statuses, logs = _state(engine)
+    assert set(statuses.values()) == {'pending'}
+    assert logs == []
+
+
+def test_sent_order_is_logged_interrupted_once(engine, claimed, tmp_path):
+    sent = claimed[0]
+    path = _journal(tmp_path, claimed, lambda journal: journal.sent(sent))
+    # a crash between the replay commit and the journal reset replays the same records
+    shutil.copy(path, tmp_path / 'copy.journal')
+
+    assert _replay(engine, path) == {'interrupted': 1, 'requeued': 2}
+    assert _replay(engine, str(tmp_path / 'copy.journal')) == {}
+    statuses, logs = _state(engine)
+    assert statuses[sent.id] == 'processing'
+    assert logs == [(sent.id, 'interrupted')]
+
+
+def test_acked_order_is_completed_with_one_log(engine, claimed, tmp_path):
+    acked = claimed[0]
+
+    def write(journal):
+        journal.sent(acked)
+        journal.outcome(acked, 'completed', 'K1', 'placed')
+    path = _journal(tmp_path, claimed, write)
+    shutil.copy(path, tmp_path / 'copy.journal')
+
+    assert _replay(engine, path) == {'applied': 1, 'requeued': 2}
+    assert _replay(engine, str(tmp_path / 'copy.journal')) == {}
+    statuses, logs = _state(engine)
+    assert statuses[acked.id] == 'completed'
+    assert logs == [(acked.id, 'completed')]
+    with engine.connect() as conn:
+        kite_order_id = conn.execute(
+            select(ScheduledOrder.kite_order_id).where(ScheduledOrder.id == acked.id)).scalar()
+    assert kite_order_id == 'K1'
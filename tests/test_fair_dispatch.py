@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import migrations
+from conftest import columns
+from fair_dispatch import BurstPositions, DueOrder, dispatch_units, order_fairly
+
+T0 = datetime(2026, 10, 20, 9, 30)
+
+
+def order(order_id, user_id, when=T0, priority=0, basket_id=None, leg=None, position=None):
+    return DueOrder(order_id, user_id, when, priority, position, basket_id, leg)
+
+
+def test_earlier_deadline_goes_first():
+    rows = [order(1, 1, T0 + timedelta(seconds=1)), order(2, 2, T0)]
+
+    assert [r.id for r in order_fairly(rows)] == [2, 1]
+
+
+def test_higher_priority_tier_goes_first():
+    rows = [order(1, 1), order(2, 2, priority=5), order(3, 3)]
+
+    assert order_fairly(rows)[0].id == 2
+
+
+def test_round_robin_across_users_within_a_burst():
+    rows = [order(1, 1), order(2, 1), order(3, 1), order(4, 2), order(5, 3)]
+
+    ordered = order_fairly(rows)
+
+    # every user's first order before anyone's second, and a user's own orders keep id order
+    assert {r.user_id for r in ordered[:3]} == {1, 2, 3}
+    assert [r.id for r in ordered if r.user_id == 1] == [1, 2, 3]
+
+
+def test_rotation_is_stable_per_burst_and_changes_between_bursts():
+    users = range(1, 21)
+    first_users = set()
+    for minute in range(10):
+        when = T0 + timedelta(minutes=minute)
+        rows = [order(user_id, user_id, when) for user_id in users]
+        ordered = order_fairly(rows)
+        assert ordered == order_fairly(list(reversed(rows)))
+        first_users.add(ordered[0].user_id)
+    assert len(first_users) > 1
+
+
+def test_basket_legs_are_one_turn_and_stay_adjacent_in_leg_order():
+    rows = [
+        order(1, 1, basket_id=7, leg=1),
+        order(2, 1, basket_id=7, leg=0),
+        order(3, 1),
+        order(4, 2),
+    ]
+
+    ordered = order_fairly(rows)
+    ids = [r.id for r in ordered]
+
+    assert ids.index(1) == ids.index(2) + 1
+    # the basket is user 1's first turn, the single order its second
+    assert ids.index(3) > ids.index(4)
+
+
+def test_dispatch_units_group_a_users_basket_legs():
+    rows = order_fairly([
+        order(1, 1, basket_id=7, leg=0),
+        order(2, 1, basket_id=7, leg=1),
+        order(3, 2, basket_id=7, leg=0),
+        order(4, 2, basket_id=7, leg=1),
+        order(5, 3),
+    ])
+
+    units = sorted(sorted(r.id for r in unit) for unit in dispatch_units(rows))
+
+    assert units == [[1, 2], [3, 4], [5]]
+
+
+def test_burst_positions_continue_after_recorded_ones():
+    positions = BurstPositions()
+    rows = [order(1, 1), order(2, 2, position=0), order(3, 3)]
+
+    assigned = positions.assign(rows, lambda when: 4)
+
+    assert assigned == [(1, 5), (3, 6)]
+    assert positions.assign([order(9, 9)], lambda when: None) == [(9, 7)]
+
+
+def test_migration_adds_priorities_with_defaults_for_existing_rows(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert {'priority', 'dispatch_position'} <= columns(baseline_engine, 'scheduled_orders')
+    assert 'priority' in columns(baseline_engine, 'scheduled_order_bulk_audits')
+    with baseline_engine.connect() as conn:
+        order = conn.execute(text('SELECT priority, dispatch_position FROM scheduled_orders WHERE id = 1')).one()
+        user = conn.execute(text('SELECT dispatch_priority FROM kite_users WHERE id = 1')).one()
+    assert tuple(order) == (0, None)
+    assert tuple(user) == (0,)
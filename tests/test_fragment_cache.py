@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from markupsafe import Markup
+
+from fragment_cache import FragmentCache
+
+NOW = datetime(2026, 10, 19, 9, 30)
+
+
+def test_entry_is_reused_only_for_the_same_version_tag():
+    cache = FragmentCache(max_entries=4)
+    cache.put('users', 'users.3', Markup('<table>'))
+
+    assert cache.get('users', 'users.3', NOW) == '<table>'
+    assert cache.get('users', 'users.4', NOW) is None
+    assert cache.get('orders', 'orders.1', NOW) is None
+
+
+def test_entry_expires_at_valid_until():
+    cache = FragmentCache(max_entries=4)
+    cache.put('users', 'users.3', Markup('<table>'), valid_until=NOW + timedelta(minutes=5))
+
+    assert cache.get('users', 'users.3', NOW + timedelta(minutes=4)) is not None
+    assert cache.get('users', 'users.3', NOW + timedelta(minutes=5)) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = FragmentCache(max_entries=2)
+    cache.put(('logs', 1), 'logs.1', Markup('page 1'))
+    cache.put(('logs', 2), 'logs.1', Markup('page 2'))
+    cache.get(('logs', 1), 'logs.1', NOW)
+
+    cache.put(('logs', 3), 'logs.1', Markup('page 3'))
+
+    assert cache.get(('logs', 2), 'logs.1', NOW) is None
+    assert cache.get(('logs', 1), 'logs.1', NOW) == 'page 1'
+    assert cache.get(('logs', 3), 'logs.1', NOW) == 'page 3'
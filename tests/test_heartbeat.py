@@ -0,0 +1,71 @@
+import time
+from datetime import datetime, timedelta
+
+from conftest import add_order, add_user
+from heartbeat import Heartbeat, HeartbeatReader, assess
+from scheduler import PendingCounter
+
+DEADLINE = datetime(2026, 10, 19, 9, 30)
+
+
+def test_published_snapshot_is_read_back_by_another_process(tmp_path):
+    path = str(tmp_path / 'heartbeat.json')
+    heartbeat = Heartbeat(path=path)
+    heartbeat.order_started(3)
+    heartbeat.order_finished()
+
+    heartbeat.loop_finished(time.time(), pending=5, next_deadline=DEADLINE)
+
+    snapshot = HeartbeatReader(path).read()
+    assert (snapshot['pending'], snapshot['in_flight'], snapshot['loops']) == (5, 2, 1)
+    assert snapshot['next_deadline'] == '2026-10-19T09:30:00'
+    assert HeartbeatReader(str(tmp_path / 'missing.json')).read() is None
+
+
+def test_assess_readiness():
+    now = time.time()
+    fresh = {'last_loop_at': now - 1, 'interval_seconds': 1, 'pending': 2, 'next_deadline': DEADLINE.isoformat()}
+
+    assert assess(fresh, now, DEADLINE + timedelta(seconds=5))['ready']
+    assert assess(None, now)['reasons'] == ['no scheduler heartbeat']
+    stale = assess(dict(fresh, last_loop_at=now - 120), now)
+    assert not stale['ready'] and 'old' in stale['reasons'][0]
+    # a long safety-sweep interval widens the staleness limit
+    assert assess(dict(fresh, last_loop_at=now - 120, interval_seconds=90), now)['ready']
+    overdue = assess(fresh, now, DEADLINE + timedelta(minutes=5))
+    assert not overdue['ready'] and 'overdue' in overdue['reasons'][0]
+    assert assess(dict(fresh, pending=0), now, DEADLINE + timedelta(minutes=5))['ready']
+
+
+def test_pending_counter_tracks_claims_and_new_orders_without_recounting(engine):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        first = [add_order(conn, user) for _ in range(3)]
+    counter = PendingCounter(recount_seconds=3600)
+
+    with engine.connect() as conn:
+        assert counter.refresh(conn)[0] == 3
+    counter.claimed(first[:2])
+    with engine.begin() as conn:
+        add_order(conn, user)
+        claimed_new = add_order(conn, user, status='processing')
+    # an order past the watermark is not in the count yet, so its claim must not be subtracted
+    counter.claimed([claimed_new])
+    counter.requeued(first[:1])
+    with engine.connect() as conn:
+        count, next_deadline = counter.refresh(conn)
+
+    assert count == 3 - 2 + 1 + 1
+    assert next_deadline is not None
+
+
+def test_pending_counter_recounts_after_the_interval(engine):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        add_order(conn, user)
+        add_order(conn, user, status='cancelled')
+    counter = PendingCounter(recount_seconds=0)
+    counter.count, counter.max_id = 99, 99
+
+    with engine.connect() as conn:
+        assert counter.refresh(conn)[0] == 1
@@ -0,0 +1,128 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+import kite_sessions
+import migrations
+from conftest import add_user, columns
+from kite_sessions import ProfileHydrator, profile_values, revalidate_tokens, token_expiry
+from models import KiteUser
+
+users = KiteUser.__table__
+
+
+def profile(client_id, **values):
+    payload = {'user_id': client_id, 'email': f'{client_id.lower()}@example.com', 'user_name': client_id,
+               'exchanges': ['NSE', 'BSE'], 'products': ['CNC', 'MIS'], 'broker': 'ZERODHA'}
+    payload.update(values)
+    return payload
+
+
+def _rows(engine):
+    with engine.connect() as conn:
+        return {row.id: row for row in conn.execute(select(users))}
+
+
+def _hydrator(engine):
+    hydrator = ProfileHydrator()
+    hydrator.engine = engine
+    return hydrator
+
+
+def test_batch_hydrates_every_user(engine):
+    with engine.begin() as conn:
+        ids = [add_user(conn, n) for n in range(3)]
+
+    written = _hydrator(engine).write([(uid, f'key{n}', f'token{n}', profile(f'ZX{n}')) for n, uid in enumerate(ids)])
+
+    assert written == 3
+    rows = _rows(engine)
+    assert [rows[uid].user_id for uid in ids] == ['ZX0', 'ZX1', 'ZX2']
+    assert rows[ids[0]].exchanges == 'NSE,BSE'
+    assert all(rows[uid].profile_synced_at is not None for uid in ids)
+
+
+def test_batch_skips_a_stale_token(engine):
+    with engine.begin() as conn:
+        uid = add_user(conn, 1)
+
+    assert _hydrator(engine).write([(uid, 'key1', 'older-token', profile('ZX1'))]) == 1
+    assert _rows(engine)[uid].user_id == 'U1'
+
+
+def test_conflicting_user_does_not_drop_the_batch(engine):
+    with engine.begin() as conn:
+        ids = [add_user(conn, n) for n in range(3)]
+    # the second login is the same Zerodha client as the first user already stored
+    batch = [(ids[0], 'key0', 'token0', profile('ZX0')),
+             (ids[1], 'key1', 'token1', profile('U2')),
+             (ids[2], 'key2', 'token2', profile('ZX2'))]
+
+    assert _hydrator(engine).write(batch) == 2
+
+    rows = _rows(engine)
+    assert [rows[uid].user_id for uid in ids] == ['ZX0', 'U1', 'ZX2']
+    assert rows[ids[1]].profile_synced_at is None
+
+
+class TokenException(Exception):
+    pass
+
+
+class FakeKite:
+    def __init__(self, outcomes, api_key):
+        self.outcome = outcomes[api_key]
+
+    def profile(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+def test_revalidate_clears_rejected_tokens_despite_a_profile_conflict(engine, monkeypatch):
+    with engine.begin() as conn:
+        valid, conflicting, rejected = (add_user(conn, n) for n in range(3))
+    outcomes = {'key0': profile('ZX0'), 'key1': profile('U2'), 'key2': TokenException('Incorrect api_key')}
+    monkeypatch.setattr(kite_sessions, '_kite', lambda api_key, access_token: FakeKite(outcomes, api_key))
+
+    counts = revalidate_tokens(engine, workers=2)
+
+    assert counts == {'valid': 2, 'invalid': 1}
+    rows = _rows(engine)
+    assert rows[valid].user_id == 'ZX0'
+    assert rows[conflicting].user_id == 'U1'
+    assert rows[rejected].access_token is None and rows[rejected].token_expiry is None
+    assert all(rows[uid].token_checked_at is not None for uid in (valid, conflicting, rejected))
+
+
+def test_token_expiry_is_the_next_six_am_ist_in_utc():
+    assert token_expiry(datetime(2026, 10, 19, 9, 15)) == datetime(2026, 10, 20, 0, 30)
+    assert token_expiry(datetime(2026, 10, 19, 5, 59)) == datetime(2026, 10, 19, 0, 30)
+
+
+def test_profile_values_joins_lists_and_stringifies_the_client_id():
+    values = profile_values({'user_id': 1234, 'exchanges': ['NSE', 'NFO'], 'email': 'a@example.com'})
+
+    assert values['user_id'] == '1234'
+    assert values['exchanges'] == 'NSE,NFO'
+    assert values['avatar_url'] is None
+
+
+def test_requeue_picks_tokens_never_hydrated(engine):
+    with engine.begin() as conn:
+        pending = add_user(conn, 1)
+        add_user(conn, 2, token_set_at=datetime(2026, 10, 19, 9), profile_synced_at=datetime(2026, 10, 19, 9, 1))
+        stale = add_user(conn, 3, token_set_at=datetime(2026, 10, 19, 9), profile_synced_at=datetime(2026, 10, 18))
+        add_user(conn, 4, valid_token=False)
+    hydrator = ProfileHydrator()
+    queued = []
+    hydrator.enqueue = lambda engine, user_id, api_key, access_token: queued.append(user_id)
+
+    assert hydrator.requeue_unhydrated(engine) == 2
+    assert queued == [pending, stale]
+
+
+def test_migration_adds_hydration_columns(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert {'profile_synced_at', 'token_checked_at'} <= columns(baseline_engine, 'kite_users')
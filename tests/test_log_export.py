@@ -0,0 +1,81 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect, insert
+from werkzeug.datastructures import MultiDict
+
+import migrations
+from conftest import add_order, add_user
+from log_export import ExportFilterError, export_filename, parse_export_args, stream_export
+from models import ScheduledOrderLog
+
+
+def test_migration_indexes_log_created_at(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    indexes = {index['name'] for index in inspect(baseline_engine).get_indexes('scheduled_order_logs')}
+    assert 'ix_scheduledorderlog_created_at' in indexes
+
+
+def test_a_date_covers_the_whole_ist_day_in_utc():
+    filters = parse_export_args(MultiDict({'date': '2026-10-19', 'user_id': '1,2', 'status': 'failed, completed'}))
+
+    assert filters == {
+        'format': 'csv',
+        'start': datetime(2026, 10, 18, 18, 30),
+        'end': datetime(2026, 10, 19, 18, 30),
+        'user_ids': [1, 2],
+        'statuses': ['failed', 'completed'],
+    }
+    assert export_filename(filters) == 'order-logs-20261019T0000-20261020T0000.csv.gz'
+
+
+@pytest.mark.parametrize('args, error', [
+    ({}, 'is required'),
+    ({'date': '2026-10-19', 'format': 'xml'}, 'format must be one of'),
+    ({'date': '19/10/2026'}, 'not an ISO date'),
+    ({'from': '2026-10-19', 'to': '2026-10-18'}, 'after from'),
+    ({'from': '2026-01-01', 'to': '2026-12-31'}, 'days per export'),
+    ({'date': '2026-10-19', 'user_id': 'U1'}, 'must be an integer'),
+])
+def test_invalid_filters_are_rejected(args, error):
+    with pytest.raises(ExportFilterError, match=error):
+        parse_export_args(MultiDict(args))
+
+
+def _export(engine, fmt, chunk_rows):
+    start = datetime(2026, 10, 19)
+    filters = {'format': fmt, 'start': start, 'end': start + timedelta(days=1)}
+    return gzip.decompress(b''.join(stream_export(engine, filters, chunk_rows=chunk_rows))).decode('utf-8')
+
+
+@pytest.fixture
+def logged(engine):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        order = add_order(conn, user, kite_order_id='K1', status='completed')
+        conn.execute(insert(ScheduledOrderLog.__table__), [
+            {'scheduled_order_id': order, 'user_id': user, 'status': 'completed', 'message': f'm{n}',
+             'created_at': datetime(2026, 10, 19, 4, n)}
+            for n in range(5)
+        ] + [{'scheduled_order_id': order, 'user_id': user, 'status': 'completed', 'message': 'outside',
+              'created_at': datetime(2026, 10, 20, 4)}])
+    return engine
+
+
+def test_csv_export_streams_every_row_in_the_range(logged):
+    rows = list(csv.DictReader(io.StringIO(_export(logged, 'csv', chunk_rows=2))))
+
+    assert [row['message'] for row in rows] == ['m0', 'm1', 'm2', 'm3', 'm4']
+    assert rows[0]['kite_order_id'] == 'K1' and rows[0]['stock_symbol'] == 'INFY'
+
+
+def test_ndjson_export_is_one_object_per_line(logged):
+    lines = _export(logged, 'ndjson', chunk_rows=3).splitlines()
+
+    assert [json.loads(line)['message'] for line in lines] == ['m0', 'm1', 'm2', 'm3', 'm4']
+    assert json.loads(lines[0])['created_at'] == '2026-10-19T04:00:00'
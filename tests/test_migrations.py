@@ -0,0 +1,26 @@
+"""The migration runner itself; each request's schema changes are checked in its own test module."""
+from sqlalchemy import text
+
+import migrations
+
+
+def test_upgrade_from_baseline_applies_every_later_migration(baseline_engine):
+    applied = migrations.upgrade(baseline_engine)
+
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS if version > 1]
+    assert migrations.applied_versions(baseline_engine) == {version for version, _, _ in migrations.MIGRATIONS}
+    assert migrations.upgrade(baseline_engine) == []
+
+
+def test_upgrade_keeps_existing_rows(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    with baseline_engine.connect() as conn:
+        order = conn.execute(text('SELECT user_id, stock_symbol, quantity, status FROM scheduled_orders')).all()
+        user = conn.execute(text('SELECT user_id, api_key FROM kite_users')).all()
+    assert [tuple(row) for row in order] == [(1, 'INFY', 5, 'pending')]
+    assert [tuple(row) for row in user] == [('AB1234', 'key')]
+
+
+def test_upgrade_is_a_no_op_once_current(engine):
+    assert migrations.upgrade(engine) == []
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+
+import clock
+import migrations
+from conftest import add_order, add_user, columns
+from models import ScheduledOrder, ScheduledOrderBulkAudit, ScheduledOrderLog
+from order_actions import OrderFilterError, cancel_pending_orders, parse_filters, reschedule_pending_orders
+
+orders = ScheduledOrder.__table__
+logs = ScheduledOrderLog.__table__
+
+
+@pytest.fixture
+def session(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def book(engine):
+    """Orders of two users on one bulk audit, plus one order outside it: ``{name: id}``."""
+    later = clock.now_ist().replace(microsecond=123456) + timedelta(hours=1)
+    with engine.begin() as conn:
+        first, second = add_user(conn, 1), add_user(conn, 2)
+        audit = conn.execute(insert(ScheduledOrderBulkAudit.__table__).values(
+            stock_symbol='INFY', quantity=1, order_type='buy', scheduled_time=later,
+            users_targeted=2, users_created=2)).inserted_primary_key[0]
+        return {
+            'audit': audit,
+            'first': add_order(conn, first, bulk_audit_id=audit, scheduled_time=later),
+            'second': add_order(conn, second, bulk_audit_id=audit, scheduled_time=later),
+            'armed': add_order(conn, second, bulk_audit_id=audit, scheduled_time=later, status='armed'),
+            'done': add_order(conn, first, bulk_audit_id=audit, scheduled_time=later, status='completed'),
+            'other': add_order(conn, first, stock_symbol='TCS', scheduled_time=later),
+        }
+
+
+def _orders(engine):
+    with engine.connect() as conn:
+        return {row.id: row for row in conn.execute(select(orders))}
+
+
+def _logs(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(select(logs.c.scheduled_order_id, logs.c.status).order_by(logs.c.id))
+        return [tuple(row) for row in rows]
+
+
+def test_parse_filters():
+    assert parse_filters({'bulk_audit_id': '7', 'stock_symbol': ' infy ', 'scheduled_from': '2026-10-19T09:30'}) == {
+        'bulk_audit_id': 7, 'stock_symbol': 'INFY', 'scheduled_from': datetime(2026, 10, 19, 9, 30)}
+    with pytest.raises(OrderFilterError, match='at least one of'):
+        parse_filters({})
+    with pytest.raises(OrderFilterError, match='user_id must be an integer'):
+        parse_filters({'user_id': 'U1'})
+    with pytest.raises(OrderFilterError, match='ISO format'):
+        parse_filters({'scheduled_to': 'tomorrow'})
+
+
+def test_cancel_hits_pending_and_armed_orders_of_the_audit_only(engine, session, book):
+    cancelled = cancel_pending_orders(session, {'bulk_audit_id': book['audit']}, 'market closed')
+
+    assert sorted(cancelled) == sorted([book['first'], book['second'], book['armed']])
+    rows = _orders(engine)
+    assert {rows[i].status for i in cancelled} == {'cancelled'}
+    assert rows[book['done']].status == 'completed'
+    assert rows[book['other']].status == 'pending'
+    assert sorted(_logs(engine)) == sorted((i, 'cancelled') for i in cancelled)
+
+
+def test_cancel_by_user_and_symbol(engine, session, book):
+    assert cancel_pending_orders(session, {'user_id': 1, 'stock_symbol': 'TCS'}) == [book['other']]
+
+
+def test_reschedule_to_a_new_time(engine, session, book):
+    target = clock.now_ist().replace(microsecond=0) + timedelta(hours=2)
+
+    moved = reschedule_pending_orders(session, {'bulk_audit_id': book['audit']}, new_time=target)
+
+    assert sorted(moved) == [book['first'], book['second']]
+    rows = _orders(engine)
+    assert {rows[i].scheduled_time for i in moved} == {target}
+    assert rows[book['armed']].scheduled_time != target
+    assert sorted(_logs(engine)) == [(book['first'], 'rescheduled'), (book['second'], 'rescheduled')]
+
+
+def test_shift_moves_each_order_in_sql_and_keeps_microseconds(engine, session, book):
+    before = _orders(engine)
+
+    moved = reschedule_pending_orders(session, {'user_id': 1}, shift=timedelta(minutes=-30))
+
+    assert sorted(moved) == [book['first'], book['other']]
+    after = _orders(engine)
+    for order_id in moved:
+        assert after[order_id].scheduled_time == before[order_id].scheduled_time - timedelta(minutes=30)
+        assert after[order_id].scheduled_time.microsecond == 123456
+        assert after[order_id].dispatch_position is None
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'new_time': datetime(2020, 1, 1, 9, 30)},
+    {'shift': timedelta(hours=-2)},
+])
+def test_reschedule_into_the_past_changes_nothing(engine, session, book, kwargs):
+    before = _orders(engine)
+
+    with pytest.raises(OrderFilterError, match='into the past'):
+        reschedule_pending_orders(session, {'bulk_audit_id': book['audit']}, **kwargs)
+
+    assert _orders(engine) == before
+    assert _logs(engine) == []
+
+
+def test_reschedule_needs_exactly_one_target(session, book):
+    with pytest.raises(OrderFilterError, match='exactly one of'):
+        reschedule_pending_orders(session, {'bulk_audit_id': book['audit']})
+
+
+def test_migration_links_orders_to_their_bulk_audit(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert 'bulk_audit_id' in columns(baseline_engine, 'scheduled_orders')
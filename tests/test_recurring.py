@@ -0,0 +1,163 @@
+import os
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert, select
+
+import migrations
+import recurring
+from app import create_app
+from conftest import add_user, columns
+from models import RecurringSchedule, ScheduledOrder, ScheduledOrderBulkAudit, ScheduledOrderLog
+from recurring import (HolidayCalendar, RecurringScheduleError, materialize_due, next_occurrence, occurrence_on,
+                       parse_schedule, require_calendar)
+
+MONDAY = date(2031, 3, 3)
+HOLIDAY = date(2031, 3, 4)
+
+
+@pytest.fixture
+def client():
+    return create_app(mode='web').test_client()
+
+
+@pytest.fixture
+def holidays(tmp_path, monkeypatch):
+    path = tmp_path / 'holidays.txt'
+    path.write_text(f'# NSE 2031\n{HOLIDAY.isoformat()} Mahashivratri\nnot-a-date\n\n2031-12-25  # Christmas\n')
+    calendar = HolidayCalendar(str(path))
+    monkeypatch.setattr(recurring, 'holidays', calendar)
+    monkeypatch.setattr(recurring, '_uncovered_years', set())
+    return calendar
+
+
+def schedule(weekdays='0,1,2,3,4', at=time(9, 30), last_materialized_on=None):
+    return SimpleNamespace(weekdays=weekdays, time_of_day=at, last_materialized_on=last_materialized_on)
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/recurring', {'stock_symbol': 'INFY', 'quantity': 1, 'order_type': 'buy'}),
+    ('/recurring/1/active', {'active': True}),
+])
+def test_recurring_writes_require_an_admin(client, path, body):
+    response = client.post(path, json=body)
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/admin/login')
+
+
+def test_admin_cannot_create_a_schedule_without_the_years_holidays(client, monkeypatch):
+    monkeypatch.setattr(recurring, 'holidays', HolidayCalendar(None))
+    with client.session_transaction() as session:
+        session['admin_id'] = 1
+
+    response = client.post('/recurring', json={
+        'stock_symbol': 'INFY', 'quantity': 1, 'order_type': 'buy', 'time_of_day': '09:30', 'weekdays': [0]})
+
+    assert response.status_code == 400
+    assert 'holiday calendar' in response.get_json()['error']
+
+
+def test_calendar_reads_dates_skips_bad_lines_and_reloads_on_change(holidays):
+    assert holidays.dates() == {HOLIDAY, date(2031, 12, 25)}
+    assert holidays.covers(2031) and not holidays.covers(2032)
+
+    with open(holidays.path, 'a') as fh:
+        fh.write('2032-01-26\n')
+    stat = os.stat(holidays.path)
+    os.utime(holidays.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert holidays.covers(2032)
+    require_calendar(2032)
+    with pytest.raises(RecurringScheduleError, match='no 2033 dates'):
+        require_calendar(2033)
+
+
+def test_occurrences_skip_holidays_weekends_and_materialized_days(holidays):
+    assert occurrence_on(schedule(), MONDAY) == datetime(2031, 3, 3, 9, 30)
+    assert occurrence_on(schedule(), HOLIDAY) is None
+    assert occurrence_on(schedule(), date(2031, 3, 8)) is None
+
+    assert next_occurrence(schedule(), datetime(2031, 3, 3, 10)) == datetime(2031, 3, 5, 9, 30)
+    assert next_occurrence(schedule(last_materialized_on=date(2031, 3, 5)), datetime(2031, 3, 3, 8)) \
+        == datetime(2031, 3, 6, 9, 30)
+    assert next_occurrence(schedule(weekdays='5'), datetime(2031, 3, 3), horizon_days=3) is None
+
+
+@pytest.mark.parametrize('data, error', [
+    ({'stock_symbol': 'NOPE'}, 'Invalid stock symbol'),
+    ({'quantity': 0}, 'quantity must be positive'),
+    ({'order_type': 'hold'}, 'buy or sell'),
+    ({'time_of_day': '16:00'}, 'between 09:30 and 15:30'),
+    ({'weekdays': '7'}, 'weekdays must be'),
+    ({'user_ids': 'a'}, 'user_ids must be integers'),
+])
+def test_parse_schedule_rejects_invalid_fields(data, error):
+    values = {'stock_symbol': 'INFY', 'quantity': 1, 'order_type': 'buy', 'time_of_day': '09:30', 'weekdays': [0]}
+    values.update(data)
+    with pytest.raises(RecurringScheduleError, match=error):
+        parse_schedule(values, {'INFY'})
+
+
+def _add_schedule(engine, **values):
+    row = dict(weekdays='0,1,2,3,4', time_of_day=time(9, 30), stock_symbol='INFY', quantity=3, order_type='buy',
+               priority=2, active=True)
+    row.update(values)
+    with engine.begin() as conn:
+        return conn.execute(insert(RecurringSchedule.__table__).values(**row)).inserted_primary_key[0]
+
+
+def test_materialize_creates_orders_for_eligible_users_once(engine, holidays):
+    with engine.begin() as conn:
+        eligible = [add_user(conn, 1), add_user(conn, 2)]
+        add_user(conn, 3, valid_token=False)
+    schedule_id = _add_schedule(engine)
+    just_before = datetime(2031, 3, 3, 9, 29)
+
+    assert materialize_due(engine, datetime(2031, 3, 3, 9, 20)) == []
+    [audit_id] = materialize_due(engine, just_before)
+    assert materialize_due(engine, just_before + timedelta(seconds=30)) == []
+
+    orders = ScheduledOrder.__table__
+    with engine.connect() as conn:
+        created = conn.execute(select(orders.c.user_id, orders.c.scheduled_time, orders.c.status, orders.c.priority)
+                               .where(orders.c.bulk_audit_id == audit_id).order_by(orders.c.user_id)).all()
+        audit = conn.execute(select(ScheduledOrderBulkAudit.__table__).where(
+            ScheduledOrderBulkAudit.__table__.c.id == audit_id)).one()
+        logs = conn.execute(select(ScheduledOrderLog.__table__.c.status)).scalars().all()
+        materialized_on = conn.execute(select(RecurringSchedule.__table__.c.last_materialized_on)).scalar()
+    assert [tuple(row) for row in created] == [(uid, datetime(2031, 3, 3, 9, 30), 'pending', 2) for uid in eligible]
+    assert (audit.initiator, audit.users_targeted, audit.users_created) == (f'recurring:{schedule_id}', 2, 2)
+    assert logs == ['scheduled', 'scheduled']
+    assert materialized_on == MONDAY
+
+
+def test_materialize_targets_only_the_listed_users(engine, holidays):
+    with engine.begin() as conn:
+        first = add_user(conn, 1)
+        add_user(conn, 2)
+    _add_schedule(engine, user_ids=str(first))
+
+    assert len(materialize_due(engine, datetime(2031, 3, 3, 9, 29))) == 1
+
+    with engine.connect() as conn:
+        users = conn.execute(select(ScheduledOrder.__table__.c.user_id)).scalars().all()
+    assert users == [first]
+
+
+def test_materialize_skips_holidays_and_years_the_calendar_does_not_cover(engine, holidays):
+    with engine.begin() as conn:
+        add_user(conn, 1)
+    _add_schedule(engine)
+
+    assert materialize_due(engine, datetime(2031, 3, 4, 9, 29)) == []
+    assert materialize_due(engine, datetime(2032, 3, 1, 9, 29)) == []
+    assert recurring._uncovered_years == {2032}
+
+
+def test_migration_adds_recurring_schedules(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert {'weekdays', 'time_of_day', 'user_ids', 'last_materialized_on'} \
+        <= columns(baseline_engine, 'recurring_schedules')
@@ -0,0 +1,41 @@
+from sharded_dispatch import ShardedDispatcher, shard_for
+
+
+def test_shard_for_spreads_users_by_modulo():
+    assert [shard_for(user_id, 3) for user_id in range(7)] == [0, 1, 2, 0, 1, 2, 0]
+
+
+def test_split_keeps_each_users_units_on_one_shard_in_order():
+    dispatcher = ShardedDispatcher('sqlite://', processes=2, threads_per_process=1)
+    units = [((1,), 1), ((2, 3), 2), ((4,), 3), ((5,), 2)]
+
+    assert dispatcher.split(units) == [[(2, 3), (5,)], [(1,), (4,)]]
+
+
+class FakeProcess:
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+def test_respawning_a_dead_shard_drops_its_in_flight_count(monkeypatch):
+    dispatcher = ShardedDispatcher('sqlite://', processes=2, threads_per_process=1)
+    spawned = []
+
+    def spawn(shard):
+        spawned.append(shard)
+        return FakeProcess(), dispatcher._ctx.SimpleQueue(), dispatcher._ctx.Value('i', 0)
+    monkeypatch.setattr(dispatcher, '_spawn', spawn)
+    dispatcher.start()
+
+    dispatcher.dispatch([((1,), 1), ((2, 3), 2), ((4,), 4)])
+    assert dispatcher.in_flight() == 4
+
+    dispatcher._workers[0].alive = False
+    dispatcher.dispatch([((5,), 6)])
+
+    assert spawned == [0, 1, 0]
+    # shard 1's order is still running; shard 0's lost orders no longer count
+    assert dispatcher.in_flight() == 2
@@ -0,0 +1,110 @@
+from collections import Counter
+
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+
+import migrations
+import scheduler
+import slicing
+from change_tracking import read_versions
+from conftest import add_order, add_user, columns
+from models import Instrument, ScheduledOrder, ScheduledOrderLog
+from slicing import SliceError, max_slice_quantity, parent_status, plan_slices
+
+
+def test_max_slice_quantity_stays_below_the_freeze_limit():
+    assert max_slice_quantity(None, 1800) == 1799
+    assert max_slice_quantity(50, 1800) == 1750
+    assert max_slice_quantity(50, 1750) == 1700
+    assert max_slice_quantity(50, 40) == 0
+
+
+def test_plan_slices_fills_full_slices_then_the_remainder():
+    assert plan_slices(3600, 50, 1800) == [1750, 1750, 100]
+    assert plan_slices(1750, 50, 1800) == [1750]
+    assert plan_slices(4000, None, 1800) == [1799, 1799, 402]
+
+
+def test_plan_slices_rejects_a_quantity_off_the_lot_size():
+    with pytest.raises(SliceError, match='multiple of the lot size'):
+        plan_slices(125, 50, 1800)
+
+
+def test_plan_slices_rejects_a_freeze_below_the_lot_size():
+    with pytest.raises(SliceError, match='smaller than the lot size'):
+        plan_slices(100, 50, 40)
+
+
+def test_plan_slices_caps_the_number_of_slices(monkeypatch):
+    monkeypatch.setattr(slicing, 'MAX_SLICES', 3)
+    assert len(plan_slices(30, 1, 11)) == 3
+    with pytest.raises(SliceError, match='at most 3'):
+        plan_slices(31, 1, 11)
+
+
+@pytest.mark.parametrize('statuses, expected', [
+    (Counter(completed=3), 'completed'),
+    (Counter(completed=2, failed=1), 'partial'),
+    (Counter(completed=1, cancelled=2), 'partial'),
+    (Counter(failed=1, cancelled=2), 'failed'),
+])
+def test_parent_status(statuses, expected):
+    assert parent_status(statuses) == expected
+
+
+def test_recover_interrupted_settles_children_and_parent(engine):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        parent = add_order(conn, user, quantity=3000, status='processing')
+        children = [
+            add_order(conn, user, quantity=1000, status=status, parent_order_id=parent, slice_index=index)
+            for index, status in enumerate(['completed', 'processing', 'processing'])
+        ]
+
+    assert slicing.recover_interrupted(engine) == Counter(interrupted=1, cancelled=1, parents=1)
+
+    orders = ScheduledOrder.__table__
+    logs = ScheduledOrderLog.__table__
+    with engine.connect() as conn:
+        statuses = dict(conn.execute(select(orders.c.id, orders.c.status)).all())
+        log_statuses = dict(conn.execute(select(logs.c.scheduled_order_id, logs.c.status)).all())
+    assert statuses == {parent: 'partial', children[0]: 'completed',
+                        children[1]: 'failed', children[2]: 'cancelled'}
+    assert log_statuses == {parent: 'partial', children[1]: 'interrupted', children[2]: 'cancelled'}
+
+    assert slicing.recover_interrupted(engine) == Counter()
+
+
+def test_place_order_streams_slices_off_the_caller_and_publishes_them(engine, monkeypatch):
+    with engine.begin() as conn:
+        user = add_user(conn, 1)
+        order_id = add_order(conn, user, quantity=250)
+        conn.execute(insert(Instrument.__table__).values(tradingsymbol='INFY', lot_size=1, freeze_qty=100))
+        before = read_versions(conn, ['orders', 'logs'])
+    streams = []
+    submit = slicing.submit_sliced
+    monkeypatch.setattr(slicing, 'submit_sliced', lambda *args, **kwargs: streams.append(submit(*args, **kwargs)))
+
+    session = sessionmaker(bind=engine)()
+    try:
+        res = scheduler.place_order(session, session.get(ScheduledOrder, order_id))
+    finally:
+        session.close()
+
+    assert res == {'status': 'sliced', 'order_status': 'processing'}
+    assert streams[0].result(timeout=10)['order_status'] == 'completed'
+    orders = ScheduledOrder.__table__
+    with engine.connect() as conn:
+        children = conn.execute(select(orders.c.quantity).where(orders.c.parent_order_id == order_id)).scalars().all()
+        after = read_versions(conn, ['orders', 'logs'])
+    assert children == [99, 99, 52]
+    # no VersionPublisher runs here, so the stream bumps what it wrote itself
+    assert all(after[name][0] > before[name][0] for name in ('orders', 'logs'))
+
+
+def test_migration_adds_instruments_and_slice_columns(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert {'parent_order_id', 'slice_index'} <= columns(baseline_engine, 'scheduled_orders')
+    assert {'tradingsymbol', 'lot_size', 'freeze_qty'} <= columns(baseline_engine, 'instruments')
@@ -0,0 +1,86 @@
+import pytest
+
+import migrations
+from conftest import columns
+from trigger_orders import TriggerError, parse_trigger
+from triggers import ReplayTickSource, TriggerIndex
+
+
+@pytest.fixture
+def index():
+    index = TriggerIndex()
+    index.rebuild([
+        (1, 'INFY', 1500.0, 'above'),
+        (2, 'INFY', 1510.0, 'above'),
+        (3, 'INFY', 1490.0, 'below'),
+        (4, 'INFY', 1480.0, 'below'),
+        (5, 'TCS', 3500.0, 'above'),
+    ])
+    return index
+
+
+def _match(index, symbol, low, high):
+    above, below = index.match(symbol, low, high)
+    return sorted(above.tolist()), sorted(below.tolist())
+
+
+def test_match_fires_thresholds_crossed_by_the_range(index):
+    assert _match(index, 'INFY', 1495.0, 1505.0) == ([1], [])
+    assert _match(index, 'INFY', 1485.0, 1495.0) == ([], [3])
+    assert len(index) == 3
+
+
+def test_match_is_inclusive_at_the_threshold(index):
+    assert _match(index, 'INFY', 1510.0, 1510.0) == ([1, 2], [])
+    assert _match(index, 'INFY', 1480.0, 1480.0) == ([], [3, 4])
+
+
+def test_matched_triggers_are_removed(index):
+    assert _match(index, 'TCS', 3600.0, 3600.0) == ([5], [])
+    assert _match(index, 'TCS', 3600.0, 3600.0) == ([], [])
+    assert index.symbols == ['INFY']
+
+
+def test_match_on_an_unknown_symbol_is_empty(index):
+    assert _match(index, 'WIPRO', 1.0, 1e9) == ([], [])
+    assert len(index) == 5
+
+
+def test_replay_resumes_after_the_last_batch(tmp_path):
+    path = tmp_path / 'ticks.csv'
+    path.write_text('symbol,price,timestamp\n'
+                    'INFY,1500,1\nTCS,3500,1\n'
+                    'INFY,oops,2\n'
+                    'INFY,1501,3\n'
+                    'INFY,1502,4\n')
+    source = ReplayTickSource(str(path), speed=0)
+
+    batches = source.batches()
+    assert next(batches) == [('INFY', 1500.0), ('TCS', 3500.0)]
+    assert next(batches) == [('INFY', 1501.0)]
+    batches.close()
+
+    assert list(source.batches()) == [[('INFY', 1502.0)]]
+    assert list(source.batches()) == []
+
+
+def test_parse_trigger():
+    assert parse_trigger({}) == (None, None)
+    assert parse_trigger({'trigger_price': '1500.5', 'trigger_direction': 'Above'}) == (1500.5, 'above')
+    for data, error in [
+        ({'trigger_price': 'x', 'trigger_direction': 'above'}, 'must be a number'),
+        ({'trigger_price': '0', 'trigger_direction': 'above'}, 'must be positive'),
+        ({'trigger_price': 'nan', 'trigger_direction': 'above'}, 'must be a finite number'),
+        ({'trigger_price': 'inf', 'trigger_direction': 'below'}, 'must be a finite number'),
+        ({'trigger_price': float('-inf'), 'trigger_direction': 'below'}, 'must be a finite number'),
+        ({'trigger_price': '10', 'trigger_direction': 'sideways'}, 'above or below'),
+    ]:
+        with pytest.raises(TriggerError, match=error):
+            parse_trigger(data)
+
+
+def test_migration_adds_trigger_columns(baseline_engine):
+    migrations.upgrade(baseline_engine)
+
+    assert {'trigger_price', 'trigger_direction'} <= columns(baseline_engine, 'scheduled_orders')
+    assert 'instrument_token' in columns(baseline_engine, 'instruments')
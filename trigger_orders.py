@@ -0,0 +1,32 @@
+"""Validation of price-trigger fields on new orders.
+
+Kept apart from triggers.py so the web process can validate ``trigger_price``
+and ``trigger_direction`` without loading NumPy, which only the scheduler's
+trigger engine needs.
+"""
+import math
+
+DIRECTIONS = ('above', 'below')
+
+
+class TriggerError(ValueError):
+    pass
+
+
+def parse_trigger(data) -> tuple:
+    """``(trigger_price, trigger_direction)`` from request data, or ``(None, None)`` for a time-only order."""
+    price = data.get('trigger_price')
+    if price in (None, ''):
+        return None, None
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise TriggerError('trigger_price must be a number')
+    if not math.isfinite(price):
+        raise TriggerError('trigger_price must be a finite number')
+    if price <= 0:
+        raise TriggerError('trigger_price must be positive')
+    direction = (data.get('trigger_direction') or '').lower()
+    if direction not in DIRECTIONS:
+        raise TriggerError('trigger_direction must be above or below')
+    return price, direction
@@ -0,0 +1,405 @@
+"""Price-triggered orders: fire when a symbol's last traded price crosses a threshold.
+
+An order created with ``trigger_price`` and ``trigger_direction`` ('above' fires
+when LTP >= price, 'below' when LTP <= price) is stored with status ``armed``.
+The scheduler process runs a :class:`TriggerEngine` that keeps every armed
+threshold in per-symbol NumPy arrays sorted by price. Each batch of ticks is
+reduced to one high/low per symbol. The crossed triggers on each side are then
+a single ``searchsorted`` and a slice, whatever the number of armed orders.
+
+Firing hands the orders to the normal dispatch path. One conditional UPDATE
+flips them from ``armed`` to ``pending``, with ``scheduled_time`` set to now, so
+they form one burst for fair ordering. The dispatcher is then woken. The index
+is rebuilt from the database whenever the orders version moves, checked at most
+every ``TRIGGER_REFRESH_SECONDS``, so new and cancelled triggers are picked up
+without a query per tick.
+
+Ticks come from a pluggable source (``TICK_SOURCE``): ``kite`` streams LTPs
+through KiteTicker, ``replay:<path>`` reads a CSV file for tests and rehearsals.
+"""
+import csv
+import itertools
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import bindparam, insert, select, update
+
+import clock
+from change_tracking import bump, read_versions
+from config import TICK_FEED_USER_ID, TICK_REPLAY_SPEED, TRIGGER_REFRESH_SECONDS
+from models import Instrument, KiteUser, ScheduledOrder, ScheduledOrderLog
+from trigger_orders import DIRECTIONS, TriggerError, parse_trigger  # noqa: F401 (re-exported)
+
+logger = logging.getLogger(__name__)
+
+_orders = ScheduledOrder.__table__
+_logs = ScheduledOrderLog.__table__
+_instruments = Instrument.__table__
+_users = KiteUser.__table__
+
+
+def _empty():
+    # numpy is imported on first use, so only the process running the trigger engine loads it
+    import numpy as np
+    return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64)
+
+
+class _SymbolTriggers:
+    """Armed thresholds for one symbol, each side sorted ascending by price."""
+    __slots__ = ('above_prices', 'above_ids', 'below_prices', 'below_ids')
+
+    def __init__(self, above: list, below: list):
+        self.above_prices, self.above_ids = self._sorted(above)
+        self.below_prices, self.below_ids = self._sorted(below)
+
+    @staticmethod
+    def _sorted(pairs: list):
+        import numpy as np
+        if not pairs:
+            return _empty()
+        prices = np.fromiter((p for p, _ in pairs), dtype=np.float64, count=len(pairs))
+        ids = np.fromiter((i for _, i in pairs), dtype=np.int64, count=len(pairs))
+        order = np.argsort(prices, kind='stable')
+        return prices[order], ids[order]
+
+    def __len__(self):
+        return len(self.above_ids) + len(self.below_ids)
+
+
+class TriggerIndex:
+    """Per-symbol sorted threshold arrays; :meth:`match` removes and returns crossed order ids."""
+
+    def __init__(self):
+        self._symbols = {}
+
+    def __len__(self):
+        return sum(len(entry) for entry in self._symbols.values())
+
+    @property
+    def symbols(self) -> list:
+        return sorted(self._symbols)
+
+    def rebuild(self, rows: Iterable):
+        """Replace the index with ``(order_id, symbol, trigger_price, direction)`` rows."""
+        grouped = {}
+        for order_id, symbol, price, direction in rows:
+            sides = grouped.setdefault(symbol, ([], []))
+            sides[0 if direction == 'above' else 1].append((price, order_id))
+        self._symbols = {symbol: _SymbolTriggers(above, below) for symbol, (above, below) in grouped.items()}
+
+    def match(self, symbol: str, low: float, high: float) -> tuple:
+        """``(above_ids, below_ids)`` crossed by prices in ``[low, high]``; they are removed from the index."""
+        import numpy as np
+        entry = self._symbols.get(symbol)
+        if entry is None:
+            empty_ids = _empty()[1]
+            return empty_ids, empty_ids
+        # 'above' fires for every threshold <= high: a prefix of the ascending array
+        k = np.searchsorted(entry.above_prices, high, side='right')
+        fired_above = entry.above_ids[:k]
+        entry.above_prices, entry.above_ids = entry.above_prices[k:], entry.above_ids[k:]
+        # 'below' fires for every threshold >= low: a suffix
+        j = np.searchsorted(entry.below_prices, low, side='left')
+        fired_below = entry.below_ids[j:]
+        entry.below_prices, entry.below_ids = entry.below_prices[:j], entry.below_ids[:j]
+        if not len(entry):
+            del self._symbols[symbol]
+        return fired_above, fired_below
+
+
+class TickSource:
+    """Yields batches of ``(symbol, price)`` ticks; ``subscribe`` narrows a live feed.
+
+    Calling ``batches`` again after a failure resumes the feed where it stopped.
+    """
+
+    def batches(self) -> Iterator[list]:
+        raise NotImplementedError
+
+    def subscribe(self, symbols: list):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReplayTickSource(TickSource):
+    """Ticks from a CSV file with ``symbol``, ``price`` and optional ``timestamp`` columns.
+
+    Consecutive rows with the same timestamp form one batch (rows without a
+    timestamp are one batch each). ``speed`` 0 replays as fast as possible,
+    1 in real time, 10 ten times faster.
+    """
+
+    def __init__(self, path: str, speed: float = TICK_REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+        # rows already handed out in batches; a new batches() call resumes after them
+        self._consumed = 0
+        self._closed = threading.Event()
+
+    @staticmethod
+    def _timestamp(value: str) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return datetime.fromisoformat(value).timestamp()
+
+    def batches(self) -> Iterator[list]:
+        batch, batch_ts, previous_ts = [], None, None
+        start = end = self._consumed
+        with open(self.path, newline='') as fh:
+            for line, row in enumerate(itertools.islice(csv.DictReader(fh), start, None), start):
+                if self._closed.is_set():
+                    return
+                end = line + 1
+                try:
+                    ts = self._timestamp((row.get('timestamp') or '').strip())
+                    tick = (row['symbol'].strip().upper(), float(row['price']))
+                except (KeyError, AttributeError, ValueError):
+                    logger.warning('Skipping invalid tick row %r in %s', row, self.path)
+                    continue
+                if batch and (ts is None or ts != batch_ts):
+                    self._consumed = line
+                    yield batch
+                    batch = []
+                if ts is not None and previous_ts is not None and self.speed > 0 and ts > previous_ts:
+                    self._closed.wait((ts - previous_ts) / self.speed)
+                batch.append(tick)
+                batch_ts = previous_ts = ts if ts is not None else previous_ts
+                if ts is None:
+                    self._consumed = line + 1
+                    yield batch
+                    batch = []
+        self._consumed = end
+        if batch:
+            yield batch
+
+    def close(self):
+        self._closed.set()
+
+
+class KiteTickerSource(TickSource):
+    """LTP ticks from KiteTicker for the instruments with an ``instrument_token``."""
+
+    def __init__(self, api_key: str, access_token: str, tokens: dict):
+        self.api_key = api_key
+        self.access_token = access_token
+        self.tokens = tokens  # tradingsymbol -> instrument_token
+        self._symbol_of = {token: symbol for symbol, token in tokens.items()}
+        self._queue = queue.Queue()
+        self._subscribed = set()
+        self._ticker = None
+        self._closed = threading.Event()
+
+    def _on_ticks(self, ws, ticks):
+        batch = [(self._symbol_of[t['instrument_token']], t['last_price'])
+                 for t in ticks if t.get('instrument_token') in self._symbol_of and t.get('last_price')]
+        if batch:
+            self._queue.put(batch)
+
+    def _on_connect(self, ws, response):
+        if self._subscribed:
+            tokens = list(self._subscribed)
+            ws.subscribe(tokens)
+            ws.set_mode(ws.MODE_LTP, tokens)
+
+    def subscribe(self, symbols: list):
+        wanted = {self.tokens[s] for s in symbols if s in self.tokens}
+        missing = [s for s in symbols if s not in self.tokens]
+        if missing:
+            logger.warning('No instrument_token for %s; their triggers cannot fire', ', '.join(missing))
+        added, removed = wanted - self._subscribed, self._subscribed - wanted
+        self._subscribed = wanted
+        ticker = self._ticker
+        if ticker is None or not ticker.is_connected():
+            return
+        if removed:
+            ticker.unsubscribe(list(removed))
+        if added:
+            ticker.subscribe(list(added))
+            ticker.set_mode(ticker.MODE_LTP, list(added))
+
+    def batches(self) -> Iterator[list]:
+        if self._ticker is None:
+            # opened once; KiteTicker reconnects by itself, and a later call resumes on the same queue
+            from kiteconnect import KiteTicker
+            self._ticker = KiteTicker(self.api_key, self.access_token)
+            self._ticker.on_ticks = self._on_ticks
+            self._ticker.on_connect = self._on_connect
+            self._ticker.connect(threaded=True)
+        while not self._closed.is_set():
+            try:
+                yield self._queue.get(timeout=1.0)
+            except queue.Empty:
+                yield []
+
+    def close(self):
+        self._closed.set()
+        if self._ticker is not None:
+            try:
+                self._ticker.close()
+            except Exception:
+                logger.exception('Failed to close KiteTicker')
+
+
+def make_tick_source(spec: str, engine) -> Optional[TickSource]:
+    """Build the source named by ``TICK_SOURCE``: '' (off), 'kite' or 'replay:<path>'."""
+    if not spec:
+        return None
+    if spec.startswith('replay:'):
+        return ReplayTickSource(spec[len('replay:'):])
+    if spec == 'kite':
+        now_utc = clock.utcnow()
+        query = select(_users.c.api_key, _users.c.access_token).where(
+            _users.c.access_token.isnot(None), _users.c.token_expiry > now_utc,
+        )
+        if TICK_FEED_USER_ID:
+            query = query.where(_users.c.id == TICK_FEED_USER_ID)
+        with engine.connect() as conn:
+            user = conn.execute(query.order_by(_users.c.id).limit(1)).first()
+            tokens = dict(conn.execute(
+                select(_instruments.c.tradingsymbol, _instruments.c.instrument_token)
+                .where(_instruments.c.instrument_token.isnot(None))
+            ).all())
+        if user is None:
+            raise TriggerError('no user with a valid access token to open the tick feed')
+        return KiteTickerSource(user.api_key, user.access_token, tokens)
+    raise TriggerError(f'unknown TICK_SOURCE {spec!r}')
+
+
+SELECT_ARMED = select(
+    _orders.c.id, _orders.c.stock_symbol, _orders.c.trigger_price, _orders.c.trigger_direction,
+).where(_orders.c.status == 'armed')
+
+# armed -> pending; the status guard skips orders cancelled since the last refresh
+FIRE_TRIGGERS = (
+    update(_orders)
+    .where(_orders.c.id.in_(bindparam('ids', expanding=True)), _orders.c.status == 'armed')
+    .values(status='pending', scheduled_time=bindparam('now'), dispatch_position=None,
+            updated_at=bindparam('updated_at'))
+    .returning(_orders.c.id, _orders.c.user_id, _orders.c.trigger_direction, _orders.c.trigger_price)
+)
+
+
+def fire_triggers(conn, fired: list, now_ist: datetime) -> list:
+    """Release ``[(order_id, symbol, price)]`` to the dispatcher; returns the ids actually released."""
+    price_of = {order_id: (symbol, price) for order_id, symbol, price in fired}
+    rows = conn.execute(FIRE_TRIGGERS, {
+        'ids': list(price_of), 'now': now_ist, 'updated_at': clock.utcnow(),
+    }).all()
+    if not rows:
+        return []
+    conn.execute(insert(_logs), [
+        {
+            'scheduled_order_id': row.id,
+            'user_id': row.user_id,
+            'status': 'triggered',
+            'message': f'{price_of[row.id][0]} LTP {price_of[row.id][1]} crossed {row.trigger_direction} '
+                       f'{row.trigger_price}',
+        }
+        for row in rows
+    ])
+    bump(conn, 'orders', 'logs')
+    return [row.id for row in rows]
+
+
+class TriggerEngine:
+    """Background thread evaluating ticks against the armed-trigger index."""
+
+    def __init__(self, engine, source: TickSource, on_fire=None, refresh_seconds: float = TRIGGER_REFRESH_SECONDS):
+        self.engine = engine
+        self.source = source
+        self.on_fire = on_fire
+        self.refresh_seconds = refresh_seconds
+        self.index = TriggerIndex()
+        self.ticks = 0
+        self.fired = 0
+        self._version = None
+        self._checked_at = 0.0
+        # set when a failed batch may have left the index without triggers that never fired
+        self._reload = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.refresh(force=True)
+        self._thread = threading.Thread(target=self._run, name='price-triggers', daemon=True)
+        self._thread.start()
+        logger.info('Price trigger engine started with %s armed triggers', len(self.index))
+
+    def stop(self):
+        self._stop.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def refresh(self, force: bool = False):
+        """Reload armed triggers if the orders version moved since the last load."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        with self.engine.connect() as conn:
+            version = read_versions(conn, ('orders',)).get('orders')
+            if not force and version == self._version:
+                return
+            self._version = version
+            self.index.rebuild(conn.execute(SELECT_ARMED))
+        self._reload = False
+        self.source.subscribe(self.index.symbols)
+
+    def process(self, batch: list) -> list:
+        """Evaluate one batch of ``(symbol, price)`` ticks; returns the fired order ids."""
+        self.ticks += len(batch)
+        ranges = {}
+        for symbol, price in batch:
+            low_high = ranges.get(symbol)
+            ranges[symbol] = (price, price) if low_high is None else (min(low_high[0], price), max(low_high[1], price))
+        fired = []
+        for symbol, (low, high) in ranges.items():
+            above, below = self.index.match(symbol, low, high)
+            fired.extend((order_id, symbol, high) for order_id in above.tolist())
+            fired.extend((order_id, symbol, low) for order_id in below.tolist())
+        if not fired:
+            return []
+        with self.engine.begin() as conn:
+            released = fire_triggers(conn, fired, clock.now_ist())
+        self.fired += len(released)
+        logger.info('Price triggers fired %s orders', len(released))
+        if released and self.on_fire is not None:
+            self.on_fire()
+        return released
+
+    def _run(self):
+        batches = None
+        while not self._stop.is_set():
+            try:
+                if batches is None:
+                    batches = self.source.batches()
+                batch = next(batches)
+            except StopIteration:
+                logger.info('Tick source exhausted after %s ticks; %s triggers fired', self.ticks, self.fired)
+                return
+            except Exception:
+                logger.exception('Tick source failed; resuming in 5s')
+                batches = None
+                self._stop.wait(5)
+                continue
+            if self._stop.is_set():
+                return
+            try:
+                self.refresh(force=self._reload)
+                if batch:
+                    self.process(batch)
+            except Exception:
+                # match() already took this batch's triggers out of the index; reload them from the database
+                logger.exception('Price trigger evaluation failed; reloading armed triggers in 5s')
+                self._reload = True
+                self._stop.wait(5)
@@ -1,6 +1,9 @@
 from app import create_app
+from config import APP_MODE
 
-app = create_app()
+# Gunicorn workers only serve HTTP; the scheduler runs in its own process
+# (run_scheduler.py). Set APP_MODE=all to keep the old single-process behaviour.
+app = create_app(mode=APP_MODE or 'web')
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    app.run()